@@ -5,6 +5,7 @@ from sqlalchemy import pool
 
 from alembic import context
 from app.models import Base
+from app.repositories.partitions import ORDER_PARTITION_RE
 from app.settings import settings
 
 # this is the Alembic Config object, which provides
@@ -30,6 +31,22 @@ target_metadata = Base.metadata
 # ... etc.
 
 
+# Месячные партиции orders / order_items создаются и отключаются в рантайме
+# (app.repositories.partitions), в моделях их нет. Autogenerate не сравнивает
+# ни сами партиции с их индексами, ни внешние ключи, которые PostgreSQL
+# клонирует на order_items для каждой партиции orders.
+def include_name(name, type_, parent_names) -> bool:
+    if type_ == "table":
+        return not ORDER_PARTITION_RE.match(name)
+    return True
+
+
+def include_object(object_, name, type_, reflected, compare_to) -> bool:
+    if type_ == "foreign_key_constraint":
+        return not ORDER_PARTITION_RE.match(object_.referred_table.name)
+    return True
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -48,6 +65,8 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_name=include_name,
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -68,7 +87,12 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_name=include_name,
+            include_object=include_object,
+        )
 
         with context.begin_transaction():
             context.run_migrations()
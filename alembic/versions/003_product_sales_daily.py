@@ -0,0 +1,224 @@
+"""003_product_sales_daily
+
+Revision ID: 003_product_sales_daily
+Revises: f8f09e93827b
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "003_product_sales_daily"
+down_revision: Union[str, Sequence[str], None] = "f8f09e93827b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+OLD_VIEW_NAME = "v_top5_products_last_30_days"
+MV_NAME = "mv_top_products_last_30_days"
+
+# Сколько позиций рейтинга хранится в материализованном представлении
+TOP_N = 100
+
+BACKFILL_SQL = """
+insert into product_sales_daily (product_id, day, sold_qty)
+select
+	oi.product_id,
+	(o.created_at at time zone 'UTC')::date as day,
+	SUM(oi.qty) as sold_qty
+from
+	order_items oi
+join orders o on
+	o.id = oi.order_id
+group by
+	oi.product_id,
+	day;
+"""
+
+MV_SQL = f"""
+CREATE MATERIALIZED VIEW {MV_NAME} as
+with recursive sales as (
+select
+	psd.product_id,
+	SUM(psd.sold_qty) as sold_qty
+from
+	product_sales_daily psd
+where
+	psd.day > (now() at time zone 'UTC')::date - 30
+group by
+	psd.product_id
+),
+top as (
+select
+	row_number() over (order by s.sold_qty desc, p.name, p.id) as rank,
+	p.id as product_id,
+	p.name as product_name,
+	p.category_id,
+	s.sold_qty
+from
+	sales s
+join products p on
+	p.id = s.product_id
+order by
+	rank
+limit {TOP_N}
+),
+cat_up as (
+select
+	c.id as start_cat_id,
+	c.id as cur_cat_id,
+	c.parent_id,
+	c.name
+from
+	categories c
+where
+	c.id in (select category_id from top)
+union all
+select
+	cu.start_cat_id,
+	p.id as cur_cat_id,
+	p.parent_id,
+	p.name
+from
+	cat_up cu
+join categories p on
+	p.id = cu.parent_id
+)
+select
+	t.rank,
+	t.product_id,
+	t.product_name,
+	cu.name as category_level1,
+	t.sold_qty::bigint as total_sold_qty
+from
+	top t
+join cat_up cu on
+	cu.start_cat_id = t.category_id
+	and cu.parent_id is null
+WITH DATA;
+"""
+
+OLD_VIEW_SQL = f"""
+CREATE OR REPLACE VIEW {OLD_VIEW_NAME} as
+with recursive sales as (
+select
+	oi.product_id,
+	SUM(oi.qty) as sold_qty
+from
+	order_items oi
+join orders o on
+	o.id = oi.order_id
+where
+	o.created_at >= now() - interval '30 days'
+group by
+	oi.product_id
+),
+start_cats as (
+select
+	distinct p.category_id
+from
+	products p
+join sales s on
+	s.product_id = p.id
+),
+cat_up as (
+select
+	sc.category_id as start_cat_id,
+	c.id as cur_cat_id,
+	c.parent_id,
+	c.name
+from
+	start_cats sc
+join categories c on
+	c.id = sc.category_id
+union all
+select
+	cu.start_cat_id,
+	p.id as cur_cat_id,
+	p.parent_id,
+	p.name
+from
+	cat_up cu
+join categories p on
+	p.id = cu.parent_id
+),
+root_cat as (
+select
+	start_cat_id,
+	cur_cat_id as root_category_id,
+	name as root_category_name
+from
+	cat_up
+where
+	parent_id is null
+)
+select
+	p.name as product_name,
+	rc.root_category_name as category_level1,
+	s.sold_qty as total_sold_qty
+from
+	sales s
+join products p on
+	p.id = s.product_id
+join root_cat rc on
+	rc.start_cat_id = p.category_id
+order by
+	s.sold_qty desc,
+	p.name
+limit 5;
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "product_sales_daily",
+        sa.Column("product_id", sa.BigInteger(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("sold_qty", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["product_id"], ["products.id"], ondelete="RESTRICT"),
+        sa.PrimaryKeyConstraint("day", "product_id"),
+    )
+    op.create_index(
+        "ix_product_sales_daily_product_id",
+        "product_sales_daily",
+        ["product_id"],
+        unique=False,
+    )
+    op.create_table(
+        "materialized_view_refreshes",
+        sa.Column("name", sa.Text(), nullable=False),
+        sa.Column(
+            "refreshed_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    op.execute(BACKFILL_SQL)
+
+    op.execute(f"DROP VIEW IF EXISTS {OLD_VIEW_NAME}")
+    op.execute(MV_SQL)
+    # Уникальный индекс обязателен для REFRESH MATERIALIZED VIEW CONCURRENTLY,
+    # INCLUDE позволяет отдавать топ index-only сканированием.
+    op.execute(
+        f"CREATE UNIQUE INDEX ux_{MV_NAME}_rank ON {MV_NAME} (rank) "
+        "INCLUDE (product_name, category_level1, total_sold_qty)"
+    )
+    op.execute(
+        f"insert into materialized_view_refreshes (name) values ('{MV_NAME}')"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(f"DROP MATERIALIZED VIEW IF EXISTS {MV_NAME}")
+    op.execute(OLD_VIEW_SQL)
+    op.drop_table("materialized_view_refreshes")
+    op.drop_index("ix_product_sales_daily_product_id", table_name="product_sales_daily")
+    op.drop_table("product_sales_daily")
@@ -0,0 +1,328 @@
+"""004_category_closure
+
+Revision ID: 004_category_closure
+Revises: 003_product_sales_daily
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "004_category_closure"
+down_revision: Union[str, Sequence[str], None] = "003_product_sales_daily"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MV_NAME = "mv_top_products_last_30_days"
+TOP_N = 100
+
+CLOSURE_FUNCTIONS_SQL = """
+create or replace function category_closure_after_insert() returns trigger
+language plpgsql as $$
+begin
+	insert into category_closure (ancestor_id, descendant_id, depth)
+	select cc.ancestor_id, new.id, cc.depth + 1
+	from category_closure cc
+	where cc.descendant_id = new.parent_id
+	union all
+	select new.id, new.id, 0;
+	return null;
+end;
+$$;
+
+create or replace function category_closure_after_update() returns trigger
+language plpgsql as $$
+declare
+	new_root_id bigint;
+begin
+	if new.parent_id is not distinct from old.parent_id then
+		return null;
+	end if;
+
+	if new.parent_id is not null and exists (
+		select 1 from category_closure
+		where ancestor_id = new.id and descendant_id = new.parent_id
+	) then
+		raise exception 'category % cannot be moved under its descendant %',
+			new.id, new.parent_id;
+	end if;
+
+	-- отрываем поддерево от прежних предков
+	delete from category_closure
+	where descendant_id in (
+		select descendant_id from category_closure where ancestor_id = new.id
+	)
+	and ancestor_id not in (
+		select descendant_id from category_closure where ancestor_id = new.id
+	);
+
+	-- подвешиваем поддерево к новым предкам
+	insert into category_closure (ancestor_id, descendant_id, depth)
+	select sup.ancestor_id, sub.descendant_id, sup.depth + sub.depth + 1
+	from category_closure sup
+	cross join category_closure sub
+	where sup.descendant_id = new.parent_id
+	and sub.ancestor_id = new.id;
+
+	select ancestor_id into new_root_id
+	from category_closure
+	where descendant_id = new.id
+	order by depth desc
+	limit 1;
+
+	update products p
+	set root_category_id = new_root_id
+	where p.category_id in (
+		select descendant_id from category_closure where ancestor_id = new.id
+	)
+	and p.root_category_id is distinct from new_root_id;
+
+	return null;
+end;
+$$;
+
+create or replace function products_set_root_category() returns trigger
+language plpgsql as $$
+begin
+	select cc.ancestor_id into new.root_category_id
+	from category_closure cc
+	where cc.descendant_id = new.category_id
+	order by cc.depth desc
+	limit 1;
+	return new;
+end;
+$$;
+"""
+
+TRIGGERS_SQL = """
+create trigger trg_categories_closure_insert
+	after insert on categories
+	for each row execute function category_closure_after_insert();
+
+create trigger trg_categories_closure_update
+	after update of parent_id on categories
+	for each row execute function category_closure_after_update();
+
+create trigger trg_products_root_category
+	before insert or update of category_id on products
+	for each row execute function products_set_root_category();
+"""
+
+BACKFILL_SQL = """
+insert into category_closure (ancestor_id, descendant_id, depth)
+with recursive paths as (
+select
+	c.id as ancestor_id,
+	c.id as descendant_id,
+	0 as depth
+from
+	categories c
+union all
+select
+	p.ancestor_id,
+	c.id as descendant_id,
+	p.depth + 1
+from
+	paths p
+join categories c on
+	c.parent_id = p.descendant_id
+)
+select ancestor_id, descendant_id, depth from paths;
+
+update products p
+set root_category_id = r.ancestor_id
+from (
+	select distinct on (descendant_id) descendant_id, ancestor_id
+	from category_closure
+	order by descendant_id, depth desc
+) r
+where r.descendant_id = p.category_id;
+"""
+
+MV_SQL = f"""
+CREATE MATERIALIZED VIEW {MV_NAME} as
+with sales as (
+select
+	psd.product_id,
+	SUM(psd.sold_qty) as sold_qty
+from
+	product_sales_daily psd
+where
+	psd.day > (now() at time zone 'UTC')::date - 30
+group by
+	psd.product_id
+),
+top as (
+select
+	row_number() over (order by s.sold_qty desc, p.name, p.id) as rank,
+	p.id as product_id,
+	p.name as product_name,
+	p.root_category_id,
+	s.sold_qty
+from
+	sales s
+join products p on
+	p.id = s.product_id
+order by
+	rank
+limit {TOP_N}
+)
+select
+	t.rank,
+	t.product_id,
+	t.product_name,
+	rc.name as category_level1,
+	t.sold_qty::bigint as total_sold_qty
+from
+	top t
+join categories rc on
+	rc.id = t.root_category_id
+WITH DATA;
+"""
+
+OLD_MV_SQL = f"""
+CREATE MATERIALIZED VIEW {MV_NAME} as
+with recursive sales as (
+select
+	psd.product_id,
+	SUM(psd.sold_qty) as sold_qty
+from
+	product_sales_daily psd
+where
+	psd.day > (now() at time zone 'UTC')::date - 30
+group by
+	psd.product_id
+),
+top as (
+select
+	row_number() over (order by s.sold_qty desc, p.name, p.id) as rank,
+	p.id as product_id,
+	p.name as product_name,
+	p.category_id,
+	s.sold_qty
+from
+	sales s
+join products p on
+	p.id = s.product_id
+order by
+	rank
+limit {TOP_N}
+),
+cat_up as (
+select
+	c.id as start_cat_id,
+	c.id as cur_cat_id,
+	c.parent_id,
+	c.name
+from
+	categories c
+where
+	c.id in (select category_id from top)
+union all
+select
+	cu.start_cat_id,
+	p.id as cur_cat_id,
+	p.parent_id,
+	p.name
+from
+	cat_up cu
+join categories p on
+	p.id = cu.parent_id
+)
+select
+	t.rank,
+	t.product_id,
+	t.product_name,
+	cu.name as category_level1,
+	t.sold_qty::bigint as total_sold_qty
+from
+	top t
+join cat_up cu on
+	cu.start_cat_id = t.category_id
+	and cu.parent_id is null
+WITH DATA;
+"""
+
+MV_INDEX_SQL = (
+    f"CREATE UNIQUE INDEX ux_{MV_NAME}_rank ON {MV_NAME} (rank) "
+    "INCLUDE (product_name, category_level1, total_sold_qty)"
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "category_closure",
+        sa.Column("ancestor_id", sa.BigInteger(), nullable=False),
+        sa.Column("descendant_id", sa.BigInteger(), nullable=False),
+        sa.Column("depth", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["ancestor_id"], ["categories.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(
+            ["descendant_id"], ["categories.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("ancestor_id", "descendant_id"),
+    )
+    op.create_index(
+        "ix_category_closure_ancestor_depth",
+        "category_closure",
+        ["ancestor_id", "depth"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_category_closure_descendant_depth",
+        "category_closure",
+        ["descendant_id", "depth"],
+        unique=False,
+    )
+    op.add_column(
+        "products", sa.Column("root_category_id", sa.BigInteger(), nullable=True)
+    )
+    op.create_foreign_key(
+        "products_root_category_id_fkey",
+        "products",
+        "categories",
+        ["root_category_id"],
+        ["id"],
+        ondelete="SET NULL",
+    )
+
+    op.execute(CLOSURE_FUNCTIONS_SQL)
+    op.execute(BACKFILL_SQL)
+    op.execute(TRIGGERS_SQL)
+    op.create_index(
+        "ix_products_root_category_id", "products", ["root_category_id"], unique=False
+    )
+
+    op.execute(f"DROP MATERIALIZED VIEW IF EXISTS {MV_NAME}")
+    op.execute(MV_SQL)
+    op.execute(MV_INDEX_SQL)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(f"DROP MATERIALIZED VIEW IF EXISTS {MV_NAME}")
+    op.execute(OLD_MV_SQL)
+    op.execute(MV_INDEX_SQL)
+
+    op.execute("DROP TRIGGER IF EXISTS trg_products_root_category ON products")
+    op.execute("DROP TRIGGER IF EXISTS trg_categories_closure_update ON categories")
+    op.execute("DROP TRIGGER IF EXISTS trg_categories_closure_insert ON categories")
+    op.execute("DROP FUNCTION IF EXISTS products_set_root_category()")
+    op.execute("DROP FUNCTION IF EXISTS category_closure_after_update()")
+    op.execute("DROP FUNCTION IF EXISTS category_closure_after_insert()")
+
+    op.drop_index("ix_products_root_category_id", table_name="products")
+    op.drop_constraint(
+        "products_root_category_id_fkey", "products", type_="foreignkey"
+    )
+    op.drop_column("products", "root_category_id")
+    op.drop_index(
+        "ix_category_closure_descendant_depth", table_name="category_closure"
+    )
+    op.drop_index("ix_category_closure_ancestor_depth", table_name="category_closure")
+    op.drop_table("category_closure")
@@ -0,0 +1,70 @@
+"""005_category_tree_version
+
+Revision ID: 005_category_tree_version
+Revises: 004_category_closure
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "005_category_tree_version"
+down_revision: Union[str, Sequence[str], None] = "004_category_closure"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NOTIFY_CHANNEL = "category_tree"
+
+FUNCTION_SQL = f"""
+create or replace function category_tree_bump_version() returns trigger
+language plpgsql as $$
+declare
+	new_version bigint;
+begin
+	update category_tree_version
+	set version = version + 1
+	where id = 1
+	returning version into new_version;
+
+	perform pg_notify('{NOTIFY_CHANNEL}', new_version::text);
+	return null;
+end;
+$$;
+"""
+
+TRIGGER_SQL = """
+create trigger trg_categories_tree_version
+	after insert or update or delete on categories
+	for each statement execute function category_tree_bump_version();
+
+create trigger trg_categories_tree_version_truncate
+	after truncate on categories
+	for each statement execute function category_tree_bump_version();
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "category_tree_version",
+        sa.Column("id", sa.SmallInteger(), nullable=False),
+        sa.Column("version", sa.BigInteger(), nullable=False),
+        sa.CheckConstraint("id = 1", name="ck_category_tree_version_single_row"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.execute("insert into category_tree_version (id, version) values (1, 1)")
+    op.execute(FUNCTION_SQL)
+    op.execute(TRIGGER_SQL)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS trg_categories_tree_version_truncate ON categories")
+    op.execute("DROP TRIGGER IF EXISTS trg_categories_tree_version ON categories")
+    op.execute("DROP FUNCTION IF EXISTS category_tree_bump_version()")
+    op.drop_table("category_tree_version")
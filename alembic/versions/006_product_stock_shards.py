@@ -0,0 +1,86 @@
+"""006_product_stock_shards
+
+Revision ID: 006_product_stock_shards
+Revises: 005_category_tree_version
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "006_product_stock_shards"
+down_revision: Union[str, Sequence[str], None] = "005_category_tree_version"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "products",
+        sa.Column(
+            "stock_shards",
+            sa.SmallInteger(),
+            server_default=sa.text("0"),
+            nullable=False,
+        ),
+    )
+    op.create_index(
+        "ix_products_sharded",
+        "products",
+        ["id"],
+        unique=False,
+        postgresql_where=sa.text("stock_shards > 0"),
+    )
+    op.create_table(
+        "product_stock_shards",
+        sa.Column("product_id", sa.BigInteger(), nullable=False),
+        sa.Column("shard_no", sa.SmallInteger(), nullable=False),
+        sa.Column("stock_qty", sa.Integer(), nullable=False),
+        sa.CheckConstraint("stock_qty >= 0", name="ck_product_stock_shards_stock_qty"),
+        sa.ForeignKeyConstraint(["product_id"], ["products.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("product_id", "shard_no"),
+    )
+    op.create_table(
+        "product_sales_daily_shards",
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("product_id", sa.BigInteger(), nullable=False),
+        sa.Column("shard_no", sa.SmallInteger(), nullable=False),
+        sa.Column("sold_qty", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["product_id"], ["products.id"], ondelete="RESTRICT"),
+        sa.PrimaryKeyConstraint("day", "product_id", "shard_no"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(
+        """
+        insert into product_sales_daily (product_id, day, sold_qty)
+        select product_id, day, sum(sold_qty)
+        from product_sales_daily_shards
+        group by product_id, day
+        on conflict (day, product_id) do update
+        set sold_qty = product_sales_daily.sold_qty + excluded.sold_qty
+        """
+    )
+    op.drop_table("product_sales_daily_shards")
+    # возвращаем остатки шардированных товаров в products.stock_qty
+    op.execute(
+        """
+        update products p
+        set stock_qty = p.stock_qty + s.stock_qty
+        from (select product_id, sum(stock_qty) as stock_qty
+              from product_stock_shards
+              group by product_id) s
+        where p.id = s.product_id
+        """
+    )
+    op.drop_table("product_stock_shards")
+    op.drop_index("ix_products_sharded", table_name="products")
+    op.drop_column("products", "stock_shards")
@@ -0,0 +1,246 @@
+"""007_customer_totals
+
+Revision ID: 007_customer_totals
+Revises: 006_product_stock_shards
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "007_customer_totals"
+down_revision: Union[str, Sequence[str], None] = "006_product_stock_shards"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Триггеры уровня оператора с переходными таблицами: многострочная вставка
+# (пакетное добавление, INSERT ... ON CONFLICT) обновляет строку клиента один раз.
+# Заказ учитывается в order_count, пока в нём есть хотя бы одна позиция.
+TOTALS_FUNCTIONS_SQL = """
+create or replace function customer_totals_after_items_insert() returns trigger
+language plpgsql as $$
+begin
+	if not exists (select 1 from new_items) then
+		return null;
+	end if;
+
+	-- сериализуем вставку первых позиций одного заказа, чтобы не посчитать его дважды
+	perform 1
+	from orders
+	where id in (select order_id from new_items)
+	order by id
+	for no key update;
+
+	insert into customer_totals (customer_id, total_amount, order_count, updated_at)
+	select
+		o.customer_id,
+		sum(l.amount),
+		count(*) filter (
+			where (select count(*) from order_items oi where oi.order_id = l.order_id) = l.lines
+		),
+		now()
+	from
+		(
+		select order_id, sum(qty * unit_price) as amount, count(*) as lines
+		from new_items
+		group by order_id
+		) l
+	join orders o on
+		o.id = l.order_id
+	group by
+		o.customer_id
+	order by
+		o.customer_id
+	on conflict (customer_id) do update
+	set total_amount = customer_totals.total_amount + excluded.total_amount,
+		order_count = customer_totals.order_count + excluded.order_count,
+		updated_at = excluded.updated_at;
+	return null;
+end;
+$$;
+
+create or replace function customer_totals_after_items_update() returns trigger
+language plpgsql as $$
+begin
+	insert into customer_totals (customer_id, total_amount, order_count, updated_at)
+	select
+		o.customer_id,
+		sum(d.amount),
+		0,
+		now()
+	from
+		(
+		select order_id, qty * unit_price as amount from new_items
+		union all
+		select order_id, -qty * unit_price from old_items
+		) d
+	join orders o on
+		o.id = d.order_id
+	group by
+		o.customer_id
+	having
+		sum(d.amount) <> 0
+	order by
+		o.customer_id
+	on conflict (customer_id) do update
+	set total_amount = customer_totals.total_amount + excluded.total_amount,
+		updated_at = excluded.updated_at;
+	return null;
+end;
+$$;
+
+create or replace function customer_totals_after_items_delete() returns trigger
+language plpgsql as $$
+begin
+	perform 1
+	from orders
+	where id in (select order_id from old_items)
+	order by id
+	for no key update;
+
+	-- позиции удалённых заказов уже вычтены в customer_totals_before_order_delete:
+	-- строк таких заказов больше нет, и join их отбрасывает
+	update customer_totals ct
+	set total_amount = ct.total_amount - s.amount,
+		order_count = ct.order_count - s.emptied,
+		updated_at = now()
+	from
+		(
+		select
+			o.customer_id,
+			sum(l.amount) as amount,
+			count(*) filter (
+				where not exists (select 1 from order_items oi where oi.order_id = l.order_id)
+			) as emptied
+		from
+			(
+			select order_id, sum(qty * unit_price) as amount
+			from old_items
+			group by order_id
+			) l
+		join orders o on
+			o.id = l.order_id
+		group by
+			o.customer_id
+		) s
+	where ct.customer_id = s.customer_id;
+	return null;
+end;
+$$;
+
+create or replace function customer_totals_before_order_delete() returns trigger
+language plpgsql as $$
+begin
+	update customer_totals ct
+	set total_amount = ct.total_amount - s.amount,
+		order_count = ct.order_count - 1,
+		updated_at = now()
+	from
+		(
+		select sum(qty * unit_price) as amount
+		from order_items
+		where order_id = old.id
+		having count(*) > 0
+		) s
+	where ct.customer_id = old.customer_id;
+	return old;
+end;
+$$;
+"""
+
+TRIGGERS_SQL = """
+create trigger trg_order_items_customer_totals_insert
+	after insert on order_items
+	referencing new table as new_items
+	for each statement execute function customer_totals_after_items_insert();
+
+create trigger trg_order_items_customer_totals_update
+	after update on order_items
+	referencing old table as old_items new table as new_items
+	for each statement execute function customer_totals_after_items_update();
+
+create trigger trg_order_items_customer_totals_delete
+	after delete on order_items
+	referencing old table as old_items
+	for each statement execute function customer_totals_after_items_delete();
+
+create trigger trg_orders_customer_totals_delete
+	before delete on orders
+	for each row execute function customer_totals_before_order_delete();
+"""
+
+BACKFILL_SQL = """
+insert into customer_totals (customer_id, total_amount, order_count, updated_at)
+select
+	o.customer_id,
+	sum(oi.qty * oi.unit_price),
+	count(distinct o.id),
+	now()
+from
+	orders o
+join order_items oi on
+	o.id = oi.order_id
+group by
+	o.customer_id;
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "customer_totals",
+        sa.Column("customer_id", sa.BigInteger(), nullable=False),
+        sa.Column(
+            "total_amount",
+            sa.Numeric(14, 2),
+            server_default=sa.text("0"),
+            nullable=False,
+        ),
+        sa.Column(
+            "order_count", sa.Integer(), server_default=sa.text("0"), nullable=False
+        ),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(["customer_id"], ["customers.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("customer_id"),
+    )
+    op.execute("LOCK TABLE order_items IN SHARE MODE")
+    op.execute(TOTALS_FUNCTIONS_SQL)
+    op.execute(BACKFILL_SQL)
+    op.execute(TRIGGERS_SQL)
+    op.create_index(
+        "ix_customer_totals_total_amount",
+        "customer_totals",
+        [sa.text("total_amount DESC"), "customer_id"],
+        unique=False,
+        postgresql_where=sa.text("order_count > 0"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS trg_orders_customer_totals_delete ON orders")
+    op.execute(
+        "DROP TRIGGER IF EXISTS trg_order_items_customer_totals_delete ON order_items"
+    )
+    op.execute(
+        "DROP TRIGGER IF EXISTS trg_order_items_customer_totals_update ON order_items"
+    )
+    op.execute(
+        "DROP TRIGGER IF EXISTS trg_order_items_customer_totals_insert ON order_items"
+    )
+    op.execute("DROP FUNCTION IF EXISTS customer_totals_before_order_delete()")
+    op.execute("DROP FUNCTION IF EXISTS customer_totals_after_items_delete()")
+    op.execute("DROP FUNCTION IF EXISTS customer_totals_after_items_update()")
+    op.execute("DROP FUNCTION IF EXISTS customer_totals_after_items_insert()")
+    op.drop_index("ix_customer_totals_total_amount", table_name="customer_totals")
+    op.drop_table("customer_totals")
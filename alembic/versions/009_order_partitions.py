@@ -0,0 +1,551 @@
+"""009_order_partitions
+
+Revision ID: 009_order_partitions
+Revises: 008_idempotency_keys
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "009_order_partitions"
+down_revision: Union[str, Sequence[str], None] = "008_idempotency_keys"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Сколько месяцев вперёд создаются партиции (как ORDER_PARTITION_MONTHS_AHEAD)
+MONTHS_AHEAD = 3
+
+ARCHIVE_SCHEMA = "order_archive"
+
+# Месячные партиции orders и order_items: границы — начало месяца по UTC,
+# уже существующие партиции пропускаются. Вызывается миграцией, seed и
+# фоновой задачей (app.repositories.partitions).
+PARTITIONS_FUNCTION_SQL = """
+create or replace function create_order_partitions(first_month date, last_month date)
+returns integer
+language plpgsql as $$
+declare
+	month_start date := date_trunc('month', first_month)::date;
+	parent_name text;
+	partition_name text;
+	created integer := 0;
+begin
+	while month_start <= last_month loop
+		foreach parent_name in array array['orders', 'order_items'] loop
+			partition_name := parent_name || '_' || to_char(month_start, 'YYYYMM');
+			if to_regclass(partition_name) is null then
+				execute format(
+					'create table %I partition of %I for values from (%L) to (%L)',
+					partition_name,
+					parent_name,
+					month_start::timestamp at time zone 'UTC',
+					(month_start + interval '1 month') at time zone 'UTC'
+				);
+				created := created + 1;
+			end if;
+		end loop;
+		month_start := (month_start + interval '1 month')::date;
+	end loop;
+	return created;
+end;
+$$;
+"""
+
+CREATE_TABLES_SQL = """
+create table orders_partitioned (
+	id bigint not null default nextval('orders_id_seq'),
+	customer_id bigint not null,
+	status text not null,
+	created_at timestamptz not null default now(),
+	constraint orders_pkey primary key (id, created_at)
+) partition by range (created_at);
+
+create table order_items_partitioned (
+	order_id bigint not null,
+	product_id bigint not null,
+	order_created_at timestamptz not null,
+	qty integer not null,
+	unit_price numeric(12, 2) not null,
+	created_at timestamptz not null default now(),
+	updated_at timestamptz not null default now(),
+	constraint order_items_pkey primary key (order_id, product_id, order_created_at)
+) partition by range (order_created_at);
+"""
+
+COPY_DATA_SQL = """
+insert into orders (id, customer_id, status, created_at)
+select id, customer_id, status, created_at
+from orders_unpartitioned;
+
+insert into order_items (
+	order_id, product_id, order_created_at, qty, unit_price, created_at, updated_at
+)
+select oi.order_id, oi.product_id, o.created_at, oi.qty, oi.unit_price,
+	oi.created_at, oi.updated_at
+from order_items_unpartitioned oi
+join orders_unpartitioned o on
+	o.id = oi.order_id;
+"""
+
+CONSTRAINTS_SQL = """
+alter table orders
+	add constraint orders_customer_id_fkey foreign key (customer_id)
+	references customers (id) on delete restrict;
+alter table order_items
+	add constraint fk_order_items_orders foreign key (order_id, order_created_at)
+	references orders (id, created_at) on delete cascade;
+alter table order_items
+	add constraint order_items_product_id_fkey foreign key (product_id)
+	references products (id) on delete restrict;
+
+create index ix_orders_created_at on orders (created_at);
+create index ix_orders_customer_id on orders (customer_id);
+create index ix_orders_status on orders (status);
+create index ix_order_items_product_id on order_items (product_id);
+"""
+
+# Функции 007_customer_totals с ключом партиции: позиции сопоставляются заказам
+# по (id, created_at), и запросы к orders/order_items читают одну партицию.
+TOTALS_FUNCTIONS_SQL = """
+create or replace function customer_totals_after_items_insert() returns trigger
+language plpgsql as $$
+begin
+	if not exists (select 1 from new_items) then
+		return null;
+	end if;
+
+	-- сериализуем вставку первых позиций одного заказа, чтобы не посчитать его дважды
+	perform 1
+	from orders
+	where (id, created_at) in (select order_id, order_created_at from new_items)
+	order by id
+	for no key update;
+
+	insert into customer_totals (customer_id, total_amount, order_count, updated_at)
+	select
+		o.customer_id,
+		sum(l.amount),
+		count(*) filter (
+			where (
+				select count(*)
+				from order_items oi
+				where oi.order_id = l.order_id
+					and oi.order_created_at = l.order_created_at
+			) = l.lines
+		),
+		now()
+	from
+		(
+		select order_id, order_created_at, sum(qty * unit_price) as amount, count(*) as lines
+		from new_items
+		group by order_id, order_created_at
+		) l
+	join orders o on
+		o.id = l.order_id
+		and o.created_at = l.order_created_at
+	group by
+		o.customer_id
+	order by
+		o.customer_id
+	on conflict (customer_id) do update
+	set total_amount = customer_totals.total_amount + excluded.total_amount,
+		order_count = customer_totals.order_count + excluded.order_count,
+		updated_at = excluded.updated_at;
+	return null;
+end;
+$$;
+
+create or replace function customer_totals_after_items_update() returns trigger
+language plpgsql as $$
+begin
+	insert into customer_totals (customer_id, total_amount, order_count, updated_at)
+	select
+		o.customer_id,
+		sum(d.amount),
+		0,
+		now()
+	from
+		(
+		select order_id, order_created_at, qty * unit_price as amount from new_items
+		union all
+		select order_id, order_created_at, -qty * unit_price from old_items
+		) d
+	join orders o on
+		o.id = d.order_id
+		and o.created_at = d.order_created_at
+	group by
+		o.customer_id
+	having
+		sum(d.amount) <> 0
+	order by
+		o.customer_id
+	on conflict (customer_id) do update
+	set total_amount = customer_totals.total_amount + excluded.total_amount,
+		updated_at = excluded.updated_at;
+	return null;
+end;
+$$;
+
+create or replace function customer_totals_after_items_delete() returns trigger
+language plpgsql as $$
+begin
+	perform 1
+	from orders
+	where (id, created_at) in (select order_id, order_created_at from old_items)
+	order by id
+	for no key update;
+
+	-- позиции удалённых заказов уже вычтены в customer_totals_before_order_delete:
+	-- строк таких заказов больше нет, и join их отбрасывает
+	update customer_totals ct
+	set total_amount = ct.total_amount - s.amount,
+		order_count = ct.order_count - s.emptied,
+		updated_at = now()
+	from
+		(
+		select
+			o.customer_id,
+			sum(l.amount) as amount,
+			count(*) filter (
+				where not exists (
+					select 1
+					from order_items oi
+					where oi.order_id = l.order_id
+						and oi.order_created_at = l.order_created_at
+				)
+			) as emptied
+		from
+			(
+			select order_id, order_created_at, sum(qty * unit_price) as amount
+			from old_items
+			group by order_id, order_created_at
+			) l
+		join orders o on
+			o.id = l.order_id
+			and o.created_at = l.order_created_at
+		group by
+			o.customer_id
+		) s
+	where ct.customer_id = s.customer_id;
+	return null;
+end;
+$$;
+
+create or replace function customer_totals_before_order_delete() returns trigger
+language plpgsql as $$
+begin
+	update customer_totals ct
+	set total_amount = ct.total_amount - s.amount,
+		order_count = ct.order_count - 1,
+		updated_at = now()
+	from
+		(
+		select sum(qty * unit_price) as amount
+		from order_items
+		where order_id = old.id
+			and order_created_at = old.created_at
+		having count(*) > 0
+		) s
+	where ct.customer_id = old.customer_id;
+	return old;
+end;
+$$;
+"""
+
+TRIGGERS_SQL = """
+create trigger trg_order_items_customer_totals_insert
+	after insert on order_items
+	referencing new table as new_items
+	for each statement execute function customer_totals_after_items_insert();
+
+create trigger trg_order_items_customer_totals_update
+	after update on order_items
+	referencing old table as old_items new table as new_items
+	for each statement execute function customer_totals_after_items_update();
+
+create trigger trg_order_items_customer_totals_delete
+	after delete on order_items
+	referencing old table as old_items
+	for each statement execute function customer_totals_after_items_delete();
+
+create trigger trg_orders_customer_totals_delete
+	before delete on orders
+	for each row execute function customer_totals_before_order_delete();
+"""
+
+# Функции 007_customer_totals для таблиц без партиций (downgrade)
+UNPARTITIONED_TOTALS_FUNCTIONS_SQL = """
+create or replace function customer_totals_after_items_insert() returns trigger
+language plpgsql as $$
+begin
+	if not exists (select 1 from new_items) then
+		return null;
+	end if;
+
+	-- сериализуем вставку первых позиций одного заказа, чтобы не посчитать его дважды
+	perform 1
+	from orders
+	where id in (select order_id from new_items)
+	order by id
+	for no key update;
+
+	insert into customer_totals (customer_id, total_amount, order_count, updated_at)
+	select
+		o.customer_id,
+		sum(l.amount),
+		count(*) filter (
+			where (select count(*) from order_items oi where oi.order_id = l.order_id) = l.lines
+		),
+		now()
+	from
+		(
+		select order_id, sum(qty * unit_price) as amount, count(*) as lines
+		from new_items
+		group by order_id
+		) l
+	join orders o on
+		o.id = l.order_id
+	group by
+		o.customer_id
+	order by
+		o.customer_id
+	on conflict (customer_id) do update
+	set total_amount = customer_totals.total_amount + excluded.total_amount,
+		order_count = customer_totals.order_count + excluded.order_count,
+		updated_at = excluded.updated_at;
+	return null;
+end;
+$$;
+
+create or replace function customer_totals_after_items_update() returns trigger
+language plpgsql as $$
+begin
+	insert into customer_totals (customer_id, total_amount, order_count, updated_at)
+	select
+		o.customer_id,
+		sum(d.amount),
+		0,
+		now()
+	from
+		(
+		select order_id, qty * unit_price as amount from new_items
+		union all
+		select order_id, -qty * unit_price from old_items
+		) d
+	join orders o on
+		o.id = d.order_id
+	group by
+		o.customer_id
+	having
+		sum(d.amount) <> 0
+	order by
+		o.customer_id
+	on conflict (customer_id) do update
+	set total_amount = customer_totals.total_amount + excluded.total_amount,
+		updated_at = excluded.updated_at;
+	return null;
+end;
+$$;
+
+create or replace function customer_totals_after_items_delete() returns trigger
+language plpgsql as $$
+begin
+	perform 1
+	from orders
+	where id in (select order_id from old_items)
+	order by id
+	for no key update;
+
+	-- позиции удалённых заказов уже вычтены в customer_totals_before_order_delete:
+	-- строк таких заказов больше нет, и join их отбрасывает
+	update customer_totals ct
+	set total_amount = ct.total_amount - s.amount,
+		order_count = ct.order_count - s.emptied,
+		updated_at = now()
+	from
+		(
+		select
+			o.customer_id,
+			sum(l.amount) as amount,
+			count(*) filter (
+				where not exists (select 1 from order_items oi where oi.order_id = l.order_id)
+			) as emptied
+		from
+			(
+			select order_id, sum(qty * unit_price) as amount
+			from old_items
+			group by order_id
+			) l
+		join orders o on
+			o.id = l.order_id
+		group by
+			o.customer_id
+		) s
+	where ct.customer_id = s.customer_id;
+	return null;
+end;
+$$;
+
+create or replace function customer_totals_before_order_delete() returns trigger
+language plpgsql as $$
+begin
+	update customer_totals ct
+	set total_amount = ct.total_amount - s.amount,
+		order_count = ct.order_count - 1,
+		updated_at = now()
+	from
+		(
+		select sum(qty * unit_price) as amount
+		from order_items
+		where order_id = old.id
+		having count(*) > 0
+		) s
+	where ct.customer_id = old.customer_id;
+	return old;
+end;
+$$;
+"""
+
+UNPARTITIONED_TABLES_SQL = """
+create table orders_unpartitioned (
+	id bigint not null default nextval('orders_id_seq'),
+	customer_id bigint not null,
+	status text not null,
+	created_at timestamptz not null default now(),
+	constraint orders_unpartitioned_pkey primary key (id)
+);
+
+create table order_items_unpartitioned (
+	order_id bigint not null,
+	product_id bigint not null,
+	qty integer not null,
+	unit_price numeric(12, 2) not null,
+	created_at timestamptz not null default now(),
+	updated_at timestamptz not null default now(),
+	constraint order_items_unpartitioned_pkey primary key (order_id, product_id)
+);
+
+insert into orders_unpartitioned (id, customer_id, status, created_at)
+select id, customer_id, status, created_at
+from orders;
+
+insert into order_items_unpartitioned (
+	order_id, product_id, qty, unit_price, created_at, updated_at
+)
+select order_id, product_id, qty, unit_price, created_at, updated_at
+from order_items;
+"""
+
+UNPARTITIONED_CONSTRAINTS_SQL = """
+alter table orders
+	add constraint orders_customer_id_fkey foreign key (customer_id)
+	references customers (id) on delete restrict;
+alter table order_items
+	add constraint order_items_order_id_fkey foreign key (order_id)
+	references orders (id) on delete cascade;
+alter table order_items
+	add constraint order_items_product_id_fkey foreign key (product_id)
+	references products (id) on delete restrict;
+
+create index ix_orders_created_at on orders (created_at);
+create index ix_orders_customer_id on orders (customer_id);
+create index ix_orders_status on orders (status);
+create index ix_order_items_product_id on order_items (product_id);
+"""
+
+
+def _drop_triggers() -> None:
+    op.execute("DROP TRIGGER IF EXISTS trg_orders_customer_totals_delete ON orders")
+    for action in ("delete", "update", "insert"):
+        op.execute(
+            f"DROP TRIGGER IF EXISTS trg_order_items_customer_totals_{action} "
+            "ON order_items"
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema.
+
+    Данные переносятся одной транзакцией под эксклюзивной блокировкой таблиц
+    заказов; на полном объёме seed миграция занимает минуты.
+    """
+    op.execute("LOCK TABLE orders, order_items IN ACCESS EXCLUSIVE MODE")
+    _drop_triggers()
+    for index in (
+        "ix_order_items_product_id",
+        "ix_orders_status",
+        "ix_orders_customer_id",
+        "ix_orders_created_at",
+    ):
+        op.execute(f"DROP INDEX {index}")
+    op.execute("ALTER TABLE orders RENAME TO orders_unpartitioned")
+    op.execute("ALTER TABLE order_items RENAME TO order_items_unpartitioned")
+    op.execute(
+        "ALTER TABLE orders_unpartitioned "
+        "RENAME CONSTRAINT orders_pkey TO orders_unpartitioned_pkey"
+    )
+    op.execute(
+        "ALTER TABLE order_items_unpartitioned "
+        "RENAME CONSTRAINT order_items_pkey TO order_items_unpartitioned_pkey"
+    )
+
+    op.execute(CREATE_TABLES_SQL)
+    op.execute("ALTER TABLE orders_partitioned RENAME TO orders")
+    op.execute("ALTER TABLE order_items_partitioned RENAME TO order_items")
+    op.execute(PARTITIONS_FUNCTION_SQL)
+    op.execute(
+        f"""
+        select create_order_partitions(
+            coalesce(
+                (select min(created_at) at time zone 'UTC' from orders_unpartitioned),
+                now() at time zone 'UTC'
+            )::date,
+            (now() at time zone 'UTC' + interval '{MONTHS_AHEAD} months')::date
+        )
+        """
+    )
+    op.execute(COPY_DATA_SQL)
+
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY NONE")
+    op.execute("DROP TABLE order_items_unpartitioned")
+    op.execute("DROP TABLE orders_unpartitioned")
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY orders.id")
+
+    op.execute(CONSTRAINTS_SQL)
+    op.execute(TOTALS_FUNCTIONS_SQL)
+    op.execute(TRIGGERS_SQL)
+    op.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+
+
+def downgrade() -> None:
+    """Downgrade schema.
+
+    Возвращаются только подключённые партиции; архивные остаются в схеме
+    `order_archive`.
+    """
+    op.execute("LOCK TABLE orders, order_items IN ACCESS EXCLUSIVE MODE")
+    _drop_triggers()
+    op.execute(UNPARTITIONED_TABLES_SQL)
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY NONE")
+    op.execute("DROP TABLE order_items")
+    op.execute("DROP TABLE orders")
+    op.execute("ALTER TABLE orders_unpartitioned RENAME TO orders")
+    op.execute("ALTER TABLE order_items_unpartitioned RENAME TO order_items")
+    op.execute(
+        "ALTER TABLE orders RENAME CONSTRAINT orders_unpartitioned_pkey TO orders_pkey"
+    )
+    op.execute(
+        "ALTER TABLE order_items "
+        "RENAME CONSTRAINT order_items_unpartitioned_pkey TO order_items_pkey"
+    )
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY orders.id")
+    op.execute(UNPARTITIONED_CONSTRAINTS_SQL)
+    op.execute(UNPARTITIONED_TOTALS_FUNCTIONS_SQL)
+    op.execute(TRIGGERS_SQL)
+    op.execute("DROP FUNCTION IF EXISTS create_order_partitions(date, date)")
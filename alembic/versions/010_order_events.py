@@ -0,0 +1,101 @@
+"""010_order_events
+
+Revision ID: 010_order_events
+Revises: 009_order_partitions
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "010_order_events"
+down_revision: Union[str, Sequence[str], None] = "009_order_partitions"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Outbox постоянно пополняется и вычищается: очистка запускается по числу мёртвых
+# строк, а не по доле от размера таблицы, иначе выборка первых событий по
+# первичному ключу проходит всё больше удалённых записей индекса
+OUTBOX_STORAGE_SQL = """
+alter table order_events set (
+	autovacuum_vacuum_scale_factor = 0,
+	autovacuum_vacuum_threshold = 10000
+)
+"""
+
+# Неприменённые события при откате переносятся в product_sales_daily
+APPLY_PENDING_EVENTS_SQL = """
+insert into product_sales_daily (product_id, day, sold_qty)
+select
+	product_id,
+	(order_created_at at time zone 'UTC')::date as day,
+	sum(qty)
+from
+	order_events
+group by
+	product_id,
+	day
+on conflict (day, product_id) do update
+set sold_qty = product_sales_daily.sold_qty + excluded.sold_qty
+"""
+
+# Продажи шардированных товаров, накопленные по шардам до outbox, переносятся в
+# product_sales_daily: дальше продажи всех товаров идут через события
+FOLD_SALES_SHARDS_SQL = """
+insert into product_sales_daily (product_id, day, sold_qty)
+select
+	product_id,
+	day,
+	sum(sold_qty)
+from
+	product_sales_daily_shards
+group by
+	product_id,
+	day
+on conflict (day, product_id) do update
+set sold_qty = product_sales_daily.sold_qty + excluded.sold_qty
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "order_events",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("order_id", sa.BigInteger(), nullable=False),
+        sa.Column("order_created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("product_id", sa.BigInteger(), nullable=False),
+        sa.Column("qty", sa.Integer(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.execute(OUTBOX_STORAGE_SQL)
+    op.execute("lock table product_sales_daily_shards in exclusive mode")
+    op.execute(FOLD_SALES_SHARDS_SQL)
+    op.drop_table("product_sales_daily_shards")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_table(
+        "product_sales_daily_shards",
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("product_id", sa.BigInteger(), nullable=False),
+        sa.Column("shard_no", sa.SmallInteger(), nullable=False),
+        sa.Column("sold_qty", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["product_id"], ["products.id"], ondelete="RESTRICT"),
+        sa.PrimaryKeyConstraint("day", "product_id", "shard_no"),
+    )
+    op.execute("lock table order_events in exclusive mode")
+    op.execute(APPLY_PENDING_EVENTS_SQL)
+    op.drop_table("order_events")
@@ -0,0 +1,77 @@
+"""011_product_sales_buckets
+
+Revision ID: 011_product_sales_buckets
+Revises: 010_order_events
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "011_product_sales_buckets"
+down_revision: Union[str, Sequence[str], None] = "010_order_events"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Продажи последних 31 суток по пятиминутным корзинам времени создания заказа.
+# Ещё не применённые события outbox вычитаются: потребитель добавит их сам.
+BACKFILL_SQL = """
+insert into product_sales_buckets (bucket_start, product_id, sold_qty)
+select
+	date_bin('5 minutes', s.order_created_at, timestamptz '2000-01-01 00:00:00+00') as bucket_start,
+	s.product_id,
+	SUM(s.qty) as sold_qty
+from
+	(
+	select oi.order_created_at, oi.product_id, oi.qty
+	from order_items oi
+	union all
+	select e.order_created_at, e.product_id, -e.qty
+	from order_events e
+	) s
+where
+	s.order_created_at >= now() - interval '31 days'
+group by
+	bucket_start,
+	s.product_id
+having
+	SUM(s.qty) > 0;
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "product_sales_buckets",
+        sa.Column("bucket_start", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("product_id", sa.BigInteger(), nullable=False),
+        sa.Column("sold_qty", sa.Integer(), nullable=False),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(["product_id"], ["products.id"], ondelete="RESTRICT"),
+        sa.PrimaryKeyConstraint("bucket_start", "product_id"),
+    )
+    op.create_index(
+        "ix_product_sales_buckets_updated_at",
+        "product_sales_buckets",
+        ["updated_at"],
+    )
+    op.execute("lock table order_events in exclusive mode")
+    op.execute(BACKFILL_SQL)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        "ix_product_sales_buckets_updated_at", table_name="product_sales_buckets"
+    )
+    op.drop_table("product_sales_buckets")
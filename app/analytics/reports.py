@@ -0,0 +1,178 @@
+"""Отчёты над колоночным снимком позиций (`app.analytics.snapshot`).
+
+Каждый отчёт — группировка `bincount` по плотным позициям справочника (клиента,
+товара, корневой категории или суток) над срезом позиций от начала окна:
+позиции отсортированы по времени создания заказа, поэтому окно находится
+бинарным поиском, а не фильтром по всем строкам. Порядок и поля строк
+совпадают с SQL-версиями отчётов.
+
+Функции выполняют работу NumPy и вызываются вне цикла событий
+(`asyncio.to_thread`) и только при построенном снимке (NumPy установлен).
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from app.analytics.snapshot import Snapshot, np
+
+SECONDS_PER_DAY = 86_400
+
+
+def _since(snapshot: Snapshot, since: datetime) -> int:
+    """Индекс первой позиции, созданной не раньше `since`."""
+
+    return int(np.searchsorted(snapshot["created_at"], int(since.timestamp())))
+
+
+def _sums(positions: Any, weights: Any, size: int) -> Any:
+    """Суммы `weights` по позициям справочника размера `size` (int64)."""
+
+    return np.rint(np.bincount(positions, weights=weights, minlength=size)).astype(
+        np.int64
+    )
+
+
+def _client_ranking(snapshot: Snapshot) -> tuple[Any, Any]:
+    totals = _sums(
+        snapshot["customer_pos"], snapshot["amount"], len(snapshot["customer_ids"])
+    )
+    order = np.lexsort((snapshot["customer_ids"], -totals))
+    return order[totals[order] > 0], totals
+
+
+def client_statistics(snapshot: Snapshot, limit: int, offset: int = 0) -> list[dict]:
+    """Клиенты по убыванию суммы заказов (как `GET /orders/clients/statistics`).
+
+    Рейтинг считается один раз на снимок.
+
+    Args:
+        snapshot: Снимок позиций.
+        limit: Размер страницы.
+        offset: Сколько клиентов пропустить.
+
+    Returns:
+        list[dict]: Строки `ClientStatistics`; сумма — в целых рублях.
+    """
+
+    order, totals = snapshot.memo("client_statistics", lambda: _client_ranking(snapshot))
+    names = snapshot["customer_names"]
+    return [
+        {"name": str(names[i]), "total_amount": int(totals[i] // 100)}
+        for i in order[offset : offset + limit]
+    ]
+
+
+def top_products(
+    snapshot: Snapshot,
+    since: datetime,
+    limit: int,
+    root_category_id: int | None = None,
+) -> list[dict]:
+    """Товары по убыванию проданного количества с момента `since`.
+
+    Порядок — как у материализованного топа: количество, название, id; товары
+    без корневой категории не попадают.
+
+    Args:
+        snapshot: Снимок позиций.
+        since: Начало окна.
+        limit: Сколько позиций вернуть.
+        root_category_id: Только товары этой корневой категории.
+
+    Returns:
+        list[dict]: Строки `TopProductOut`.
+    """
+
+    start = _since(snapshot, since)
+    positions = snapshot["product_pos"][start:]
+    qty = snapshot["qty"][start:]
+    root_ids = snapshot["root_ids"]
+    if root_category_id is not None:
+        root = int(np.searchsorted(root_ids, root_category_id))
+        if root == len(root_ids) or root_ids[root] != root_category_id:
+            return []
+        mask = snapshot["root_pos"][start:] == root
+        positions, qty = positions[mask], qty[mask]
+
+    product_roots = snapshot["product_root_pos"]
+    sold = _sums(positions, qty, len(snapshot["product_ids"]))
+    sold[product_roots < 0] = 0
+    ranked = int(np.count_nonzero(sold > 0))
+    if not ranked:
+        return []
+
+    # кандидаты — товары не ниже limit-го количества, включая равные ему
+    kth = len(sold) - min(limit, ranked)
+    candidates = np.flatnonzero(sold >= max(np.partition(sold, kth)[kth], 1))
+    names = snapshot["product_names"]
+    ids = snapshot["product_ids"]
+    order = candidates[
+        np.lexsort((ids[candidates], names[candidates], -sold[candidates]))
+    ][:limit]
+    root_names = snapshot["root_names"]
+    return [
+        {
+            "product_name": str(names[i]),
+            "category_level1": str(root_names[product_roots[i]]),
+            "total_sold_qty": int(sold[i]),
+        }
+        for i in order
+    ]
+
+
+def category_revenue(snapshot: Snapshot, since: datetime) -> list[dict]:
+    """Проданное количество и выручка корневых категорий с момента `since`.
+
+    Returns:
+        list[dict]: Строки `CategoryRevenueOut` по убыванию выручки.
+    """
+
+    start = _since(snapshot, since)
+    positions = snapshot["root_pos"][start:]
+    mask = positions >= 0
+    positions = positions[mask]
+    size = len(snapshot["root_ids"])
+    qty = _sums(positions, snapshot["qty"][start:][mask], size)
+    revenue = _sums(positions, snapshot["amount"][start:][mask], size)
+    ids = snapshot["root_ids"]
+    names = snapshot["root_names"]
+    order = np.lexsort((ids, -revenue))
+    return [
+        {
+            "category_id": int(ids[i]),
+            "name": str(names[i]),
+            "sold_qty": int(qty[i]),
+            "revenue": int(revenue[i]) / 100,
+        }
+        for i in order
+        if qty[i] > 0
+    ]
+
+
+def daily_sales(snapshot: Snapshot, days: int) -> list[dict]:
+    """Гистограмма продаж по суткам (UTC) за последние `days` суток, включая текущие.
+
+    Returns:
+        list[dict]: Строки `DailySalesOut` по возрастанию суток, в том числе
+        сутки без продаж.
+    """
+
+    first_day = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    since = datetime(first_day.year, first_day.month, first_day.day, tzinfo=timezone.utc)
+    start = _since(snapshot, since)
+    day = (snapshot["created_at"][start:] - int(since.timestamp())) // SECONDS_PER_DAY
+    day = np.minimum(day, days - 1)
+    qty = _sums(day, snapshot["qty"][start:], days)
+    revenue = _sums(day, snapshot["amount"][start:], days)
+    # заказ считается один раз: по первой его позиции в окне
+    _, first = np.unique(snapshot["order_id"][start:], return_index=True)
+    orders = np.bincount(day[first], minlength=days)
+    return [
+        {
+            "day": (first_day + timedelta(days=i)).isoformat(),
+            "orders": int(orders[i]),
+            "sold_qty": int(qty[i]),
+            "revenue": int(revenue[i]) / 100,
+        }
+        for i in range(days)
+    ]
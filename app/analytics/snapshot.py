@@ -0,0 +1,315 @@
+"""Колоночный снимок позиций заказов в массивах NumPy для аналитики в памяти.
+
+Снимок — колонки `order_items` с клиентом заказа и корневой категорией товара
+(`SNAPSHOT_ITEM_COLUMNS`), отсортированные по времени создания заказа, плюс
+справочники имён. Отчёты (`app.analytics.reports`) считаются над ними
+векторными группировками (`bincount`) без соединений в PostgreSQL; окно по
+времени — срез массивов бинарным поиском.
+
+Снимок перестраивается раз в `ANALYTICS_SNAPSHOT_INTERVAL` секунд. Без
+`ANALYTICS_SNAPSHOT_DIR` каждый воркер строит свой снимок в памяти. С каталогом
+снимок строит один воркер (advisory-блокировка), записывает колонки файлами
+`.npy` в новый подкаталог и переключает на него файл `CURRENT`; остальные
+воркеры отображают файлы в память (mmap), поэтому данные снимка хранятся в
+страничном кэше ОС в одном экземпляре на все процессы.
+
+NumPy — опциональная зависимость (extra `analytics`): без него снимок не
+строится, а эндпоинты аналитики отвечают 503.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+from app.db import SessionLocal
+from app.repositories.analytics import (
+    SNAPSHOT_ITEM_COLUMNS,
+    get_snapshot_categories,
+    get_snapshot_customers,
+    get_snapshot_products,
+    iterate_snapshot_items,
+    try_lock_analytics_snapshot,
+)
+from app.settings import settings
+
+try:
+    import numpy as np
+except ImportError:  # опциональная зависимость (extra `analytics`)
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Строк позиций в одной пачке серверного курсора
+SNAPSHOT_BATCH_SIZE = 100_000
+
+CURRENT_FILE = "CURRENT"
+META_FILE = "meta.json"
+
+# Сколько последних снимков остаётся в каталоге: предыдущий может ещё читать
+# воркер, не успевший переключиться
+KEEP_SNAPSHOTS = 2
+
+
+class Snapshot:
+    """Неизменяемый снимок: колонки позиций и справочники по имени массива.
+
+    Колонки позиций (по строке на позицию, по возрастанию `created_at`):
+    `SNAPSHOT_ITEM_COLUMNS`, сумма позиции в копейках `amount` и позиции товара,
+    клиента и корневой категории в справочниках `product_pos`, `customer_pos`,
+    `root_pos` (`-1` — товар без корневой категории). Справочники, отсортированные
+    по id: `product_ids`, `product_names`, `product_root_pos`, `customer_ids`,
+    `customer_names`, `root_ids`, `root_names`.
+    """
+
+    def __init__(self, arrays: dict[str, Any], created_at: float, name: str):
+        self.arrays = arrays
+        self.created_at = created_at
+        self.name = name
+        self._memo: dict[str, Any] = {}
+
+    def __getitem__(self, name: str):
+        return self.arrays[name]
+
+    def __len__(self) -> int:
+        return len(self.arrays["order_id"])
+
+    @property
+    def age(self) -> float:
+        """Возраст снимка, сек."""
+
+        return time.time() - self.created_at
+
+    def memo(self, key: str, compute: Callable[[], Any]) -> Any:
+        """Результат `compute`, вычисляемый один раз на снимок (не зависит от
+        параметров запроса, например рейтинг клиентов)."""
+
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+    def save(self, directory: Path) -> None:
+        """Записывает снимок в `directory/<name>` и делает его текущим.
+
+        Колонки пишутся во временный подкаталог, который переименовывается
+        целиком; `CURRENT` заменяется атомарно. Старые снимки сверх
+        `KEEP_SNAPSHOTS` удаляются.
+        """
+
+        directory.mkdir(parents=True, exist_ok=True)
+        staging = directory / f"{self.name}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir()
+        for name, array in self.arrays.items():
+            np.save(staging / f"{name}.npy", array, allow_pickle=False)
+        (staging / META_FILE).write_text(
+            json.dumps({"created_at": self.created_at, "rows": len(self)})
+        )
+        staging.rename(directory / self.name)
+
+        current = directory / f"{CURRENT_FILE}.tmp"
+        current.write_text(self.name)
+        os.replace(current, directory / CURRENT_FILE)
+
+        snapshots = sorted(
+            path for path in directory.iterdir() if path.is_dir() and path.suffix != ".tmp"
+        )
+        for path in snapshots[:-KEEP_SNAPSHOTS]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    @classmethod
+    def open(cls, directory: Path, name: str) -> "Snapshot":
+        """Отображает в память снимок `directory/<name>` (только чтение)."""
+
+        path = directory / name
+        meta = json.loads((path / META_FILE).read_text())
+        arrays = {
+            file.stem: np.load(file, mmap_mode="r", allow_pickle=False)
+            for file in path.glob("*.npy")
+        }
+        return cls(arrays, meta["created_at"], name)
+
+
+def read_current(directory: Path) -> tuple[str, float] | None:
+    """Имя и время создания текущего снимка каталога (None — снимка нет)."""
+
+    try:
+        name = (directory / CURRENT_FILE).read_text().strip()
+        meta = json.loads((directory / name / META_FILE).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    return name, meta["created_at"]
+
+
+def _names(rows: list, ids) -> Any:
+    """Массив имён в порядке `ids` (пустая строка — id не найден)."""
+
+    by_id = {row.id: row.name for row in rows}
+    return np.array([by_id.get(int(i), "") for i in ids], dtype=np.str_)
+
+
+def _dense(ids, values) -> Any:
+    """Позиции `values` в отсортированном справочнике `ids` (int32)."""
+
+    return np.searchsorted(ids, values).astype(np.int32)
+
+
+async def build_snapshot(session) -> Snapshot:
+    """Читает позиции и справочники в колонки снимка.
+
+    Args:
+        session: Асинхронная SQLAlchemy-сессия с открытой транзакцией
+            (REPEATABLE READ: позиции и имена из одного снимка БД).
+    """
+
+    created_at = time.time()
+    started = time.perf_counter()
+    batches = [
+        np.array(rows, dtype=np.int64)
+        async for rows in iterate_snapshot_items(session, SNAPSHOT_BATCH_SIZE)
+    ]
+
+    def columns() -> dict[str, Any]:
+        items = (
+            np.concatenate(batches)
+            if batches
+            else np.empty((0, len(SNAPSHOT_ITEM_COLUMNS)), dtype=np.int64)
+        )
+        created = SNAPSHOT_ITEM_COLUMNS.index("created_at")
+        items = items[np.argsort(items[:, created], kind="stable")]
+        arrays = {
+            name: np.ascontiguousarray(items[:, i])
+            for i, name in enumerate(SNAPSHOT_ITEM_COLUMNS)
+        }
+        arrays["amount"] = arrays["qty"] * arrays["unit_price"]
+        arrays["product_ids"] = np.unique(arrays["product_id"])
+        arrays["customer_ids"] = np.unique(arrays["customer_id"])
+        return arrays
+
+    arrays = await asyncio.to_thread(columns)
+    products = await get_snapshot_products(session, arrays["product_ids"].tolist())
+    customers = await get_snapshot_customers(session, arrays["customer_ids"].tolist())
+    product_roots = {row.id: row.root_category_id for row in products}
+    root_ids = np.unique(
+        np.array([root for root in product_roots.values() if root >= 0], dtype=np.int64)
+    )
+    roots = await get_snapshot_categories(session, root_ids.tolist())
+
+    def dimensions() -> None:
+        arrays["product_names"] = _names(products, arrays["product_ids"])
+        arrays["customer_names"] = _names(customers, arrays["customer_ids"])
+        arrays["root_ids"] = root_ids
+        arrays["root_names"] = _names(roots, root_ids)
+        product_root = np.array(
+            [product_roots.get(int(i), -1) for i in arrays["product_ids"]],
+            dtype=np.int64,
+        )
+        arrays["product_root_pos"] = np.where(
+            product_root >= 0, _dense(root_ids, product_root), -1
+        ).astype(np.int32)
+        arrays["product_pos"] = _dense(arrays["product_ids"], arrays["product_id"])
+        arrays["customer_pos"] = _dense(arrays["customer_ids"], arrays["customer_id"])
+        arrays["root_pos"] = np.where(
+            arrays["root_category_id"] >= 0,
+            _dense(root_ids, arrays["root_category_id"]),
+            -1,
+        ).astype(np.int32)
+
+    await asyncio.to_thread(dimensions)
+    snapshot = Snapshot(arrays, created_at, f"snapshot-{int(created_at * 1000)}")
+    logger.info(
+        "Построен снимок аналитики: %s позиций за %.1f с",
+        len(snapshot),
+        time.perf_counter() - started,
+    )
+    return snapshot
+
+
+class AnalyticsSnapshotCache:
+    """Держит текущий снимок процесса и перестраивает или переоткрывает его."""
+
+    def __init__(self) -> None:
+        self._snapshot: Snapshot | None = None
+        self._task: asyncio.Task | None = None
+
+    def get(self) -> Snapshot | None:
+        """Текущий снимок или None, если он ещё не построен."""
+
+        return self._snapshot
+
+    async def refresh(self) -> bool:
+        """Строит новый снимок (или открывает построенный другим воркером).
+
+        Returns:
+            bool: True, если текущий снимок процесса сменился.
+        """
+
+        if not settings.analytics_snapshot_dir:
+            async with SessionLocal() as session, session.begin():
+                await session.connection(
+                    execution_options={"isolation_level": "REPEATABLE READ"}
+                )
+                self._snapshot = await build_snapshot(session)
+            return True
+
+        directory = Path(settings.analytics_snapshot_dir)
+        await self._build_shared(directory)
+        current = await asyncio.to_thread(read_current, directory)
+        if current is None or (
+            self._snapshot is not None and self._snapshot.name == current[0]
+        ):
+            return False
+        self._snapshot = await asyncio.to_thread(Snapshot.open, directory, current[0])
+        return True
+
+    async def _build_shared(self, directory: Path) -> None:
+        async with SessionLocal() as session, session.begin():
+            await session.connection(
+                execution_options={"isolation_level": "REPEATABLE READ"}
+            )
+            if not await try_lock_analytics_snapshot(session):
+                return
+            # снимок, построенный другим воркером за последние полпериода, свежий
+            current = await asyncio.to_thread(read_current, directory)
+            if (
+                current is not None
+                and time.time() - current[1] < settings.analytics_snapshot_interval / 2
+            ):
+                return
+            snapshot = await build_snapshot(session)
+            # запись под блокировкой: следующий воркер увидит новый CURRENT
+            await asyncio.to_thread(snapshot.save, directory)
+
+    async def start(self) -> None:
+        """Запускает периодическое построение снимка (первое — сразу)."""
+
+        if np is None:
+            logger.warning("NumPy не установлен, снимок аналитики не строится")
+            return
+        self._task = asyncio.create_task(self._poll(), name="analytics_snapshot")
+
+    async def stop(self) -> None:
+        """Останавливает построение снимка."""
+
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _poll(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Построение снимка аналитики не удалось")
+            await asyncio.sleep(settings.analytics_snapshot_interval)
+
+
+analytics_snapshot = AnalyticsSnapshotCache()
@@ -0,0 +1,145 @@
+"""Аналитические эндпоинты над колоночным снимком позиций в памяти.
+
+Альтернатива SQL-версиям отчётов: ответы считаются NumPy-группировками над
+снимком `app.analytics.snapshot` и отстают от БД на его возраст, который
+передаётся в заголовке `X-Snapshot-Age` (секунды).
+"""
+
+import asyncio
+import logging
+
+from fastapi import APIRouter, HTTPException, Query, Response
+
+from app.analytics import reports
+from app.analytics.snapshot import Snapshot, analytics_snapshot
+from app.api.catalog.schemas import (
+    DEFAULT_PAGE_LIMIT,
+    MAX_PAGE_LIMIT,
+    CategoryRevenueOut,
+    ClientStatistics,
+    DailySalesOut,
+    TopProductOut,
+)
+from app.api.catalog.top_products import TOP_PRODUCTS_MAX_LIMIT
+from app.api.pagination import page_response
+from app.sales_ranking import SalesWindow, window_since
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/analytics", tags=["Analytics"])
+
+SNAPSHOT_AGE_HEADER = "X-Snapshot-Age"
+
+# Суток в гистограмме продаж не больше, чем в году
+DAILY_SALES_MAX_DAYS = 366
+
+
+def _get_snapshot() -> Snapshot:
+    snapshot = analytics_snapshot.get()
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="Analytics snapshot is not loaded")
+    return snapshot
+
+
+def _snapshot_response(schema, rows: list, snapshot: Snapshot, response: Response):
+    result = page_response(schema, rows, response)
+    target = result if isinstance(result, Response) else response
+    target.headers[SNAPSHOT_AGE_HEADER] = f"{snapshot.age:.1f}"
+    return result
+
+
+@router.get("/clients/statistics", response_model=list[ClientStatistics])
+async def client_statistics(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    offset: int = Query(0, ge=0),
+):
+    """Возвращает статистику клиентов по сумме заказов из снимка.
+
+    То же, что `GET /orders/clients/statistics`, на момент построения снимка.
+
+    Args:
+        response: Ответ FastAPI для заголовка возраста снимка.
+        limit: Сколько клиентов вернуть.
+        offset: Сколько клиентов пропустить (по убыванию суммы).
+
+    Raises:
+        HTTPException: 503, если снимок не построен.
+    """
+
+    snapshot = _get_snapshot()
+    rows = await asyncio.to_thread(reports.client_statistics, snapshot, limit, offset)
+    return _snapshot_response(ClientStatistics, rows, snapshot, response)
+
+
+@router.get("/top-products", response_model=list[TopProductOut])
+async def top_products(
+    response: Response,
+    window: SalesWindow = Query("30d", description="окно продаж"),
+    root_category_id: int | None = Query(
+        None, description="только товары корневой категории"
+    ),
+    limit: int = Query(5, ge=1, le=TOP_PRODUCTS_MAX_LIMIT),
+):
+    """Возвращает топ товаров по количеству продаж за окно из снимка.
+
+    Окна — как у `GET /catalog/top-products`; фильтр — по корневой категории
+    товара, а не по поддереву.
+
+    Args:
+        response: Ответ FastAPI для заголовка возраста снимка.
+        window: Окно продаж.
+        root_category_id: Корневая категория товаров.
+        limit: Сколько позиций вернуть.
+
+    Raises:
+        HTTPException: 503, если снимок не построен.
+    """
+
+    snapshot = _get_snapshot()
+    rows = await asyncio.to_thread(
+        reports.top_products, snapshot, window_since(window), limit, root_category_id
+    )
+    return _snapshot_response(TopProductOut, rows, snapshot, response)
+
+
+@router.get("/categories/revenue", response_model=list[CategoryRevenueOut])
+async def category_revenue(
+    response: Response,
+    window: SalesWindow = Query("30d", description="окно продаж"),
+):
+    """Возвращает продажи и выручку корневых категорий за окно из снимка.
+
+    Args:
+        response: Ответ FastAPI для заголовка возраста снимка.
+        window: Окно продаж.
+
+    Raises:
+        HTTPException: 503, если снимок не построен.
+    """
+
+    snapshot = _get_snapshot()
+    rows = await asyncio.to_thread(
+        reports.category_revenue, snapshot, window_since(window)
+    )
+    return _snapshot_response(CategoryRevenueOut, rows, snapshot, response)
+
+
+@router.get("/sales/daily", response_model=list[DailySalesOut])
+async def daily_sales(
+    response: Response,
+    days: int = Query(30, ge=1, le=DAILY_SALES_MAX_DAYS),
+):
+    """Возвращает продажи по суткам (UTC) за последние `days` суток из снимка.
+
+    Args:
+        response: Ответ FastAPI для заголовка возраста снимка.
+        days: Сколько суток, включая текущие.
+
+    Raises:
+        HTTPException: 503, если снимок не построен.
+    """
+
+    snapshot = _get_snapshot()
+    rows = await asyncio.to_thread(reports.daily_sales, snapshot, days)
+    return _snapshot_response(DailySalesOut, rows, snapshot, response)
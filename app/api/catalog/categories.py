@@ -1,47 +1,221 @@
 """Эндпоинты для аналитики по категориям каталога."""
 
-from fastapi import APIRouter, Depends
-from app.api.catalog.schemas import CategoryChildrenCountOut
-from app.db import get_db
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from app.api.catalog.schemas import (
+    CategoryChildrenCountOut,
+    CategoryOut,
+    MAX_PAGE_LIMIT,
+)
+from app.api.pagination import (
+    StreamFormat,
+    cached_page,
+    decode_cursor,
+    encode_cursor,
+    in_batches,
+    iterate_query,
+    page_response,
+    stream_response,
+)
+from app.category_tree import category_tree
+from app.db import EXPLAIN_SAFE, get_read_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
 router = APIRouter(prefix="/categories", tags=["Catalog / Categories"])
 
+# Категории первого уровня и число их прямых потомков через closure table.
+# Имена сравниваются и сортируются в collate "C" (по кодовым точкам), как в
+# дереве в памяти (app.category_tree): курсор страницы годится для обоих путей
 SQL_CHILDREN_COUNT = text(
     """
 select
 	c.id,
 	c.name,
-	COUNT(child.id) as children_count
+	COUNT(child.descendant_id) as children_count
 from
-	categories c
-join categories parent on
-	parent.id = c.parent_id
-left join categories child on
-	child.parent_id = c.id
+	category_closure lvl
+join categories root on
+	root.id = lvl.ancestor_id
+	and root.parent_id is null
+join categories c on
+	c.id = lvl.descendant_id
+left join category_closure child on
+	child.ancestor_id = c.id
+	and child.depth = 1
 where
-	parent.parent_id is null
+	lvl.depth = 1
+	and (cast(:after_name as text) is null
+		or (c.name collate "C", c.id) > (cast(:after_name as text), cast(:after_id as bigint)))
 group by
 	c.id,
 	c.name
 order by
-	c.name;
+	c.name collate "C",
+	c.id
+limit :limit;
 """
-)
+).execution_options(**EXPLAIN_SAFE)
+
+SQL_ANCESTORS = text(
+    """
+select
+	c.id,
+	c.name,
+	c.parent_id,
+	cc.depth
+from
+	category_closure cc
+join categories c on
+	c.id = cc.ancestor_id
+where
+	cc.descendant_id = :category_id
+	and cc.depth > 0
+order by
+	cc.depth;
+"""
+).execution_options(**EXPLAIN_SAFE)
+
+SQL_SUBTREE = text(
+    """
+select
+	c.id,
+	c.name,
+	c.parent_id,
+	cc.depth
+from
+	category_closure cc
+join categories c on
+	c.id = cc.descendant_id
+where
+	cc.ancestor_id = :category_id
+order by
+	cc.depth,
+	c.name,
+	c.id;
+"""
+).execution_options(**EXPLAIN_SAFE)
+
+SQL_CATEGORY_EXISTS = text("select 1 from categories where id = :category_id")
+
+
+async def ensure_category_exists(db: AsyncSession, category_id: int) -> None:
+    """Отвечает 404, если категории нет в БД."""
+
+    found = (
+        await db.execute(SQL_CATEGORY_EXISTS, {"category_id": category_id})
+    ).scalar_one_or_none()
+    if found is None:
+        raise HTTPException(status_code=404, detail="Category not found")
 
 
 @router.get("/children-count", response_model=list[CategoryChildrenCountOut])
-async def get_children_count_first_level(db: Session = Depends(get_db)):
+async def get_children_count_first_level(
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: str | None = Query(None, description="курсор из X-Next-Cursor"),
+    stream: StreamFormat | None = Query(None, description="потоковая выдача"),
+    db: AsyncSession = Depends(get_read_db),
+):
     """Возвращает число дочерних категорий для категорий первого уровня.
 
+    Категории упорядочены по имени и id. Без `limit` возвращаются все; с `limit`
+    следующая страница запрашивается курсором из заголовка `X-Next-Cursor`.
+    Страницы кэшируются на `CACHE_TTLS["children_count"]` секунд; перезагрузка
+    дерева категорий сбрасывает кэш.
+
     Args:
-        db: SQLAlchemy-сессия из зависимости FastAPI.
+        response: Ответ FastAPI для заголовка следующего курсора.
+        limit: Размер страницы.
+        cursor: Курсор следующей страницы.
+        stream: Формат потоковой выдачи (`ndjson` или `json`).
+        db: Читающая сессия (реплика или основная БД, см. `get_read_db`).
 
     Returns:
         list[CategoryChildrenCountOut]: Список категорий и количества их дочерних узлов.
     """
 
-    res = db.execute(SQL_CHILDREN_COUNT)
-    rows = res.mappings().all()
-    return rows
+    after = decode_cursor(cursor, str, int) if cursor is not None else None
+    params = {
+        "after_name": after[0] if after else None,
+        "after_id": after[1] if after else None,
+        "limit": limit,
+    }
+
+    if stream is not None:
+        tree = category_tree.get()
+        if tree is not None:
+            rows = tree.children_count_first_level(after, limit)
+            return stream_response(in_batches(rows), CategoryChildrenCountOut, stream)
+        return stream_response(
+            iterate_query(SQL_CHILDREN_COUNT, params),
+            CategoryChildrenCountOut,
+            stream,
+        )
+
+    async def load(session: AsyncSession) -> tuple[list, str | None]:
+        tree = category_tree.get()
+        if tree is not None:
+            rows = tree.children_count_first_level(after, limit)
+        else:
+            rows = (await session.execute(SQL_CHILDREN_COUNT, params)).mappings().all()
+        next_cursor = None
+        if limit is not None and len(rows) == limit:
+            next_cursor = encode_cursor(rows[-1]["name"], rows[-1]["id"])
+        return rows, next_cursor
+
+    return await cached_page(
+        "children_count",
+        {"limit": limit, "cursor": cursor},
+        CategoryChildrenCountOut,
+        db,
+        response,
+        load,
+    )
+
+
+@router.get("/{category_id}/ancestors", response_model=list[CategoryOut])
+async def get_category_ancestors(
+    category_id: int, response: Response, db: AsyncSession = Depends(get_read_db)
+):
+    """Возвращает предков категории от родителя до корня.
+
+    Args:
+        category_id: Идентификатор категории.
+        response: Ответ FastAPI.
+        db: Читающая сессия (реплика или основная БД, см. `get_read_db`).
+
+    Returns:
+        list[CategoryOut]: Предки категории; `depth` — расстояние до неё.
+    """
+
+    tree = category_tree.get(category_id)
+    if tree is not None:
+        return page_response(CategoryOut, tree.ancestors(category_id), response)
+
+    await ensure_category_exists(db, category_id)
+    res = await db.execute(SQL_ANCESTORS, {"category_id": category_id})
+    return page_response(CategoryOut, res.mappings().all(), response)
+
+
+@router.get("/{category_id}/subtree", response_model=list[CategoryOut])
+async def get_category_subtree(
+    category_id: int, response: Response, db: AsyncSession = Depends(get_read_db)
+):
+    """Возвращает категорию и всех её потомков.
+
+    Args:
+        category_id: Идентификатор категории.
+        response: Ответ FastAPI.
+        db: Читающая сессия (реплика или основная БД, см. `get_read_db`).
+
+    Returns:
+        list[CategoryOut]: Узлы поддерева, упорядоченные по глубине и имени.
+    """
+
+    tree = category_tree.get(category_id)
+    if tree is not None:
+        return page_response(CategoryOut, tree.subtree(category_id), response)
+
+    await ensure_category_exists(db, category_id)
+    res = await db.execute(SQL_SUBTREE, {"category_id": category_id})
+    return page_response(CategoryOut, res.mappings().all(), response)
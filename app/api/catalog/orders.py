@@ -1,54 +1,450 @@
 """Эндпоинты для работы с заказами и их агрегатной аналитикой."""
 
 import logging
-from fastapi import APIRouter, Depends, HTTPException
-from app.api.catalog.schemas import AddItemRequest, AddItemResponse, ClientStatistics
-from app.db import get_db
-from app.models import Order, Product, OrderItem
-from sqlalchemy.orm import Session
-from sqlalchemy import select, text
+from collections import defaultdict
+from functools import partial
+from decimal import Decimal
+from collections.abc import Awaitable, Callable
+from typing import Annotated
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Response
+from fastapi.encoders import jsonable_encoder
+from app.api.catalog.schemas import (
+    AddItemRequest,
+    AddItemResponse,
+    ClientStatistics,
+    DEFAULT_PAGE_LIMIT,
+    MAX_BATCH_ITEMS,
+    MAX_PAGE_LIMIT,
+)
+from app.api.pagination import (
+    StreamFormat,
+    cached_page,
+    decode_cursor,
+    encode_cursor,
+    iterate_query,
+    stream_response,
+)
+from app.cache.responses import api_cache
+from app.db import SessionLocal, get_db, get_read_db
+from app.logging_config import TRANSACTION_LOGGER, sample_transaction
+from app.metrics import stock_conflicts
+from app.models import Product, OrderItem
+from app.repositories.customers import client_statistics_query, get_client_statistics
+from app.repositories.order_events import add_order_events, add_product_order_events
+from app.repositories.orders import (
+    decrement_stock,
+    get_order_created_at,
+    get_order_product_state,
+    get_orders_created_at,
+    lock_products,
+    reserve_and_add_item,
+    upsert_order_items,
+    upsert_product_order_items,
+)
+from app.repositories.stock_shards import (
+    get_sharded_products,
+    reserve_from_shards,
+    reserve_shard_and_add_item,
+    sharded_products,
+)
+from app.services.group_commit import GroupCommit
+from app.services.idempotency import (
+    IdempotencyKeyReusedError,
+    request_fingerprint,
+    run_idempotent,
+)
+from app.services.unit_of_work import TransactionConflictError, run_in_transaction
+from app.settings import settings
+from sqlalchemy import Row, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 logger = logging.getLogger(__name__)
+# начало и результат каждой транзакции записи; пишется с выборкой
+transaction_logger = logging.getLogger(TRANSACTION_LOGGER)
 
 router = APIRouter(prefix="/orders", tags=["Catalog / Orders"])
 
-SQL_CLIENT_STATISTICS = text(
-    """
-    select cs.name,
-           sum(oi.unit_price * oi.qty) as total_amount
-    from orders o
-             join order_items oi on
-        o.id = oi.order_id
-             join customers cs on
-        o.customer_id = cs.id
-    group by o.customer_id,
-             cs.name
-    order by total_amount desc
-
-    """
-)
+# Кэши ответов (app.cache.responses), которые устаревают после добавления товаров:
+# суммы клиентов пишутся в той же транзакции, а топ товаров сбрасывается только
+# после обновления материализованного представления
+ORDER_WRITE_CACHES = ("clients_statistics",)
 
+IdempotencyKeyHeader = Annotated[
+    str | None,
+    Header(
+        alias="Idempotency-Key",
+        min_length=1,
+        max_length=255,
+        description="ключ повтора запроса: запись выполняется не больше одного раза",
+    ),
+]
 
 @router.get("/clients/statistics", response_model=list[ClientStatistics])
-def client_statistics(db: Session = Depends(get_db)):
+async def client_statistics(
+        response: Response,
+        limit: int | None = Query(None, ge=1, le=MAX_PAGE_LIMIT),
+        offset: int = Query(0, ge=0),
+        cursor: str | None = Query(None, description="курсор из X-Next-Cursor"),
+        stream: StreamFormat | None = Query(None, description="потоковая выдача"),
+        db: AsyncSession = Depends(get_read_db),
+):
     """Возвращает статистику клиентов по сумме заказов.
 
+    Суммы читаются из агрегата `customer_totals`, который триггеры `order_items`
+    обновляют в той же транзакции, что и позиции заказа.
+
+    Страницы листаются курсором: `X-Next-Cursor` ответа передаётся в `cursor`
+    следующего запроса (`offset` оставлен для совместимости и с курсором не
+    сочетается). С `stream=ndjson|json` клиенты после курсора отдаются потоком
+    без ограничения размера, если `limit` не задан.
+
+    Страницы кэшируются на `CACHE_TTLS["clients_statistics"]` секунд; добавление
+    товаров в заказ сбрасывает кэш.
+
     Args:
-        db: SQLAlchemy-сессия из зависимости FastAPI.
+        response: Ответ FastAPI для заголовка следующего курсора.
+        limit: Сколько клиентов вернуть (по умолчанию 100).
+        offset: Сколько клиентов пропустить (по убыванию суммы).
+        cursor: Курсор следующей страницы.
+        stream: Формат потоковой выдачи.
+        db: Читающая сессия (реплика или основная БД, см. `get_read_db`).
 
     Returns:
         list[ClientStatistics]: Имя клиента и агрегированная сумма покупок.
     """
 
-    res = db.execute(SQL_CLIENT_STATISTICS)
-    rows = res.mappings().all()
-    return rows
+    if cursor is not None and offset:
+        raise HTTPException(status_code=400, detail="Use either cursor or offset")
+    after = decode_cursor(cursor, Decimal, int) if cursor is not None else None
+
+    if stream is not None:
+        stmt = client_statistics_query(after, limit).offset(offset)
+        return stream_response(iterate_query(stmt), ClientStatistics, stream)
+
+    limit = limit or DEFAULT_PAGE_LIMIT
+
+    async def load(session: AsyncSession) -> tuple[list[Row], str | None]:
+        rows = await get_client_statistics(session, limit, offset, after)
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = encode_cursor(rows[-1].total_amount, rows[-1].customer_id)
+        return rows, next_cursor
+
+    return await cached_page(
+        "clients_statistics",
+        {"limit": limit, "offset": offset, "cursor": cursor},
+        ClientStatistics,
+        db,
+        response,
+        load,
+    )
+
+
+async def _add_item_locking(
+        db: AsyncSession, order_id: int, payload: AddItemRequest
+) -> AddItemResponse:
+    """Списание через `SELECT ... FOR UPDATE` и изменение ORM-объекта товара."""
+
+    order_created_at = await get_order_created_at(db, order_id)
+    if order_created_at is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    transaction_logger.info("Начата транзакция")
+
+    product: Product | None = (
+        await db.execute(
+            select(Product)
+            .where(Product.id == payload.product_id, Product.stock_shards == 0)
+            .with_for_update()
+        )
+    ).scalar_one_or_none()
+
+    if product is None:
+        # товара нет или его остаток шардирован
+        state = await get_order_product_state(db, order_id, payload.product_id)
+        if state.stock_qty is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        return await _add_item_sharded(db, order_id, payload, state)
+
+    if product.stock_qty < payload.quantity:
+        raise HTTPException(status_code=409, detail="Not enough stock")
+
+    # списываем остаток
+    product.stock_qty -= payload.quantity
+
+    # upsert в order_items
+    stmt = (
+        pg_insert(OrderItem)
+        .values(
+            order_id=order_id,
+            product_id=payload.product_id,
+            order_created_at=order_created_at,
+            qty=payload.quantity,
+            unit_price=product.price,
+        )
+        .on_conflict_do_update(
+            index_elements=[
+                OrderItem.order_id,
+                OrderItem.product_id,
+                OrderItem.order_created_at,
+            ],
+            set_={
+                OrderItem.qty: OrderItem.qty + payload.quantity,
+                OrderItem.unit_price: product.price,
+            },
+        )
+        .returning(OrderItem.qty)
+    )
+
+    new_qty = (await db.execute(stmt)).scalar_one()
+
+    await add_order_events(
+        db, order_id, order_created_at, {payload.product_id: payload.quantity}
+    )
+
+    await db.flush()
+
+    return AddItemResponse(
+        order_id=order_id,
+        product_id=payload.product_id,
+        new_qty=int(new_qty),
+        remaining_stock=int(product.stock_qty),
+    )
+
+
+async def _add_item_atomic(
+        db: AsyncSession, order_id: int, payload: AddItemRequest
+) -> AddItemResponse:
+    """Списание и запись позиции одним запросом без предварительной блокировки."""
+
+    reserved = await reserve_and_add_item(
+        db, order_id, payload.product_id, payload.quantity
+    )
+    if reserved is None:
+        state = await get_order_product_state(db, order_id, payload.product_id)
+        if state.order_created_at is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+        if state.stock_qty is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        if state.stock_shards:
+            return await _add_item_sharded(db, order_id, payload, state)
+        raise HTTPException(status_code=409, detail="Not enough stock")
+
+    return AddItemResponse(
+        order_id=order_id,
+        product_id=payload.product_id,
+        new_qty=int(reserved.new_qty),
+        remaining_stock=int(reserved.remaining_stock),
+    )
+
+
+async def _add_item_unsharded(
+        db: AsyncSession, order_id: int, payload: AddItemRequest
+) -> AddItemResponse:
+    """Списание из `products.stock_qty` способом из `STOCK_RESERVATION_MODE`."""
+
+    if settings.stock_reservation_mode == "atomic":
+        return await _add_item_atomic(db, order_id, payload)
+    return await _add_item_locking(db, order_id, payload)
+
+
+async def _add_item_sharded(
+        db: AsyncSession,
+        order_id: int,
+        payload: AddItemRequest,
+        state: Row | None = None,
+) -> AddItemResponse:
+    """Списание из шардов остатка (`product_stock_shards`) без блокировки товара.
+
+    Сначала одним запросом списывается свободный шард и пишется позиция; если
+    свободных шардов с достаточным остатком нет, остаток списывается через
+    `reserve_from_shards` с ожиданием шарда, а позиция пишется отдельно.
+
+    Args:
+        state: Уже прочитанное `get_order_product_state`, если есть.
+    """
+
+    reserved = await reserve_shard_and_add_item(
+        db, order_id, payload.product_id, payload.quantity
+    )
+    if reserved is not None:
+        sharded_products.add(payload.product_id)
+        return AddItemResponse(
+            order_id=order_id,
+            product_id=payload.product_id,
+            new_qty=int(reserved.new_qty),
+            remaining_stock=int(reserved.remaining_stock),
+        )
+
+    if state is None:
+        state = await get_order_product_state(db, order_id, payload.product_id)
+    if state.order_created_at is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if state.stock_qty is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    if not state.stock_shards:
+        # остаток товара вернули в products.stock_qty
+        sharded_products.discard(payload.product_id)
+        return await _add_item_unsharded(db, order_id, payload)
+    sharded_products.add(payload.product_id)
+
+    remaining = await reserve_from_shards(
+        db, payload.product_id, payload.quantity, skip_locked=False
+    )
+    if remaining is None:
+        raise HTTPException(status_code=409, detail="Not enough stock")
+
+    new_qty = await upsert_order_items(
+        db,
+        order_id,
+        state.order_created_at,
+        {payload.product_id: (payload.quantity, state.price)},
+    )
+    await add_order_events(
+        db, order_id, state.order_created_at, {payload.product_id: payload.quantity}
+    )
+
+    return AddItemResponse(
+        order_id=order_id,
+        product_id=payload.product_id,
+        new_qty=int(new_qty[payload.product_id]),
+        remaining_stock=int(remaining),
+    )
+
+
+async def _apply_add_item_group(
+        db: AsyncSession, product_id: int, requests: list[tuple[int, int]]
+) -> list[AddItemResponse | HTTPException | None]:
+    """Тело групповой транзакции `_add_item_group`."""
+
+    product = (await lock_products(db, [product_id])).get(product_id)
+    if product is None:
+        if await get_sharded_products(db, [product_id]):
+            return [None] * len(requests)
+        return [
+            HTTPException(status_code=404, detail="Product not found")
+            for _ in requests
+        ]
+
+    created = await get_orders_created_at(db, (order_id for order_id, _ in requests))
+    stock = product.stock_qty
+    added: dict[int, int] = defaultdict(int)
+    # (order_id, остаток и добавленное в заказ после запроса) или ошибка
+    outcomes: list[tuple[int, int, int] | HTTPException] = []
+    for order_id, quantity in requests:
+        if order_id not in created:
+            outcomes.append(HTTPException(status_code=404, detail="Order not found"))
+        elif stock < quantity:
+            outcomes.append(HTTPException(status_code=409, detail="Not enough stock"))
+        else:
+            stock -= quantity
+            added[order_id] += quantity
+            outcomes.append((order_id, stock, added[order_id]))
+    if not added:
+        return outcomes
+
+    await decrement_stock(db, {product_id: product.stock_qty - stock})
+    qty_by_order = {
+        (order_id, created[order_id]): qty for order_id, qty in added.items()
+    }
+    new_qty = await upsert_product_order_items(
+        db, product_id, product.price, qty_by_order
+    )
+    await add_product_order_events(db, product_id, qty_by_order)
+    return [
+        AddItemResponse(
+            order_id=outcome[0],
+            product_id=product_id,
+            new_qty=int(new_qty[outcome[0]] - added[outcome[0]] + outcome[2]),
+            remaining_stock=int(outcome[1]),
+        )
+        if isinstance(outcome, tuple)
+        else outcome
+        for outcome in outcomes
+    ]
+
+
+async def _add_item_group(
+        product_id: int, requests: list[tuple[int, int]]
+) -> list[AddItemResponse | HTTPException | None]:
+    """Выполняет группу запросов `add_item_to_order` одного товара одной транзакцией.
+
+    Строка товара блокируется один раз, остаток проверяется по запросам в порядке
+    поступления: запрос, которому не хватило остатка, получает 409, а следующие
+    меньшие могут пройти. Остаток списывается одним `UPDATE`, позиции всех
+    заказов и события пишутся по одному многострочному `INSERT`.
+
+    Args:
+        product_id: Товар группы.
+        requests: (order_id, quantity) запросов в порядке поступления.
+
+    Returns:
+        list[AddItemResponse | HTTPException | None]: Ответ или ошибка по каждому
+        запросу; None — остаток товара шардирован, запрос выполняется обычным путём.
+    """
+
+    transaction_logger.info(
+        "Групповая транзакция, товар: %s, запросов: %s", product_id, len(requests)
+    )
+    async with SessionLocal() as db:
+        return await run_in_transaction(
+            db,
+            partial(_apply_add_item_group, db, product_id, requests),
+            operation="add_item",
+        )
+
+
+# Группы одновременных запросов add_item_to_order по товару (ADD_ITEM_GROUP_COMMIT_*)
+add_item_group_commit = GroupCommit("add_item", _add_item_group)
+
+
+async def _run_write(
+        db: AsyncSession,
+        response: Response,
+        operation: str,
+        work: Callable[[], Awaitable[object]],
+        idempotency_key: str | None,
+        order_id: int,
+        payload: object,
+):
+    """Выполняет транзакцию записи; с `Idempotency-Key` — не больше раза на ключ.
+
+    Повтор с уже выполненным ключом получает сохранённый ответ с заголовком
+    `Idempotent-Replayed: true`. После записи сбрасываются кэши `ORDER_WRITE_CACHES`.
+    """
+
+    if idempotency_key is None:
+        result = await run_in_transaction(db, work, operation=operation)
+        api_cache.invalidate(*ORDER_WRITE_CACHES)
+        return result
+
+    async def encoded_work() -> object:
+        return jsonable_encoder(await work())
+
+    body, replayed = await run_idempotent(
+        db,
+        idempotency_key,
+        request_fingerprint(
+            operation, {"order_id": order_id}, jsonable_encoder(payload)
+        ),
+        encoded_work,
+        operation=operation,
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    else:
+        api_cache.invalidate(*ORDER_WRITE_CACHES)
+    return body
 
 
 @router.post("/{order_id}/items", response_model=AddItemResponse)
 async def add_item_to_order(
-        order_id: int, payload: AddItemRequest, db: Session = Depends(get_db)
+        order_id: int,
+        payload: AddItemRequest,
+        response: Response,
+        idempotency_key: IdempotencyKeyHeader = None,
+        db: AsyncSession = Depends(get_db),
 ):
     """Добавляет товар в заказ и списывает остаток на складе.
 
@@ -56,75 +452,235 @@ async def add_item_to_order(
     - если позиция уже есть, увеличивает `qty`;
     - если товара недостаточно на складе, возвращает HTTP 409.
 
+    Способ списания задаётся `STOCK_RESERVATION_MODE`:
+    - `locking` — строка товара блокируется `SELECT ... FOR UPDATE`, остаток
+      проверяется и уменьшается в приложении;
+    - `atomic` — проверка, списание и upsert позиции выполняются одним запросом,
+      блокировка строки не удерживается между обращениями к БД.
+
+    Остаток шардированного товара (`products.stock_shards > 0`) в обоих режимах
+    списывается из случайного свободного шарда `product_stock_shards`.
+
+    Суточные продажи товара в транзакции не обновляются: она дописывает событие
+    в outbox `order_events`, которое фоновый потребитель применяет к
+    `product_sales_daily` в пределах `ORDER_EVENTS_INTERVAL` секунд.
+
+    Транзакция, прерванная deadlock или ошибкой сериализации, повторяется
+    (`run_in_transaction`); если конфликт не разрешился, возвращается HTTP 503.
+
+    С `ADD_ITEM_GROUP_COMMIT_WINDOW > 0` запросы одного нешардированного товара
+    без `Idempotency-Key`, пришедшие за окно, выполняются одной транзакцией
+    (`_add_item_group`) независимо от `STOCK_RESERVATION_MODE`; каждый запрос
+    получает свой ответ или 404/409 в порядке поступления.
+
+    С заголовком `Idempotency-Key` повтор запроса (например, после таймаута)
+    не списывает остаток второй раз, а возвращает ответ первого выполнения;
+    тот же ключ с другим запросом — HTTP 422.
+
     Args:
         order_id: Идентификатор заказа.
         payload: Данные о добавляемом товаре и количестве.
+        response: Ответ FastAPI для заголовка `Idempotent-Replayed`.
+        idempotency_key: Ключ идемпотентности запроса.
         db: SQLAlchemy-сессия из зависимости FastAPI.
 
     Returns:
         AddItemResponse: Обновлённое количество позиции в заказе и текущий остаток.
     """
-    try:
-        logger.info("Пытаюсь начать транзакцию, order_id: %s", order_id)
-        with db.begin():
 
-            order_exists = db.execute(
-                select(Order.id).where(Order.id == order_id)
-            ).scalar_one_or_none()
-            if order_exists is None:
-                raise HTTPException(status_code=404, detail="Order not found")
+    async def work() -> AddItemResponse:
+        if payload.product_id in sharded_products:
+            return await _add_item_sharded(db, order_id, payload)
+        return await _add_item_unsharded(db, order_id, payload)
 
-            logger.info("Начата транзакция")
+    sample_transaction()
+    try:
+        transaction_logger.info("Пытаюсь начать транзакцию, order_id: %s", order_id)
+        result = None
+        if (
+            settings.add_item_group_commit_window > 0
+            and idempotency_key is None
+            and payload.product_id not in sharded_products
+        ):
+            result = await add_item_group_commit.submit(
+                payload.product_id,
+                (order_id, payload.quantity),
+                settings.add_item_group_commit_window,
+                settings.add_item_group_commit_max_size,
+            )
+            if result is not None:
+                api_cache.invalidate(*ORDER_WRITE_CACHES)
+        if result is None:
+            result = await _run_write(
+                db, response, "add_item", work, idempotency_key, order_id, payload
+            )
+        transaction_logger.info("Успешно выполнено, order_id: %s", order_id)
+        return result
 
-            product: Product | None = db.execute(
-                select(Product)
-                .where(Product.id == payload.product_id)
-                .with_for_update()
-            ).scalar_one_or_none()
+    except HTTPException as e:
+        transaction_logger.info(e)
+        if e.status_code == 409:
+            stock_conflicts.labels("add_item").inc()
+        raise
+    except TransactionConflictError:
+        # deadlock/ошибка сериализации повторялись до исчерпания попыток
+        raise HTTPException(
+            status_code=503,
+            detail="Transaction conflict, try again",
+            headers={"Retry-After": "1"},
+        )
+    except IdempotencyKeyReusedError:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key is already used by another request",
+        )
+    except Exception as e:
+        logger.info(e)
+        raise HTTPException(status_code=500, detail="Internet server error")
 
-            if product is None:
-                raise HTTPException(status_code=404, detail="Product not found")
 
-            if product.stock_qty < payload.quantity:
-                raise HTTPException(status_code=409, detail="Not enough stock")
+def _batch_results(
+        order_id: int,
+        payload: list[AddItemRequest],
+        qty_by_product: dict[int, int],
+        new_qty: dict[int, int],
+        remaining: dict[int, int],
+) -> list[AddItemResponse]:
+    """Ответ пакетного добавления: состояние после каждой строки запроса."""
 
-            # списываем остаток
-            product.stock_qty -= payload.quantity
-
-            # upsert в order_items
-            stmt = (
-                pg_insert(OrderItem)
-                .values(
-                    order_id=order_id,
-                    product_id=payload.product_id,
-                    qty=payload.quantity,
-                    unit_price=product.price,
-                )
-                .on_conflict_do_update(
-                    index_elements=[OrderItem.order_id, OrderItem.product_id],
-                    set_={
-                        OrderItem.qty: OrderItem.qty + payload.quantity,
-                        OrderItem.unit_price: product.price,
-                    },
-                )
-                .returning(OrderItem.qty)
+    # итог минус ещё не применённые строки того же товара
+    pending = dict(qty_by_product)
+    results = []
+    for item in payload:
+        pending[item.product_id] -= item.quantity
+        results.append(
+            AddItemResponse(
+                order_id=order_id,
+                product_id=item.product_id,
+                new_qty=int(new_qty[item.product_id] - pending[item.product_id]),
+                remaining_stock=int(
+                    remaining[item.product_id] + pending[item.product_id]
+                ),
             )
+        )
+    return results
+
 
-            new_qty = db.execute(stmt).scalar_one()
+@router.post("/{order_id}/items:batch", response_model=list[AddItemResponse])
+async def add_items_to_order(
+        order_id: int,
+        payload: Annotated[
+            list[AddItemRequest],
+            Body(min_length=1, max_length=MAX_BATCH_ITEMS),
+        ],
+        response: Response,
+        idempotency_key: IdempotencyKeyHeader = None,
+        db: AsyncSession = Depends(get_db),
+):
+    """Добавляет в заказ несколько товаров одной транзакцией.
 
-            db.flush()
-            logger.info("Успешно выполнено, order_id: %s", order_id)
+    Число обращений к БД не зависит от количества строк:
+    - строки всех товаров блокируются одним `SELECT ... FOR UPDATE` в порядке id;
+    - остатки проверяются для всех строк до записи, при нехватке хотя бы одного
+      товара ничего не списывается и возвращается HTTP 409;
+    - остатки списываются одним `UPDATE ... FROM (VALUES ...)`;
+    - позиции пишутся одним многострочным `INSERT ... ON CONFLICT`;
+    - остатки шардированных товаров списываются из шардов после проверки
+      остальных строк, по запросу на товар.
 
-            return AddItemResponse(
-                order_id=order_id,
-                product_id=payload.product_id,
-                new_qty=int(new_qty),
-                remaining_stock=int(product.stock_qty),
+    Повторяющиеся товары в запросе суммируются, а ответ по каждой строке
+    отражает состояние после её применения в порядке запроса. Конфликтующая
+    транзакция повторяется, а `Idempotency-Key` обрабатывается, как в
+    `add_item_to_order`.
+
+    Args:
+        order_id: Идентификатор заказа.
+        payload: Список добавляемых товаров и количеств.
+        response: Ответ FastAPI для заголовка `Idempotent-Replayed`.
+        idempotency_key: Ключ идемпотентности запроса.
+        db: SQLAlchemy-сессия из зависимости FastAPI.
+
+    Returns:
+        list[AddItemResponse]: Результат по каждой строке запроса.
+    """
+    qty_by_product: dict[int, int] = defaultdict(int)
+    for item in payload:
+        qty_by_product[item.product_id] += item.quantity
+
+    async def work() -> list[AddItemResponse]:
+        order_created_at = await get_order_created_at(db, order_id)
+        if order_created_at is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+
+        products = await lock_products(db, qty_by_product)
+        missing = qty_by_product.keys() - products.keys()
+        sharded = await get_sharded_products(db, missing) if missing else {}
+        if len(products) + len(sharded) != len(qty_by_product):
+            raise HTTPException(status_code=404, detail="Product not found")
+
+        if any(
+            product.stock_qty < qty_by_product[product_id]
+            for product_id, product in products.items()
+        ):
+            raise HTTPException(status_code=409, detail="Not enough stock")
+
+        remaining = await decrement_stock(
+            db, {product_id: qty_by_product[product_id] for product_id in products}
+        )
+        for product_id in sorted(sharded):
+            stock = await reserve_from_shards(
+                db, product_id, qty_by_product[product_id]
             )
+            if stock is None:
+                raise HTTPException(status_code=409, detail="Not enough stock")
+            remaining[product_id] = stock
+
+        prices = {
+            product_id: row.price
+            for product_id, row in (products | sharded).items()
+        }
+        new_qty = await upsert_order_items(
+            db,
+            order_id,
+            order_created_at,
+            {
+                product_id: (qty, prices[product_id])
+                for product_id, qty in qty_by_product.items()
+            },
+        )
+        await add_order_events(db, order_id, order_created_at, qty_by_product)
+        return _batch_results(order_id, payload, qty_by_product, new_qty, remaining)
+
+    sample_transaction()
+    try:
+        transaction_logger.info(
+            "Пытаюсь начать транзакцию, order_id: %s, товаров: %s",
+            order_id,
+            len(qty_by_product),
+        )
+        results = await _run_write(
+            db, response, "add_items_batch", work, idempotency_key, order_id, payload
+        )
+        transaction_logger.info("Успешно выполнено, order_id: %s", order_id)
+        return results
 
     except HTTPException as e:
-        logger.info(e)
+        transaction_logger.info(e)
+        if e.status_code == 409:
+            stock_conflicts.labels("add_items_batch").inc()
         raise
+    except TransactionConflictError:
+        # deadlock/ошибка сериализации повторялись до исчерпания попыток
+        raise HTTPException(
+            status_code=503,
+            detail="Transaction conflict, try again",
+            headers={"Retry-After": "1"},
+        )
+    except IdempotencyKeyReusedError:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key is already used by another request",
+        )
     except Exception as e:
         logger.info(e)
         raise HTTPException(status_code=500, detail="Internet server error")
@@ -1,7 +1,19 @@
 """Pydantic-схемы для API каталога и заказов."""
 
+from collections.abc import Callable, Mapping
+from datetime import date
+from types import NoneType, UnionType
+from typing import Any, Union, get_args, get_origin
+
 from pydantic import BaseModel, Field
 
+# Максимум строк в пакетном добавлении товаров в заказ
+MAX_BATCH_ITEMS = 100
+
+# Размер страницы списков по умолчанию и максимальный
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
 
 class AddItemRequest(BaseModel):
     """Запрос на добавление товара в заказ."""
@@ -27,6 +39,15 @@ class CategoryChildrenCountOut(BaseModel):
     children_count: int
 
 
+class CategoryOut(BaseModel):
+    """Категория с расстоянием до запрошенной категории в дереве."""
+
+    id: int
+    name: str
+    parent_id: int | None
+    depth: int
+
+
 class ClientStatistics(BaseModel):
     """Статистика клиента по общей сумме заказов."""
 
@@ -35,8 +56,76 @@ class ClientStatistics(BaseModel):
 
 
 class TopProductOut(BaseModel):
-    """Элемент ответа с данными о популярном товаре за последний месяц."""
+    """Элемент ответа с данными о популярном товаре за окно продаж."""
 
     product_name: str
     category_level1: str
     total_sold_qty: int
+
+
+class CategoryRevenueOut(BaseModel):
+    """Продажи и выручка корневой категории за окно."""
+
+    category_id: int
+    name: str
+    sold_qty: int
+    revenue: float
+
+
+class DailySalesOut(BaseModel):
+    """Продажи за сутки (UTC): число заказов, проданное количество и выручка."""
+
+    day: date
+    orders: int
+    sold_qty: int
+    revenue: float
+
+
+# Быстрый путь сериализации: строки БД преобразуются в dict по полям схемы без
+# построения и валидации Pydantic-моделей (формы строк гарантирует SQL).
+RowSerializer = Callable[[Mapping[str, Any]], dict]
+
+_SCALARS = (int, float, str, bool)
+
+
+def _field_converter(annotation: Any) -> Callable[[Any], Any] | None:
+    """Приведение значения колонки к типу поля (Decimal -> int и т. п.)."""
+
+    if annotation in _SCALARS:
+        return annotation
+    if get_origin(annotation) in (Union, UnionType):
+        args = [arg for arg in get_args(annotation) if arg is not NoneType]
+        convert = _field_converter(args[0]) if len(args) == 1 else None
+        if convert is not None:
+            return lambda value: None if value is None else convert(value)
+    return None
+
+
+def row_serializer(schema: type[BaseModel]) -> RowSerializer:
+    """Собирает сериализатор строки (mapping) в dict с полями `schema`."""
+
+    fields = [
+        (name, _field_converter(field.annotation))
+        for name, field in schema.model_fields.items()
+    ]
+
+    def serialize(row: Mapping[str, Any]) -> dict:
+        return {
+            name: convert(row[name]) if convert is not None else row[name]
+            for name, convert in fields
+        }
+
+    return serialize
+
+
+ROW_SERIALIZERS: dict[type[BaseModel], RowSerializer] = {
+    schema: row_serializer(schema)
+    for schema in (
+        CategoryChildrenCountOut,
+        CategoryOut,
+        CategoryRevenueOut,
+        ClientStatistics,
+        DailySalesOut,
+        TopProductOut,
+    )
+}
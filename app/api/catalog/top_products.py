@@ -1,19 +1,73 @@
-"""Эндпоинт для получения самых продаваемых товаров за 30 дней."""
+"""Эндпоинт для получения самых продаваемых товаров за окно продаж."""
 
 import logging
-from fastapi import APIRouter, Depends
-from app.db import get_db
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query, Response
+from app.api.catalog.categories import ensure_category_exists
+from app.api.pagination import cached_page, page_response
+from app.db import get_read_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.api.catalog.schemas import TopProductOut
-from app.repositories.catalog import get_top5_products_last_30_days
+from app.repositories.catalog import (
+    get_top_products_last_30_days,
+    get_top_products_since,
+)
+from app.sales_ranking import SalesWindow, sales_ranking, window_since
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/catalog", tags=["Catalog"])
 
+# Позиций в ответе не больше, чем хранит материализованное представление
+TOP_PRODUCTS_MAX_LIMIT = 100
+
 
 @router.get("/top-products", response_model=list[TopProductOut])
-async def get_top_products(db: Session = Depends(get_db)):
-    """Возвращает топ-5 товаров по количеству продаж за последний месяц."""
+async def get_top_products(
+    response: Response,
+    window: SalesWindow = Query("30d", description="окно продаж"),
+    category_id: int | None = Query(
+        None, description="топ в поддереве категории (по умолчанию — все)"
+    ),
+    limit: int = Query(5, ge=1, le=TOP_PRODUCTS_MAX_LIMIT),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Возвращает топ товаров по количеству продаж за окно, в том числе в
+    поддереве категории.
+
+    Окна `1h` и `24h` — последние 12 и 288 пятиминутных корзин времени
+    создания заказа, `7d` и `30d` — сутки (UTC), включая текущие. Отвечает из
+    рейтинга продаж в памяти процесса (`app.sales_ranking`). Пока он не
+    загружен, топ за 30 дней по всем категориям читается из материализованного
+    представления, остальные — из пятиминутных продаж; такие ответы кэшируются
+    на `CACHE_TTLS["top_products"]` секунд.
+
+    Args:
+        window: Окно продаж.
+        category_id: Категория, в поддереве которой считается топ.
+        limit: Сколько позиций вернуть.
+        response: Ответ FastAPI.
+        db: Читающая сессия (реплика или основная БД, см. `get_read_db`).
+
+    Raises:
+        HTTPException: 404, если категории нет.
+    """
+
+    ranking = sales_ranking.get(category_id)
+    if ranking is not None:
+        return page_response(
+            TopProductOut, ranking.top(window, limit, category_id), response
+        )
+
+    if category_id is not None:
+        await ensure_category_exists(db, category_id)
+
+    async def load(session: AsyncSession) -> tuple[list, None]:
+        if window == "30d" and category_id is None:
+            return await get_top_products_last_30_days(session, limit), None
+        rows = await get_top_products_since(
+            session, window_since(window), limit, category_id
+        )
+        return rows, None
 
-    return get_top5_products_last_30_days(db)
+    params = {"window": window, "category_id": category_id, "limit": limit}
+    return await cached_page("top_products", params, TopProductOut, db, response, load)
@@ -0,0 +1,14 @@
+"""Эндпоинт метрик Prometheus (вне API_PREFIX и OpenAPI)."""
+
+from fastapi import APIRouter, Response
+
+from app.metrics import CONTENT_TYPE, REGISTRY
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics() -> Response:
+    """Возвращает метрики процесса (или всех воркеров при `METRICS_DIR`)."""
+
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
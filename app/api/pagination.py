@@ -0,0 +1,210 @@
+"""Keyset-пагинация и потоковая выдача списков для эндпоинтов API.
+
+Курсор — непрозрачная строка (base64url от JSON-массива ключа сортировки
+последней строки страницы). Клиент передаёт его в `cursor`, а следующий курсор
+получает в заголовке `X-Next-Cursor`; заголовка нет на последней странице.
+
+Потоковый режим (`stream=ndjson|json`) читает строки курсором на стороне сервера
+пачками по `STREAM_BATCH_SIZE` и отдаёт их по мере чтения, не собирая весь список
+и не создавая Pydantic-модели на каждую строку.
+"""
+
+import base64
+import binascii
+import json
+import logging
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+from typing import Any, Literal
+
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import Executable, Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.catalog.schemas import ROW_SERIALIZERS
+from app.api.serialization import FastJSONResponse, dump_rows, dumps, serialize_rows
+from app.cache.responses import CachedResponse, api_cache, cache_key
+from app.db import read_session
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# Откуда взят ответ кэшируемого эндпоинта: hit, stale, miss, coalesced
+CACHE_STATUS_HEADER = "X-Cache"
+
+StreamFormat = Literal["ndjson", "json"]
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+
+def encode_cursor(*values: Any) -> str:
+    """Кодирует ключ сортировки строки в курсор."""
+
+    raw = json.dumps(values, default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str, *types: Callable[[Any], Any]) -> tuple:
+    """Разбирает курсор и приводит значения ключа к `types`.
+
+    Raises:
+        HTTPException: 400, если курсор повреждён или не подходит эндпоинту.
+    """
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        return tuple(cast(value) for cast, value in zip(types, values, strict=True))
+    except (binascii.Error, ValueError, TypeError, ArithmeticError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def set_next_cursor(response: Response, cursor: str | None) -> None:
+    """Передаёт курсор следующей страницы в заголовке ответа."""
+
+    if cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+
+
+def page_response(
+    schema: type[BaseModel],
+    rows: list,
+    response: Response,
+    next_cursor: str | None = None,
+) -> Any:
+    """Страница списка: через `response_model` или быстрым путём
+    (`FAST_SERIALIZATION`, см. `app.api.serialization`).
+
+    Args:
+        schema: Схема элемента списка из `response_model` эндпоинта.
+        rows: Строки из БД или кэша.
+        response: Ответ FastAPI из параметров эндпоинта.
+        next_cursor: Курсор следующей страницы.
+    """
+
+    if not settings.fast_serialization:
+        set_next_cursor(response, next_cursor)
+        return rows
+
+    fast_response = FastJSONResponse(serialize_rows(schema, rows))
+    set_next_cursor(fast_response, next_cursor)
+    return fast_response
+
+
+async def cached_page(
+    namespace: str,
+    params: dict,
+    schema: type[BaseModel],
+    db: AsyncSession,
+    response: Response,
+    load: Callable[[AsyncSession], Awaitable[tuple[list, str | None]]],
+) -> Any:
+    """Страница списка через кэш ответов (`app.cache.responses`).
+
+    Без кэша (`CACHE_BACKEND=none` или нулевой TTL маршрута) — то же, что
+    `page_response`. С кэшем страница сериализуется в JSON один раз при загрузке
+    (через схему или, при `FAST_SERIALIZATION`, сериализатором строк), а
+    загрузка идёт в собственной читающей сессии (`read_session`): её результат
+    нужен и другим запросам, и фоновому обновлению после ответа.
+
+    Args:
+        namespace: Пространство имён кэша (маршрут).
+        params: Параметры запроса, определяющие ответ.
+        schema: Схема элемента списка.
+        db: Сессия запроса (используется без кэша).
+        response: Ответ FastAPI из параметров эндпоинта.
+        load: Строки страницы и курсор следующей по сессии.
+    """
+
+    if not api_cache.enabled(namespace):
+        rows, next_cursor = await load(db)
+        return page_response(schema, rows, response, next_cursor)
+
+    async def build() -> CachedResponse:
+        async with read_session() as session:
+            rows, next_cursor = await load(session)
+        headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor is not None else {}
+        if settings.fast_serialization:
+            body = dumps(serialize_rows(schema, rows))
+        else:
+            body = dump_rows(schema, rows)
+        return CachedResponse(body, headers)
+
+    entry, result = await api_cache.get_or_load(namespace, cache_key(params), build)
+    return Response(
+        entry.body,
+        media_type="application/json",
+        headers={**entry.headers, CACHE_STATUS_HEADER: result},
+    )
+
+
+async def iterate_query(
+    stmt: Executable, params: dict | None = None
+) -> AsyncIterator[list[Row]]:
+    """Читает результат запроса пачками через курсор на стороне сервера.
+
+    Открывает собственную читающую сессию (`read_session`): поток живёт дольше
+    обработчика запроса и его зависимостей.
+    """
+
+    async with read_session() as session:
+        result = await session.stream(
+            stmt,
+            params,
+            execution_options={"yield_per": settings.stream_batch_size},
+        )
+        async for rows in result.partitions():
+            yield rows
+
+
+async def _encode(
+    batches: AsyncIterator[Iterable], schema: type[BaseModel], fmt: StreamFormat
+) -> AsyncIterator[bytes]:
+    serialize = ROW_SERIALIZERS[schema]
+    separator = b"\n" if fmt == "ndjson" else b","
+    first = True
+    if fmt == "json":
+        yield b"["
+    try:
+        async for batch in batches:
+            chunk = separator.join(
+                dumps(serialize(getattr(row, "_mapping", row))) for row in batch
+            )
+            if not chunk:
+                continue
+            if fmt == "ndjson":
+                chunk += b"\n"
+            elif not first:
+                chunk = b"," + chunk
+            first = False
+            yield chunk
+    except Exception:
+        # статус уже отправлен: обрываем поток, клиент увидит неполный ответ
+        logger.exception("Ошибка потоковой выдачи")
+        raise
+    if fmt == "json":
+        yield b"]"
+
+
+def stream_response(
+    batches: AsyncIterator[Iterable], schema: type[BaseModel], fmt: StreamFormat
+) -> StreamingResponse:
+    """Потоковый ответ NDJSON или JSON-массивом из пачек строк (элементы — `schema`)."""
+
+    return StreamingResponse(_encode(batches, schema, fmt), media_type=MEDIA_TYPES[fmt])
+
+
+async def in_batches(items: Iterable, size: int | None = None) -> AsyncIterator[list]:
+    """Отдаёт готовую последовательность пачками для `stream_response`."""
+
+    size = size or settings.stream_batch_size
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,61 @@
+"""Быстрая сериализация списков в ответах API (`FAST_SERIALIZATION`).
+
+По умолчанию эндпоинты возвращают строки БД, а FastAPI валидирует каждую через
+`response_model` и сериализует результат. В быстром режиме строки сразу
+превращаются в dict сериализатором схемы (`ROW_SERIALIZERS`) и кодируются
+orjson (если установлен, иначе стандартным `json`), минуя построение моделей.
+`response_model` остаётся в описании эндпоинта для OpenAPI.
+
+Тот же сериализатор и кодировщик использует потоковая выдача
+(`app.api.pagination`). Кэш ответов без быстрого режима кодирует страницы
+через схему (`dump_rows`), как `response_model`.
+"""
+
+import json
+from collections.abc import Iterable
+from functools import cache
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, TypeAdapter
+
+from app.api.catalog.schemas import ROW_SERIALIZERS
+
+try:
+    import orjson
+except ImportError:  # опциональная зависимость (extra `fast`)
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Кодирует JSON-совместимое значение в байты UTF-8."""
+
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON-ответ, кодируемый orjson без промежуточной валидации."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def serialize_rows(schema: type[BaseModel], rows: Iterable) -> list[dict]:
+    """Преобразует строки БД (Row, RowMapping или dict) в dict по полям `schema`."""
+
+    serialize = ROW_SERIALIZERS[schema]
+    return [serialize(getattr(row, "_mapping", row)) for row in rows]
+
+
+@cache
+def _list_adapter(schema: type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(list[schema])
+
+
+def dump_rows(schema: type[BaseModel], rows: Iterable) -> bytes:
+    """Кодирует строки в JSON-массив через валидацию `schema` (как `response_model`)."""
+
+    adapter = _list_adapter(schema)
+    return adapter.dump_json(adapter.validate_python(list(rows), from_attributes=True))
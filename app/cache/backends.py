@@ -0,0 +1,140 @@
+"""Хранилища кэша ответов: память процесса (TTL + LRU) или Redis.
+
+Бэкенд хранит байтовые значения по ключу внутри пространства имён (маршрута) и
+умеет целиком очищать пространство имён — этим пользуется инвалидация
+(`app.cache.responses`). Бэкенд выбирается настройкой `CACHE_BACKEND`.
+
+Redis-бэкенд использует опциональную зависимость `redis` (extra `redis`) и любой
+сервер, говорящий по протоколу Redis (RESP), в том числе локальную замену
+`python -m app.cache.standin`. Ошибки Redis не прерывают запрос: чтение
+считается промахом, запись пропускается.
+"""
+
+import logging
+import time
+from collections import OrderedDict
+
+from app.settings import settings
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # опциональная зависимость (extra `redis`)
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """Интерфейс хранилища кэша."""
+
+    async def get(self, namespace: str, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    async def set(self, namespace: str, key: str, value: bytes, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def clear(self, namespace: str) -> None:
+        """Удаляет все ключи пространства имён."""
+
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """Кэш в памяти процесса: LRU до `max_entries` ключей на пространство имён.
+
+    Истёкшие значения удаляются при чтении и вытесняются как давно не читанные.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._namespaces: dict[str, OrderedDict[str, tuple[float, bytes]]] = {}
+
+    async def get(self, namespace: str, key: str) -> bytes | None:
+        entries = self._namespaces.get(namespace)
+        entry = entries.get(key) if entries is not None else None
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del entries[key]
+            return None
+        entries.move_to_end(key)
+        return value
+
+    async def set(self, namespace: str, key: str, value: bytes, ttl: float) -> None:
+        entries = self._namespaces.setdefault(namespace, OrderedDict())
+        entries[key] = (time.monotonic() + ttl, value)
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    async def clear(self, namespace: str) -> None:
+        self._namespaces.pop(namespace, None)
+
+
+class RedisBackend(CacheBackend):
+    """Кэш в Redis: ключ `<prefix><namespace>:<key>` со сроком жизни `PX`.
+
+    Очистка пространства имён проходит ключи по `SCAN MATCH` и удаляет их
+    `UNLINK`, не блокируя сервер.
+    """
+
+    SCAN_COUNT = 1000
+
+    def __init__(self, url: str, prefix: str = "trade-tree:"):
+        if redis is None:
+            raise RuntimeError(
+                "CACHE_BACKEND=redis требует пакет redis: pip install redis"
+            )
+        self.prefix = prefix
+        # RESP2: его понимают и все версии Redis, и `app.cache.standin`
+        self._client = redis.Redis.from_url(url, protocol=2)
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}{namespace}:{key}"
+
+    async def get(self, namespace: str, key: str) -> bytes | None:
+        try:
+            return await self._client.get(self._key(namespace, key))
+        except redis.RedisError as e:
+            logger.warning("Кэш Redis недоступен (get): %s", e)
+            return None
+
+    async def set(self, namespace: str, key: str, value: bytes, ttl: float) -> None:
+        try:
+            await self._client.set(
+                self._key(namespace, key), value, px=max(1, int(ttl * 1000))
+            )
+        except redis.RedisError as e:
+            logger.warning("Кэш Redis недоступен (set): %s", e)
+
+    async def clear(self, namespace: str) -> None:
+        pattern = self._key(namespace, "*")
+        try:
+            cursor = 0
+            while True:
+                cursor, keys = await self._client.scan(
+                    cursor, match=pattern, count=self.SCAN_COUNT
+                )
+                if keys:
+                    await self._client.unlink(*keys)
+                if not cursor:
+                    break
+        except redis.RedisError as e:
+            logger.warning("Кэш Redis недоступен (clear %s): %s", namespace, e)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def create_backend() -> CacheBackend | None:
+    """Бэкенд по настройке `CACHE_BACKEND` (None — кэш выключен)."""
+
+    if settings.cache_backend == "memory":
+        return MemoryBackend(settings.cache_max_entries)
+    if settings.cache_backend == "redis":
+        return RedisBackend(settings.cache_redis_url)
+    return None
@@ -0,0 +1,204 @@
+"""Кэш готовых JSON-ответов аналитических эндпоинтов.
+
+Ответ кэшируется в пространстве имён маршрута (`top_products`,
+`clients_statistics`, `children_count`) по ключу из параметров запроса на
+`CACHE_TTLS[namespace]` секунд и ещё `CACHE_STALE_TTL` секунд хранится
+устаревшим:
+
+- свежий ответ отдаётся из кэша (`hit`);
+- устаревший отдаётся сразу, а обновление запускается в фоне (`stale`,
+  stale-while-revalidate);
+- при промахе ответ строит один запрос (`miss`), одновременные запросы того же
+  ключа ждут его результат (`coalesced`, single-flight в пределах процесса).
+
+Запись, меняющая данные маршрута, вызывает `invalidate(namespace)`: пространство
+имён очищается в фоне (подряд идущие инвалидации объединяются), а загрузки,
+начатые до инвалидации, не сохраняют свой результат.
+"""
+
+import asyncio
+import json
+import logging
+import struct
+import time
+from collections import defaultdict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field, replace
+
+from app.cache.backends import CacheBackend, create_backend
+from app.metrics import cache_requests
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Кэшируемые маршруты (пространства имён) и их метки в метриках
+RESPONSE_CACHES = ("top_products", "clients_statistics", "children_count")
+
+for _namespace in RESPONSE_CACHES:
+    for _result in ("hit", "stale", "miss", "coalesced"):
+        cache_requests.register_labels(_namespace, _result)
+
+# Заголовок значения: время до которого ответ свежий, длина JSON заголовков ответа
+_ENVELOPE = struct.Struct("!dI")
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    """Тело JSON-ответа, его заголовки и время, до которого он свежий (unix)."""
+
+    body: bytes
+    headers: dict[str, str] = field(default_factory=dict)
+    fresh_until: float = 0.0
+
+    def encode(self) -> bytes:
+        headers = json.dumps(self.headers).encode()
+        return _ENVELOPE.pack(self.fresh_until, len(headers)) + headers + self.body
+
+    @classmethod
+    def decode(cls, raw: bytes) -> "CachedResponse":
+        fresh_until, size = _ENVELOPE.unpack_from(raw)
+        start = _ENVELOPE.size
+        headers = json.loads(raw[start : start + size])
+        return cls(raw[start + size :], headers, fresh_until)
+
+
+def cache_key(params: dict) -> str:
+    """Ключ ответа из параметров запроса (без учёта порядка)."""
+
+    return json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class ResponseCache:
+    """Кэш ответов поверх `CacheBackend` с single-flight и stale-while-revalidate."""
+
+    def __init__(self):
+        self.backend: CacheBackend | None = None
+        self._loads: dict[tuple[str, str], asyncio.Task] = {}
+        self._generations: dict[str, int] = defaultdict(int)
+        self._clearing: dict[str, asyncio.Task] = {}
+        self._clear_again: set[str] = set()
+
+    def start(self) -> None:
+        """Создаёт бэкенд по настройкам (`CACHE_BACKEND=none` — кэш выключен)."""
+
+        self.backend = create_backend()
+
+    async def close(self) -> None:
+        """Дожидается фоновых очисток, отменяет загрузки и закрывает бэкенд."""
+
+        loads = list(self._loads.values())
+        for task in loads:
+            task.cancel()
+        await asyncio.gather(
+            *loads, *self._clearing.values(), return_exceptions=True
+        )
+        if self.backend is not None:
+            await self.backend.close()
+            self.backend = None
+
+    def enabled(self, namespace: str) -> bool:
+        """Кэшируются ли ответы пространства имён (есть бэкенд и TTL)."""
+
+        return self.backend is not None and settings.cache_ttls.get(namespace, 0) > 0
+
+    async def get_or_load(
+        self,
+        namespace: str,
+        key: str,
+        load: Callable[[], Awaitable[CachedResponse]],
+    ) -> tuple[CachedResponse, str | None]:
+        """Ответ из кэша или от `load`.
+
+        Returns:
+            tuple[CachedResponse, str | None]: Ответ и способ его получения
+            (`hit`, `stale`, `miss`, `coalesced`; None — кэш не используется).
+        """
+
+        if not self.enabled(namespace):
+            return await load(), None
+        ttl = settings.cache_ttls[namespace]
+
+        raw = await self.backend.get(namespace, key)
+        if raw is not None:
+            entry = CachedResponse.decode(raw)
+            if entry.fresh_until > time.time():
+                result = "hit"
+            else:
+                self._start_load(namespace, key, load, ttl)
+                result = "stale"
+            cache_requests.labels(namespace, result).inc()
+            return entry, result
+
+        result = "coalesced" if (namespace, key) in self._loads else "miss"
+        cache_requests.labels(namespace, result).inc()
+        # загрузка не отменяется вместе с запросом: её результат ждут другие
+        task = self._start_load(namespace, key, load, ttl)
+        return await asyncio.shield(task), result
+
+    def invalidate(self, *namespaces: str) -> None:
+        """Очищает пространства имён в фоне; загрузки, начатые раньше, не сохраняются."""
+
+        if self.backend is None:
+            return
+        for namespace in namespaces:
+            self._generations[namespace] += 1
+            if namespace in self._clearing:
+                self._clear_again.add(namespace)
+                continue
+            self._clearing[namespace] = asyncio.create_task(
+                self._clear(namespace), name=f"cache_clear_{namespace}"
+            )
+
+    def _start_load(
+        self,
+        namespace: str,
+        key: str,
+        load: Callable[[], Awaitable[CachedResponse]],
+        ttl: float,
+    ) -> asyncio.Task:
+        task = self._loads.get((namespace, key))
+        if task is None:
+            task = asyncio.create_task(self._load(namespace, key, load, ttl))
+            self._loads[namespace, key] = task
+            task.add_done_callback(
+                lambda done: self._load_done(namespace, key, done)
+            )
+        return task
+
+    def _load_done(self, namespace: str, key: str, task: asyncio.Task) -> None:
+        if self._loads.get((namespace, key)) is task:
+            del self._loads[namespace, key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(
+                "Не удалось обновить кэш %s %s: %r", namespace, key, task.exception()
+            )
+
+    async def _load(
+        self,
+        namespace: str,
+        key: str,
+        load: Callable[[], Awaitable[CachedResponse]],
+        ttl: float,
+    ) -> CachedResponse:
+        generation = self._generations[namespace]
+        entry = replace(await load(), fresh_until=time.time() + ttl)
+        if self._generations[namespace] == generation:
+            await self.backend.set(
+                namespace, key, entry.encode(), ttl + settings.cache_stale_ttl
+            )
+        return entry
+
+    async def _clear(self, namespace: str) -> None:
+        try:
+            while True:
+                self._clear_again.discard(namespace)
+                await self.backend.clear(namespace)
+                if namespace not in self._clear_again:
+                    break
+        except Exception:
+            logger.exception("Не удалось очистить кэш %s", namespace)
+        finally:
+            del self._clearing[namespace]
+
+
+api_cache = ResponseCache()
@@ -0,0 +1,201 @@
+"""Локальная замена Redis для разработки и бенчмарков кэша ответов.
+
+Однопроцессный asyncio-сервер протокола RESP2 (без HELLO: клиент подключается с
+`protocol=2`, как `RedisBackend`) с подмножеством команд, которых достаточно
+`RedisBackend` и клиенту `redis-py`: PING, GET, SET (EX/PX/NX/XX),
+DEL, UNLINK, EXISTS, SCAN (MATCH/COUNT), DBSIZE, FLUSHDB/FLUSHALL, SELECT, CLIENT.
+Данные хранятся в памяти процесса, срок жизни ключей проверяется при обращении.
+
+    python -m app.cache.standin --port 6379
+    CACHE_BACKEND=redis CACHE_REDIS_URL=redis://localhost:6379/0 uvicorn app.main:app
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+OK = b"+OK\r\n"
+NULL = b"$-1\r\n"
+
+
+def _bulk(value: bytes) -> bytes:
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def _array(items: list[bytes]) -> bytes:
+    return b"*%d\r\n" % len(items) + b"".join(items)
+
+
+def _integer(value: int) -> bytes:
+    return b":%d\r\n" % value
+
+
+def _error(message: str) -> bytes:
+    return b"-ERR %s\r\n" % message.encode()
+
+
+class StandinServer:
+    """Хранилище ключей и исполнение команд RESP."""
+
+    def __init__(self):
+        # ключ -> (порядковый номер вставки, срок жизни, значение); номер служит
+        # курсором SCAN, который не сбивается от удаления уже пройденных ключей
+        self._data: dict[bytes, tuple[int, float | None, bytes]] = {}
+        self._next_seq = 1
+
+    def _live(self, key: bytes) -> bytes | None:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        _, expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def execute(self, args: list[bytes]) -> bytes:
+        name = args[0].upper().decode()
+        handler = getattr(self, f"cmd_{name.lower()}", None)
+        if handler is None:
+            return _error(f"unknown command '{name}'")
+        try:
+            return handler(*args[1:])
+        except (TypeError, ValueError):
+            return _error(f"wrong arguments for '{name}' command")
+
+    def cmd_ping(self, message: bytes | None = None) -> bytes:
+        return _bulk(message) if message is not None else b"+PONG\r\n"
+
+    def cmd_get(self, key: bytes) -> bytes:
+        value = self._live(key)
+        return NULL if value is None else _bulk(value)
+
+    def cmd_set(self, key: bytes, value: bytes, *options: bytes) -> bytes:
+        expires_at = None
+        exists = self._live(key) is not None
+        options_iter = iter(options)
+        for option in options_iter:
+            option = option.upper()
+            if option == b"EX":
+                expires_at = time.monotonic() + int(next(options_iter))
+            elif option == b"PX":
+                expires_at = time.monotonic() + int(next(options_iter)) / 1000
+            elif option == b"NX" and exists or option == b"XX" and not exists:
+                return NULL
+            elif option not in (b"NX", b"XX"):
+                raise ValueError(option)
+        entry = self._data.get(key)
+        if entry is None:
+            seq = self._next_seq
+            self._next_seq += 1
+        else:
+            seq = entry[0]
+        self._data[key] = (seq, expires_at, value)
+        return OK
+
+    def cmd_del(self, *keys: bytes) -> bytes:
+        removed = 0
+        for key in keys:
+            if self._live(key) is not None:
+                del self._data[key]
+                removed += 1
+        return _integer(removed)
+
+    cmd_unlink = cmd_del
+
+    def cmd_exists(self, *keys: bytes) -> bytes:
+        return _integer(sum(self._live(key) is not None for key in keys))
+
+    def cmd_scan(self, cursor: bytes, *options: bytes) -> bytes:
+        pattern, count = "*", 10
+        options_iter = iter(options)
+        for option in options_iter:
+            if option.upper() == b"MATCH":
+                pattern = next(options_iter).decode("latin-1")
+            elif option.upper() == b"COUNT":
+                count = int(next(options_iter))
+            else:
+                raise ValueError(option)
+        start = int(cursor)
+        page = [key for key, entry in self._data.items() if entry[0] >= start][:count]
+        next_cursor = 0
+        if page and self._data[page[-1]][0] + 1 < self._next_seq:
+            next_cursor = self._data[page[-1]][0] + 1
+        found = [
+            _bulk(key)
+            for key in page
+            if self._live(key) is not None
+            and fnmatch.fnmatchcase(key.decode("latin-1"), pattern)
+        ]
+        return _array([_bulk(str(next_cursor).encode()), _array(found)])
+
+    def cmd_dbsize(self) -> bytes:
+        return _integer(sum(self._live(key) is not None for key in list(self._data)))
+
+    def cmd_flushdb(self, *options: bytes) -> bytes:
+        self._data.clear()
+        return OK
+
+    cmd_flushall = cmd_flushdb
+
+    def cmd_select(self, db: bytes) -> bytes:
+        return OK
+
+    def cmd_client(self, *args: bytes) -> bytes:
+        return OK
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while (args := await _read_command(reader)) is not None:
+                if args:
+                    writer.write(self.execute(args))
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _read_command(reader: asyncio.StreamReader) -> list[bytes] | None:
+    """Читает команду: массив bulk-строк или inline-строку (None — конец потока)."""
+
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.split()
+    args = []
+    for _ in range(int(line[1:])):
+        header = await reader.readline()
+        size = int(header[1:])
+        args.append((await reader.readexactly(size + 2))[:-2])
+    return args
+
+
+async def serve(host: str, port: int) -> None:
+    server = await asyncio.start_server(StandinServer().handle, host, port)
+    logger.info("RESP stand-in слушает %s:%s", host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def cli(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if "__main__" == __name__:
+    cli()
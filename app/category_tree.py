@@ -0,0 +1,318 @@
+"""Кэш дерева категорий в памяти процесса с инвалидацией через LISTEN/NOTIFY.
+
+Дерево строится из строк `categories` при старте приложения и хранится в компактных
+массивах (родитель, глубина, корень и дочерние узлы в CSR-формате), поэтому подсчёт
+детей, предки, корень и поддерево отвечают за микросекунды без обращения к БД.
+
+Каждое изменение `categories` увеличивает `category_tree_version.version` и отправляет
+новую версию в канал `category_tree`. Воркер перезагружает дерево, если пришедшая
+версия больше загруженной; периодический опрос версии страхует от пропущенных
+уведомлений (например, при переподключении слушателя).
+"""
+
+import asyncio
+import logging
+from array import array
+from bisect import bisect_right
+from collections.abc import Iterable
+
+import asyncpg
+from sqlalchemy import select
+
+from app.cache.responses import api_cache
+from app.db import SessionLocal, asyncpg_dsn
+from app.metrics import cache_requests
+from app.models import Category, CategoryTreeVersion
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "category_tree"
+
+cache_hits = cache_requests.labels("category_tree", "hit")
+cache_misses = cache_requests.labels("category_tree", "miss")
+
+
+class CategoryTree:
+    """Неизменяемый снимок дерева категорий.
+
+    Узлы адресуются позицией в отсортированном массиве id; связи хранятся
+    позициями, поэтому обход не создаёт промежуточных объектов.
+    """
+
+    __slots__ = (
+        "version",
+        "_pos",
+        "_ids",
+        "_names",
+        "_parents",
+        "_depths",
+        "_roots",
+        "_child_offsets",
+        "_children",
+        "_first_level",
+    )
+
+    def __init__(self, rows: Iterable[tuple[int, str, int | None]], version: int):
+        """Строит дерево из строк (id, name, parent_id).
+
+        Категория с родителем, отсутствующим в выборке, считается корнем.
+        """
+
+        self.version = version
+        nodes = sorted(rows)
+        self._ids = array("q", (node[0] for node in nodes))
+        self._names = [node[1] for node in nodes]
+        self._pos = {category_id: i for i, category_id in enumerate(self._ids)}
+        size = len(nodes)
+
+        self._parents = array("l", [-1]) * size
+        for i, (_, _, parent_id) in enumerate(nodes):
+            if parent_id is not None:
+                self._parents[i] = self._pos.get(parent_id, -1)
+
+        # дети в CSR: children[child_offsets[i]:child_offsets[i + 1]], по имени
+        buckets: list[list[int]] = [[] for _ in range(size)]
+        roots: list[int] = []
+        for i in range(size):
+            parent = self._parents[i]
+            (buckets[parent] if parent >= 0 else roots).append(i)
+        self._child_offsets = array("l", [0]) * (size + 1)
+        self._children = array("l")
+        for i, bucket in enumerate(buckets):
+            bucket.sort(key=self._sort_key)
+            self._children.extend(bucket)
+            self._child_offsets[i + 1] = len(self._children)
+
+        # глубина и корень обходом в ширину от корней (узлы в циклах недостижимы)
+        self._depths = array("l", [-1]) * size
+        self._roots = array("l", [-1]) * size
+        queue = sorted(roots, key=self._sort_key)
+        for root in queue:
+            self._depths[root] = 0
+            self._roots[root] = root
+        for i in queue:
+            for child in self._children_pos(i):
+                self._depths[child] = self._depths[i] + 1
+                self._roots[child] = self._roots[i]
+                queue.append(child)
+
+        self._first_level = sorted(
+            (i for i in range(size) if self._depths[i] == 1), key=self._sort_key
+        )
+
+    def _sort_key(self, pos: int) -> tuple[str, int]:
+        return self._names[pos], self._ids[pos]
+
+    def _children_pos(self, pos: int) -> array:
+        return self._children[self._child_offsets[pos] : self._child_offsets[pos + 1]]
+
+    def _node(self, pos: int) -> dict:
+        parent = self._parents[pos]
+        return {
+            "id": self._ids[pos],
+            "name": self._names[pos],
+            "parent_id": self._ids[parent] if parent >= 0 else None,
+        }
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, category_id: int) -> bool:
+        return category_id in self._pos
+
+    def children_count(self, category_id: int) -> int:
+        """Число прямых потомков категории."""
+
+        pos = self._pos[category_id]
+        return self._child_offsets[pos + 1] - self._child_offsets[pos]
+
+    def root_of(self, category_id: int) -> int | None:
+        """Id корневой категории (первого уровня иерархии)."""
+
+        root = self._roots[self._pos[category_id]]
+        return self._ids[root] if root >= 0 else None
+
+    def ancestors(self, category_id: int) -> list[dict]:
+        """Предки категории от родителя к корню; `depth` — расстояние от категории."""
+
+        result = []
+        pos = self._parents[self._pos[category_id]]
+        while pos >= 0 and len(result) < len(self._ids):
+            result.append({**self._node(pos), "depth": len(result) + 1})
+            pos = self._parents[pos]
+        return result
+
+    def subtree(self, category_id: int) -> list[dict]:
+        """Категория и все её потомки; `depth` — расстояние от категории."""
+
+        levels = [(self._pos[category_id], 0)]
+        for pos, depth in levels:
+            levels.extend((child, depth + 1) for child in self._children_pos(pos))
+        nodes = [{**self._node(pos), "depth": depth} for pos, depth in levels]
+        nodes.sort(key=lambda node: (node["depth"], node["name"], node["id"]))
+        return nodes
+
+    def children_count_first_level(
+        self, after: tuple[str, int] | None = None, limit: int | None = None
+    ) -> list[dict]:
+        """Категории первого уровня (дети корней) и число их прямых потомков.
+
+        Args:
+            after: Ключ (name, id), после которого начинается страница.
+            limit: Размер страницы (None — до конца).
+        """
+
+        start = (
+            bisect_right(self._first_level, after, key=self._sort_key)
+            if after is not None
+            else 0
+        )
+        stop = start + limit if limit is not None else None
+        return [
+            {
+                "id": self._ids[pos],
+                "name": self._names[pos],
+                "children_count": self._child_offsets[pos + 1]
+                - self._child_offsets[pos],
+            }
+            for pos in self._first_level[start:stop]
+        ]
+
+
+class CategoryTreeCache:
+    """Держит актуальный `CategoryTree` процесса и перезагружает его по NOTIFY."""
+
+    def __init__(self) -> None:
+        self._tree: CategoryTree | None = None
+        self._reload_lock = asyncio.Lock()
+        self._listener: asyncpg.Connection | None = None
+        self._poll_task: asyncio.Task | None = None
+        self._reloads: set[asyncio.Task] = set()
+
+    @property
+    def tree(self) -> CategoryTree | None:
+        """Текущий снимок дерева или None, если кэш ещё не загружен."""
+
+        return self._tree
+
+    def get(self, category_id: int | None = None) -> CategoryTree | None:
+        """Снимок дерева для ответа из кэша (с `category_id` — если категория в нём есть).
+
+        Учитывает попадание или промах в метрике `cache_requests`.
+        """
+
+        tree = self._tree
+        if tree is None or (category_id is not None and category_id not in tree):
+            cache_misses.inc()
+            return None
+        cache_hits.inc()
+        return tree
+
+    @property
+    def version(self) -> int:
+        """Загруженная версия дерева (0 — не загружено)."""
+
+        return self._tree.version if self._tree is not None else 0
+
+    async def load(self) -> CategoryTree:
+        """Загружает дерево и его версию из одного снимка БД."""
+
+        async with SessionLocal() as session:
+            async with session.begin():
+                await session.connection(
+                    execution_options={"isolation_level": "REPEATABLE READ"}
+                )
+                version = (
+                    await session.execute(select(CategoryTreeVersion.version))
+                ).scalar_one_or_none()
+                rows = (
+                    await session.execute(
+                        select(Category.id, Category.name, Category.parent_id)
+                    )
+                ).all()
+
+        tree = CategoryTree(rows, version or 0)
+        self._tree = tree
+        logger.info(
+            "Загружено дерево категорий: %s узлов, версия %s", len(tree), tree.version
+        )
+        return tree
+
+    async def reload_if_stale(self, version: int | None = None) -> bool:
+        """Перезагружает дерево, если версия в БД (или из уведомления) новее загруженной.
+
+        Returns:
+            bool: True, если дерево было перезагружено.
+        """
+
+        async with self._reload_lock:
+            if version is None:
+                async with SessionLocal() as session:
+                    version = (
+                        await session.execute(select(CategoryTreeVersion.version))
+                    ).scalar_one_or_none() or 0
+            if self._tree is not None and version <= self._tree.version:
+                return False
+            await self.load()
+            api_cache.invalidate("children_count")
+            return True
+
+    async def start(self) -> None:
+        """Загружает дерево и подписывается на уведомления об изменениях."""
+
+        try:
+            await self.load()
+            await self._listen()
+        except Exception:
+            logger.exception("Кэш дерева категорий недоступен, запросы пойдут в БД")
+        self._poll_task = asyncio.create_task(
+            self._poll(), name="category_tree_poll"
+        )
+
+    async def stop(self) -> None:
+        """Отписывается от уведомлений и останавливает фоновые задачи."""
+
+        tasks = [*self._reloads, *([self._poll_task] if self._poll_task else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._listener is not None and not self._listener.is_closed():
+            await self._listener.close()
+        self._listener = None
+
+    async def _listen(self) -> None:
+        self._listener = await asyncpg.connect(asyncpg_dsn())
+        await self._listener.add_listener(NOTIFY_CHANNEL, self._on_notify)
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        try:
+            version = int(payload)
+        except ValueError:
+            version = None
+        if version is not None and version <= self.version:
+            return
+        task = asyncio.create_task(self._reload(version))
+        self._reloads.add(task)
+        task.add_done_callback(self._reloads.discard)
+
+    async def _reload(self, version: int | None) -> None:
+        try:
+            await self.reload_if_stale(version)
+        except Exception:
+            logger.exception("Не удалось перезагрузить дерево категорий")
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(settings.category_tree_poll_interval)
+            try:
+                if self._listener is None or self._listener.is_closed():
+                    await self._listen()
+                await self.reload_if_stale()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Проверка версии дерева категорий не удалась")
+
+
+category_tree = CategoryTreeCache()
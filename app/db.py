@@ -1,23 +1,418 @@
-"""Настройки подключения к базе данных и фабрика сессий SQLAlchemy."""
+"""Настройки подключения к базе данных и фабрики сессий SQLAlchemy.
 
-from sqlalchemy import create_engine
+Асинхронный движок инструментирован событиями `before/after_cursor_execute`:
+длительность и число строк каждого запроса добавляются в `QueryStats`
+текущего HTTP-запроса (см. `SQLTimingMiddleware` в `app.main`), а запросы
+дольше `SLOW_QUERY_THRESHOLD_MS` пишутся в журнал медленных запросов
+(логгер `app.sql.slow`), при `SLOW_QUERY_EXPLAIN` — с планом
+`EXPLAIN (ANALYZE, BUFFERS)` для запросов с опциями выполнения `EXPLAIN_SAFE`.
+Состояние пула и ожидание соединения учитываются в метриках (`app.metrics`);
+время запросов и ожидание соединения подстраивают лимит допуска запросов
+(`app.services.admission`).
+
+Читающие эндпоинты получают сессию через `get_read_db`: при заданных
+`DATABASE_REPLICA_URLS` она по кругу идёт на здоровые реплики, а без реплик
+или когда все реплики недоступны или отстают — на основную БД (см. `ReplicaRouter`).
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from collections.abc import AsyncIterator
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import Engine, create_engine, event, make_url, text
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm import sessionmaker
-from app.settings import settings
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from app.metrics import (
+    db_pool_checked_out,
+    db_pool_checkout_wait,
+    db_pool_overflow,
+    db_pool_size,
+    db_read_sessions,
+    db_replica_checks,
+)
+from app.services.admission import admission
+from app.settings import settings, to_async_url
 
-engine = create_engine(settings.database_url)
+logger = logging.getLogger(__name__)
 
-SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений, учитывающий в метриках время ожидания соединения."""
 
-def get_db():
-    """Предоставляет сессию БД для зависимостей FastAPI.
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            wait = time.perf_counter() - started
+            db_pool_checkout_wait.observe(wait)
+            admission.observe_pool_wait(wait)
 
-    Yields:
-        Session: SQLAlchemy-сессия с автоматическим закрытием после запроса.
+
+engine = create_async_engine(
+    settings.async_database_url,
+    poolclass=InstrumentedQueuePool,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=settings.db_pool_pre_ping,
+)
+
+SessionLocal = async_sessionmaker(
+    bind=engine, autoflush=False, expire_on_commit=False
+)
+
+# Синхронный движок для CLI-скриптов (seed, обслуживание), не для запросов API.
+sync_engine = create_engine(settings.database_url)
+
+SyncSessionLocal = sessionmaker(bind=sync_engine, autocommit=False, autoflush=False)
+
+slow_query_logger = logging.getLogger("app.sql.slow")
+
+# Опции выполнения запроса: его можно повторить под EXPLAIN ANALYZE. Ставится
+# явно на читающие запросы без побочных эффектов; по тексту запроса это не
+# определить (select pg_try_advisory_lock(...) или вызов функции с DDL)
+EXPLAIN_SAFE = {"explain_safe": True}
+
+# Одновременно выполняется не больше одного EXPLAIN медленного запроса
+_explain_running = False
+# Ссылки на задачи EXPLAIN, чтобы сборщик мусора не удалил их до завершения
+_explain_tasks: set[asyncio.Task] = set()
+# Асинхронные движки по синхронным (из событий курсора): EXPLAIN выполняется на
+# той же БД, что и медленный запрос (основной или реплике)
+_async_engines: dict[Engine, AsyncEngine] = {}
+
+
+@dataclass
+class QueryStats:
+    """SQL-запросы, выполненные при обработке одного HTTP-запроса."""
+
+    # ASGI scope запроса: шаблон маршрута появляется в нём после роутинга
+    scope: dict = field(default_factory=dict)
+    count: int = 0
+    duration: float = 0.0
+    rows: int = 0
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        path = getattr(route, "path", None) or self.scope.get("path", "-")
+        return f"{self.scope.get('method', '-')} {path}"
+
+    def add(self, duration: float, rows: int) -> None:
+        self.count += 1
+        self.duration += duration
+        self.rows += rows
+
+    def server_timing(self, total: float) -> str:
+        """Значение заголовка Server-Timing: время SQL и всего запроса, мс."""
+
+        return (
+            f'db;dur={self.duration * 1000:.1f};desc="{self.count} queries, {self.rows} rows", '
+            f"total;dur={total * 1000:.1f}"
+        )
+
+
+# Статистика текущего HTTP-запроса; None вне запросов (фоновые задачи, CLI)
+current_query_stats: ContextVar[QueryStats | None] = ContextVar(
+    "current_query_stats", default=None
+)
+
+
+@event.listens_for(engine.sync_engine, "checkout")
+def _update_pool_metrics(*args) -> None:
+    pool = engine.sync_engine.pool
+    db_pool_size.set(pool.size())
+    db_pool_checked_out.set(pool.checkedout())
+    db_pool_overflow.set(max(pool.overflow(), 0))
+
+
+@event.listens_for(engine.sync_engine, "checkin")
+def _update_pool_metrics_after_checkin(*args) -> None:
+    # событие приходит до возврата соединения в пул: обновляем метрики после него
+    try:
+        asyncio.get_running_loop().call_soon(_update_pool_metrics)
+    except RuntimeError:
+        _update_pool_metrics()
+
+
+def _instrument(async_engine: AsyncEngine) -> None:
+    """Подключает учёт времени запросов и журнал медленных запросов к движку."""
+
+    sync = async_engine.sync_engine
+    _async_engines[sync] = async_engine
+    event.listen(sync, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync, "after_cursor_execute", _after_cursor_execute)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info.pop("query_started")
+    # у курсора на стороне сервера строки ещё не прочитаны: rowcount = -1
+    rows = max(cursor.rowcount, 0)
+    admission.observe_query(duration)
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.add(duration, rows)
+
+    threshold = settings.slow_query_threshold_ms
+    if not threshold or duration * 1000 < threshold:
+        return
+    if context.execution_options.get("slow_query_explain"):
+        return
+    route = stats.route if stats is not None else "-"
+    slow_query_logger.warning(
+        "Медленный запрос %.1f мс, строк %s, %s: %s; параметры: %.500r",
+        duration * 1000,
+        rows if cursor.rowcount >= 0 else "?",
+        route,
+        " ".join(statement.split()),
+        parameters,
+    )
+    if (
+        settings.slow_query_explain
+        and not _explain_running
+        and context.execution_options.get("explain_safe")
+        and not context.execution_options.get("stream_results")
+    ):
+        task = asyncio.get_running_loop().create_task(
+            _explain_slow_query(
+                _async_engines.get(conn.engine, engine), statement, parameters, route
+            )
+        )
+        _explain_tasks.add(task)
+        task.add_done_callback(_explain_tasks.discard)
+
+
+async def _explain_slow_query(
+    source: AsyncEngine, statement: str, parameters, route: str
+) -> None:
+    """Логирует план медленного читающего запроса отдельным соединением движка
+    `source`, на котором выполнялся запрос.
+
+    EXPLAIN ANALYZE повторно выполняет запрос, поэтому берутся только запросы
+    с опциями `EXPLAIN_SAFE`, транзакция откатывается, а соединение не
+    возвращается в пул (инвалидируется): состояние сеанса, которое не снимает
+    откат, не достаётся следующим запросам.
     """
 
-    db = SessionLocal()
+    global _explain_running
+    _explain_running = True
+    current_query_stats.set(None)
     try:
-        yield db
+        async with source.connect() as conn:
+            conn = await conn.execution_options(slow_query_explain=True)
+            result = await conn.exec_driver_sql(
+                "EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters
+            )
+            plan = "\n".join(row[0] for row in result)
+            await conn.rollback()
+            await conn.invalidate()
+        slow_query_logger.warning("EXPLAIN (ANALYZE, BUFFERS), %s:\n%s", route, plan)
+    except Exception:
+        slow_query_logger.exception("Не удалось получить план медленного запроса")
     finally:
-        db.close()
+        _explain_running = False
+
+
+_instrument(engine)
+
+# Отставание реплики, сек: 0, если всё полученное WAL уже применено (на
+# простаивающей основной БД время последней транзакции не меняется); NULL —
+# неизвестно. Сервер не в режиме восстановления считается репликой без отставания.
+REPLICA_LAG_SQL = text(
+    """
+    select pg_is_in_recovery() as in_recovery,
+           case
+               when not pg_is_in_recovery()
+                    or pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() then 0
+               else extract(epoch from now() - pg_last_xact_replay_timestamp())
+           end as lag
+    """
+)
+
+
+@dataclass
+class Replica:
+    """Реплика для чтения и результат её последней проверки."""
+
+    name: str
+    url: str
+    engine: AsyncEngine
+    sessionmaker: async_sessionmaker
+    healthy: bool = False
+    lag: float | None = None
+
+
+class ReplicaRouter:
+    """Распределяет читающие сессии по здоровым репликам.
+
+    Реплики проверяются при старте и затем каждые `DB_REPLICA_CHECK_INTERVAL`
+    секунд: недоступная реплика и реплика с отставанием больше
+    `DB_REPLICA_MAX_LAG` исключаются до следующей успешной проверки. Обрыв
+    соединения во время запроса исключает реплику сразу. Сессии выдаются по
+    кругу; если здоровых реплик нет, читающий запрос идёт на основную БД.
+    """
+
+    def __init__(self, urls: list[str]):
+        self.replicas = [
+            self._create_replica(f"replica{i}", url) for i, url in enumerate(urls)
+        ]
+        self._next = itertools.count()
+        self._check_task: asyncio.Task | None = None
+
+    def _create_replica(self, name: str, url: str) -> Replica:
+        replica_engine = create_async_engine(
+            to_async_url(url),
+            pool_size=settings.db_replica_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_recycle=settings.db_pool_recycle,
+            pool_pre_ping=settings.db_pool_pre_ping,
+        )
+        _instrument(replica_engine)
+        replica = Replica(
+            name,
+            make_url(url).render_as_string(hide_password=True),
+            replica_engine,
+            async_sessionmaker(
+                bind=replica_engine, autoflush=False, expire_on_commit=False
+            ),
+        )
+
+        @event.listens_for(replica_engine.sync_engine, "handle_error")
+        def _mark_down(context) -> None:
+            if context.is_disconnect and replica.healthy:
+                replica.healthy = False
+                logger.warning(
+                    "Реплика %s недоступна: %s",
+                    replica.name,
+                    context.original_exception,
+                )
+
+        for result in ("ok", "lagging", "down"):
+            db_replica_checks.register_labels(name, result)
+        return replica
+
+    def session(self) -> AsyncSession:
+        """Сессия на следующей здоровой реплике или на основной БД."""
+
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            db_read_sessions.labels("primary").inc()
+            return SessionLocal()
+        db_read_sessions.labels("replica").inc()
+        return healthy[next(self._next) % len(healthy)].sessionmaker()
+
+    async def check(self, replica: Replica) -> None:
+        """Проверяет доступность и отставание реплики и обновляет её состояние."""
+
+        lag = None
+        try:
+            async with asyncio.timeout(settings.db_replica_check_interval):
+                async with replica.engine.connect() as conn:
+                    row = (await conn.execute(REPLICA_LAG_SQL)).one()
+            lag = float(row.lag) if row.lag is not None else None
+            lagging = lag is None or lag > settings.db_replica_max_lag
+            result = "lagging" if lagging else "ok"
+        except Exception as e:
+            logger.debug("Проверка реплики %s: %r", replica.name, e)
+            result = "down"
+
+        healthy = result == "ok"
+        if healthy != replica.healthy:
+            log = logger.info if healthy else logger.warning
+            log(
+                "Реплика %s (%s): %s, отставание %s сек",
+                replica.name,
+                replica.url,
+                "используется" if healthy else f"исключена ({result})",
+                "?" if lag is None else f"{lag:.1f}",
+            )
+        replica.healthy = healthy
+        replica.lag = lag
+        db_replica_checks.labels(replica.name, result).inc()
+
+    async def check_all(self) -> None:
+        await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+
+    async def start(self) -> None:
+        """Проверяет реплики и запускает их периодическую проверку."""
+
+        if not self.replicas:
+            return
+        await self.check_all()
+        self._check_task = asyncio.create_task(self._poll(), name="replica_checks")
+
+    async def stop(self) -> None:
+        """Останавливает проверки и закрывает пулы соединений реплик."""
+
+        if self._check_task is not None:
+            self._check_task.cancel()
+            await asyncio.gather(self._check_task, return_exceptions=True)
+            self._check_task = None
+        for replica in self.replicas:
+            replica.healthy = False
+            await replica.engine.dispose()
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(settings.db_replica_check_interval)
+            await self.check_all()
+
+
+replicas = ReplicaRouter(settings.database_replica_urls)
+
+
+def read_session() -> AsyncSession:
+    """Сессия для запросов только на чтение (реплика или основная БД).
+
+    Данные реплики могут отставать от основной БД на `DB_REPLICA_MAX_LAG`
+    секунд; запросы, которым нужны только что записанные данные, используют
+    `SessionLocal`.
+    """
+
+    return replicas.session()
+
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    """Предоставляет асинхронную сессию БД для зависимостей FastAPI.
+
+    Yields:
+        AsyncSession: SQLAlchemy-сессия с автоматическим закрытием после запроса.
+    """
+
+    async with SessionLocal() as db:
+        yield db
+
+
+async def get_read_db() -> AsyncIterator[AsyncSession]:
+    """Предоставляет сессию для читающих эндпоинтов (см. `read_session`).
+
+    Yields:
+        AsyncSession: Сессия реплики или основной БД, закрывается после запроса.
+    """
+
+    async with read_session() as db:
+        yield db
+
+
+def asyncpg_dsn() -> str:
+    """DSN для прямого подключения asyncpg (LISTEN/NOTIFY и др.) без SQLAlchemy."""
+
+    url = make_url(settings.async_database_url).set(drivername="postgresql")
+    return url.render_as_string(hide_password=False)
@@ -1,30 +1,156 @@
+"""Настройка логирования: очередь записей и фоновый поток вывода.
+
+Логгеры пишут в ограниченную очередь (`QueueHandler`), а файлы и консоль
+обслуживает `QueueListener` в отдельном потоке, поэтому запись лога в обработчике
+запроса — это форматирование сообщения и `put` в очередь без файлового ввода-вывода.
+При переполненной очереди запись отбрасывается и учитывается в метрике
+`trade_tree_log_records_dropped_total`.
+
+Настройки (`app.settings`): `LOG_LEVEL`, уровни отдельных логгеров `LOG_LEVELS`
+(JSON, например `{"app.transactions": "WARNING"}`), формат `LOG_FORMAT=text|json`,
+размер очереди `LOG_QUEUE_SIZE` и доля записываемых логов отдельных транзакций
+`LOG_TRANSACTION_SAMPLE_RATE` (логгер `app.transactions`, предупреждения и ошибки
+пишутся всегда). Решение принимается один раз на запрос (`sample_transaction`),
+поэтому логи попавшей в выборку транзакции пишутся целиком.
+"""
+
+import atexit
+import copy
+import json
 import logging
-from logging.handlers import TimedRotatingFileHandler
-from app.settings import BASE_DIR
+import queue
+import random
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+from app.metrics import log_records_dropped
+from app.settings import BASE_DIR, settings
+
+# Логгер сообщений о каждой транзакции записи (начало, результат)
+TRANSACTION_LOGGER = "app.transactions"
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Пишутся ли INFO-логи транзакции текущего запроса; None — решение не принято
+transaction_sampled: ContextVar[bool | None] = ContextVar(
+    "transaction_sampled", default=None
+)
+
+# Атрибуты LogRecord, которые не считаются полями `extra`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON: время, уровень, логгер, сообщение и поля `extra`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """`QueueHandler`, отбрасывающий запись при переполненной очереди."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # аргументы подставляются сразу (они могут измениться до записи), а
+        # исключение форматирует поток вывода: очередь не покидает процесс
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+
+def sample_transaction() -> None:
+    """Решает для текущего запроса, пишутся ли INFO-логи его транзакции.
+
+    Вызывается в начале обработчика записи: все записи `app.transactions` этого
+    запроса (начало, результат, 404/409) попадают в лог вместе или не попадают.
+    """
+
+    transaction_sampled.set(random.random() < settings.log_transaction_sample_rate)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает INFO-записи транзакций, попавших в выборку (`sample_transaction`);
+    записи вне такого запроса — с вероятностью `rate`, остальные уровни — всегда."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        sampled = transaction_sampled.get()
+        if sampled is None:
+            return random.random() < self.rate
+        return sampled
+
+
+def _file_handler(path) -> TimedRotatingFileHandler:
+    return TimedRotatingFileHandler(
+        path, when="D", interval=1, backupCount=14, encoding="utf-8"
+    )
 
 
 def setup_logging() -> None:
     root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
+    root_logger.setLevel(settings.log_level.upper())
 
     if root_logger.handlers:
         return
 
     log_dir = BASE_DIR / "logs"
     log_dir.mkdir(parents=True, exist_ok=True)
-    log_path = log_dir / "trade-tree.log"
-
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
 
-    file_handler = TimedRotatingFileHandler(
-        log_path, when="D", interval=1, backupCount=14, encoding="utf-8"
-    )
-    file_handler.setFormatter(formatter)
+    if settings.log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
 
+    file_handler = _file_handler(log_dir / "trade-tree.log")
     console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
 
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
+    # медленные SQL-запросы дополнительно пишутся в отдельный файл
+    slow_query_handler = _file_handler(log_dir / "slow-queries.log")
+    slow_query_handler.addFilter(logging.Filter("app.sql.slow"))
+
+    handlers = (file_handler, console_handler, slow_query_handler)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(settings.log_queue_size)
+    root_logger.addHandler(DroppingQueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # дописывает оставшиеся в очереди записи при завершении процесса
+    atexit.register(listener.stop)
+
+    for name, level in settings.log_levels.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    rate = settings.log_transaction_sample_rate
+    transaction_logger = logging.getLogger(TRANSACTION_LOGGER)
+    if rate <= 0:
+        transaction_logger.setLevel(
+            max(transaction_logger.getEffectiveLevel(), logging.WARNING)
+        )
+    elif rate < 1:
+        transaction_logger.addFilter(SamplingFilter(rate))
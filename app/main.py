@@ -1,11 +1,24 @@
 """Точка входа FastAPI-приложения."""
 
 import logging
+import time
 from contextlib import asynccontextmanager
 from app.settings import BASE_DIR, settings
+from app.api.metrics import router as metrics_router
 from app.api.router import api_router
 from app.logging_config import setup_logging
+from app.db import QueryStats, current_query_stats, engine, replicas
+from app.metrics import REGISTRY, http_requests_in_flight, observe_request, register_routes
+from app.cache.responses import api_cache
+from app.analytics.snapshot import analytics_snapshot
+from app.category_tree import category_tree
+from app.sales_ranking import sales_ranking
+from app.services.admission import AdmissionRejectedError, admission, classify
+from app.tasks import start_background_tasks, stop_background_tasks
 from fastapi import FastAPI
+from starlette.datastructures import MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 # Настраиваем логирование
 setup_logging()
@@ -14,11 +27,148 @@ logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    REGISTRY.open(settings.metrics_dir)
     logger.info("App started: trade-tree")
+    if settings.category_tree_cache_enabled:
+        await category_tree.start()
+    if settings.sales_ranking_enabled:
+        await sales_ranking.start()
+    await replicas.start()
+    api_cache.start()
+    if settings.admission_control_enabled:
+        admission.start()
+    if settings.analytics_snapshot_interval > 0:
+        await analytics_snapshot.start()
+    tasks = start_background_tasks()
     yield
+    await stop_background_tasks(tasks)
+    await analytics_snapshot.stop()
+    await sales_ranking.stop()
+    await category_tree.stop()
+    await api_cache.close()
+    await replicas.stop()
+    await engine.dispose()
+    REGISTRY.close()
     logger.info("App stopped: trade-tree")
 
 
+class SQLTimingMiddleware:
+    """Собирает SQL-статистику HTTP-запроса (см. `app.db.QueryStats`).
+
+    Время SQL и всего запроса до начала ответа передаётся в заголовке
+    `Server-Timing`; у потоковых ответов запросы после отправки заголовков
+    в него не попадают, но учитываются в итоговой строке DEBUG-лога.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.sql_timing_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(scope)
+        token = current_query_stats.set(stats)
+        started = time.perf_counter()
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing", stats.server_timing(time.perf_counter() - started)
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_query_stats.reset(token)
+            logger.debug(
+                "%s: SQL-запросов %d, %.1f мс, строк %d, всего %.1f мс",
+                stats.route,
+                stats.count,
+                stats.duration * 1000,
+                stats.rows,
+                (time.perf_counter() - started) * 1000,
+            )
+
+
+class MetricsMiddleware:
+    """Учитывает HTTP-запросы в метриках: длительность по маршруту, код ответа,
+    число запросов в обработке (см. `app.metrics`).
+
+    Длительность — до отправки всего тела ответа, включая потоковые.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.metrics_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            route = scope.get("route")
+            observe_request(
+                scope["method"],
+                getattr(route, "path", None),
+                status,
+                time.perf_counter() - started,
+            )
+
+
+class AdmissionMiddleware:
+    """Допускает запросы к API в пределах адаптивного лимита процесса
+    (см. `app.services.admission`); не допущенные сразу получают 503 с
+    `Retry-After`, не дожидаясь соединения с БД.
+
+    Место запроса занято до отправки всего тела ответа, включая потоковые.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.admission_control_enabled:
+            await self.app(scope, receive, send)
+            return
+        route_class = classify(scope["method"], scope["path"])
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await admission.acquire(route_class)
+        except AdmissionRejectedError as e:
+            logger.debug("Запрос не допущен: %s %s (%s)", scope["method"], scope["path"], e)
+            response = JSONResponse(
+                {"detail": "Service overloaded, try again"},
+                status_code=503,
+                headers={"Retry-After": str(settings.admission_retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.release(route_class)
+
+
 def create_app() -> FastAPI:
     """Создаёт и настраивает экземпляр FastAPI.
 
@@ -31,7 +181,12 @@ def create_app() -> FastAPI:
         lifespan=lifespan,
     )
     
+    app.add_middleware(AdmissionMiddleware)
+    app.add_middleware(SQLTimingMiddleware)
+    app.add_middleware(MetricsMiddleware)
     app.include_router(api_router, prefix=settings.api_prefix)
+    app.include_router(metrics_router)
+    register_routes(app.routes)
     return app
 
 
@@ -0,0 +1,141 @@
+"""Команды обслуживания БД: шардирование остатков, сверка агрегатов, партиции заказов.
+
+    python -m app.maintenance shard-stock --product-id 1 --shards 16
+    python -m app.maintenance unshard-stock --product-id 1
+    python -m app.maintenance rebalance-stock [--product-id 1]
+    python -m app.maintenance reconcile-customer-totals
+    python -m app.maintenance reconcile-product-sales [--days 30]
+    python -m app.maintenance order-partitions [--months-ahead 3] [--retention-months 12]
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timezone
+
+from app.db import SessionLocal, engine
+from app.repositories.catalog import rebuild_recent_product_sales
+from app.repositories.customers import reconcile_customer_totals
+from app.repositories.partitions import maintain_order_partitions
+from app.settings import settings
+from app.repositories.stock_shards import (
+    list_sharded_product_ids,
+    rebalance_product_stock,
+    shard_product_stock,
+    unshard_product_stock,
+)
+
+
+async def shard_stock(args: argparse.Namespace) -> None:
+    async with SessionLocal() as session, session.begin():
+        total = await shard_product_stock(session, args.product_id, args.shards)
+    if total is None:
+        raise SystemExit(f"Товар {args.product_id} не найден")
+    print(f"Остаток товара {args.product_id} ({total}) разделён на {args.shards} шардов")
+
+
+async def unshard_stock(args: argparse.Namespace) -> None:
+    async with SessionLocal() as session, session.begin():
+        total = await unshard_product_stock(session, args.product_id)
+    if total is None:
+        raise SystemExit(f"Товар {args.product_id} не найден")
+    print(f"Остаток товара {args.product_id} ({total}) возвращён в products.stock_qty")
+
+
+async def rebalance_stock(args: argparse.Namespace) -> None:
+    if args.product_id is not None:
+        product_ids = [args.product_id]
+    else:
+        async with SessionLocal() as session:
+            product_ids = await list_sharded_product_ids(session)
+
+    changed = 0
+    for product_id in product_ids:
+        async with SessionLocal() as session, session.begin():
+            changed += await rebalance_product_stock(session, product_id)
+    print(f"Перебалансировано товаров: {changed} из {len(product_ids)}")
+
+
+async def reconcile_totals(args: argparse.Namespace) -> None:
+    async with SessionLocal() as session, session.begin():
+        result = await reconcile_customer_totals(session)
+    print(
+        f"customer_totals: исправлено строк {result.fixed}, удалено {result.removed}"
+    )
+
+
+async def reconcile_sales(args: argparse.Namespace) -> None:
+    async with SessionLocal() as session, session.begin():
+        rows = await rebuild_recent_product_sales(session, args.days)
+    print(f"product_sales_daily: пересчитано за {args.days} сут., строк {rows}")
+
+
+async def order_partitions(args: argparse.Namespace) -> None:
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        result = await maintain_order_partitions(
+            conn,
+            datetime.now(timezone.utc).date(),
+            args.months_ahead,
+            args.retention_months,
+        )
+    if result is None:
+        raise SystemExit("Партициями заказов сейчас занимается другой процесс")
+    archived = ", ".join(result.archived) or "нет"
+    print(f"Создано партиций: {result.created}, перенесено в архив: {archived}")
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("shard-stock", help="разделить остаток товара на шарды")
+    command.add_argument("--product-id", type=int, required=True)
+    command.add_argument("--shards", type=int, required=True, choices=range(1, 257),
+                         metavar="1..256")
+    command.set_defaults(handler=shard_stock)
+
+    command = commands.add_parser("unshard-stock", help="собрать шарды остатка обратно")
+    command.add_argument("--product-id", type=int, required=True)
+    command.set_defaults(handler=unshard_stock)
+
+    command = commands.add_parser("rebalance-stock", help="выровнять шарды остатка")
+    command.add_argument("--product-id", type=int, help="по умолчанию — все товары")
+    command.set_defaults(handler=rebalance_stock)
+
+    command = commands.add_parser(
+        "reconcile-customer-totals", help="пересчитать customer_totals из заказов"
+    )
+    command.set_defaults(handler=reconcile_totals)
+
+    command = commands.add_parser(
+        "reconcile-product-sales",
+        help="пересчитать product_sales_daily и product_sales_buckets за последние "
+        "сутки из позиций заказов",
+    )
+    command.add_argument("--days", type=int, default=30, choices=range(1, 3661),
+                         metavar="1..3660")
+    command.set_defaults(handler=reconcile_sales)
+
+    command = commands.add_parser(
+        "order-partitions",
+        help="создать партиции заказов вперёд и перенести устаревшие в архив",
+    )
+    command.add_argument("--months-ahead", type=int,
+                         default=settings.order_partition_months_ahead)
+    command.add_argument("--retention-months", type=int,
+                         default=settings.order_partition_retention_months,
+                         help="0 — не архивировать")
+    command.set_defaults(handler=order_partitions)
+
+    return parser.parse_args(argv)
+
+
+async def main(args: argparse.Namespace) -> None:
+    try:
+        await args.handler(args)
+    finally:
+        await engine.dispose()
+
+
+if "__main__" == __name__:
+    asyncio.run(main(parse_args()))
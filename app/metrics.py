@@ -0,0 +1,469 @@
+"""Метрики приложения в текстовом формате Prometheus (`GET /metrics`).
+
+Все наборы меток регистрируются заранее (маршруты — при создании приложения),
+и каждому значению выделяется фиксированная ячейка в плоском массиве double.
+Запись в метрику — прибавление к ячейке без блокировок: в процессе один поток
+event loop, а в многопроцессном режиме у каждого процесса свой файл.
+
+Многопроцессный режим (`METRICS_DIR`, например несколько воркеров uvicorn):
+каждый воркер отображает в память (mmap) файл `<pid>.db` в этом каталоге и пишет
+только в него; `/metrics` любого воркера суммирует файлы всех процессов.
+Счётчики и гистограммы суммируются по всем файлам, в том числе завершившихся
+воркеров, gauge — только по живым процессам. Каталог очищается перед запуском
+сервера. Без `METRICS_DIR` значения хранятся в памяти процесса.
+"""
+
+import mmap
+import os
+import zlib
+from bisect import bisect_left
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DOUBLE_SIZE = 8
+
+# Заголовок файла: контрольная сумма раскладки ячеек и pid процесса
+HEADER_SLOTS = 2
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+GROUP_COMMIT_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+ORDER_EVENT_LAG_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+HTTP_STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+
+# Метки запросов, не попавших ни в один маршрут
+UNMATCHED_ROUTE = ("*", "<unmatched>")
+
+
+class Registry:
+    """Раскладка ячеек всех метрик и их хранилище (память процесса или mmap-файл)."""
+
+    def __init__(self) -> None:
+        self.metrics: list["Metric"] = []
+        self.size = HEADER_SLOTS
+        self.gauge_slots: set[int] = set()
+        self._values: memoryview | None = None
+        self._mmap: mmap.mmap | None = None
+        self._directory: Path | None = None
+
+    def allocate(self, slots: int, gauge: bool = False) -> int:
+        """Выделяет `slots` ячеек и возвращает индекс первой.
+
+        Raises:
+            RuntimeError: Хранилище уже создано — раскладка зафиксирована.
+        """
+
+        if self._values is not None:
+            raise RuntimeError("Метки метрик регистрируются до первой записи")
+        offset = self.size
+        self.size += slots
+        if gauge:
+            self.gauge_slots.update(range(offset, self.size))
+        return offset
+
+    @property
+    def values(self) -> memoryview:
+        values = self._values
+        if values is None:
+            values = self._values = memoryview(bytearray(self.size * DOUBLE_SIZE)).cast("d")
+        return values
+
+    @property
+    def layout_checksum(self) -> float:
+        layout = ";".join(
+            f"{metric.name}{list(metric.children)}" for metric in self.metrics
+        )
+        return float(zlib.crc32(layout.encode()))
+
+    def open(self, directory: str | None) -> None:
+        """Переводит хранилище в файл `<directory>/<pid>.db` (None — в память процесса).
+
+        Уже записанные значения переносятся в новое хранилище.
+        """
+
+        if not directory:
+            return
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        path = self._directory / f"{os.getpid()}.db"
+        with open(path, "w+b") as file:
+            file.truncate(self.size * DOUBLE_SIZE)
+            self._mmap = mmap.mmap(file.fileno(), self.size * DOUBLE_SIZE)
+        values = memoryview(self._mmap).cast("d")
+        if self._values is not None:
+            values[HEADER_SLOTS:] = self._values[HEADER_SLOTS:]
+        values[0] = self.layout_checksum
+        values[1] = float(os.getpid())
+        self._values = values
+
+    def close(self) -> None:
+        if self._mmap is None:
+            return
+        values = self._values
+        self._values = memoryview(bytearray(self.size * DOUBLE_SIZE)).cast("d")
+        self._values[:] = values
+        values.release()
+        self._mmap.close()
+        self._mmap = None
+
+    def collect(self) -> list[float]:
+        """Значения всех ячеек: свои или суммарные по файлам всех процессов."""
+
+        if self._directory is None:
+            return self.values.tolist()
+
+        totals = [0.0] * self.size
+        checksum = self.layout_checksum
+        for path in self._directory.glob("*.db"):
+            try:
+                data = memoryview(path.read_bytes()).cast("d")
+            except (OSError, TypeError):
+                continue
+            if len(data) != self.size or data[0] != checksum:
+                # файл другой версии приложения
+                continue
+            live = _process_alive(int(data[1]))
+            for i in range(HEADER_SLOTS, self.size):
+                if live or i not in self.gauge_slots:
+                    totals[i] += data[i]
+        return totals
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+
+        values = self.collect()
+        lines: list[str] = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for label_values, child in metric.children.items():
+                labels = dict(zip(metric.labelnames, label_values))
+                lines.extend(child.render(metric.name, labels, values))
+        return "\n".join(lines) + "\n"
+
+
+def _process_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r'\"').replace("\n", r"\n")
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Metric:
+    """Метрика с заранее зарегистрированными наборами значений меток."""
+
+    kind = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        labelsets: Iterable[Sequence[str]] = (),
+        registry: Registry | None = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry or REGISTRY
+        self.children: dict[tuple[str, ...], object] = {}
+        self.registry.metrics.append(self)
+        if not self.labelnames:
+            self.register_labels()
+        for label_values in labelsets:
+            self.register_labels(*label_values)
+
+    def register_labels(self, *label_values: str):
+        """Регистрирует набор значений меток и возвращает его ячейки."""
+
+        if len(label_values) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}")
+        child = self.children.get(label_values)
+        if child is None:
+            child = self.children[label_values] = self._child()
+        return child
+
+    def labels(self, *label_values: str):
+        """Ячейки зарегистрированного набора меток.
+
+        Raises:
+            KeyError: Набор меток не зарегистрирован.
+        """
+
+        return self.children[label_values]
+
+    def _child(self):
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("registry", "slot")
+
+    def __init__(self, registry: Registry, gauge: bool = False):
+        self.registry = registry
+        self.slot = registry.allocate(1, gauge)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.registry.values[self.slot] += amount
+
+    def render(self, name: str, labels: dict, values: list[float]) -> list[str]:
+        return [f"{name}{_format_labels(labels)} {_format_value(values[self.slot])}"]
+
+
+class _GaugeValue(_Value):
+    __slots__ = ()
+
+    def __init__(self, registry: Registry):
+        super().__init__(registry, gauge=True)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.registry.values[self.slot] -= amount
+
+    def set(self, value: float) -> None:
+        self.registry.values[self.slot] = value
+
+
+class _HistogramValue:
+    __slots__ = ("registry", "buckets", "slot")
+
+    def __init__(self, registry: Registry, buckets: tuple[float, ...]):
+        self.registry = registry
+        self.buckets = buckets
+        # счётчики корзин (последняя — +Inf), затем сумма наблюдений
+        self.slot = registry.allocate(len(buckets) + 2)
+
+    def observe(self, value: float) -> None:
+        values = self.registry.values
+        values[self.slot + bisect_left(self.buckets, value)] += 1
+        values[self.slot + len(self.buckets) + 1] += value
+
+    def render(self, name: str, labels: dict, values: list[float]) -> list[str]:
+        lines = []
+        count = 0.0
+        for i, bound in enumerate((*self.buckets, float("inf"))):
+            count += values[self.slot + i]
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(
+                f"{name}_bucket{_format_labels(labels | {'le': le})} {_format_value(count)}"
+            )
+        total = values[self.slot + len(self.buckets) + 1]
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {_format_value(count)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _child(self) -> _Value:
+        return _Value(self.registry)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.children[()].inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _child(self) -> _GaugeValue:
+        return _GaugeValue(self.registry)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.children[()].inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.children[()].dec(amount)
+
+    def set(self, value: float) -> None:
+        self.children[()].set(value)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(*args, **kwargs)
+
+    def _child(self) -> _HistogramValue:
+        return _HistogramValue(self.registry, self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.children[()].observe(value)
+
+
+REGISTRY = Registry()
+
+http_request_duration = Histogram(
+    "trade_tree_http_request_duration_seconds",
+    "Длительность обработки HTTP-запроса по маршруту, сек.",
+    ("method", "route"),
+    [UNMATCHED_ROUTE],
+)
+http_requests = Counter(
+    "trade_tree_http_requests_total",
+    "HTTP-запросы по маршруту и классу кода ответа.",
+    ("method", "route", "status"),
+    [(*UNMATCHED_ROUTE, status) for status in HTTP_STATUS_CLASSES],
+)
+http_requests_in_flight = Gauge(
+    "trade_tree_http_requests_in_flight", "HTTP-запросы в обработке."
+)
+
+db_pool_size = Gauge("trade_tree_db_pool_size", "Постоянных соединений в пуле.")
+db_pool_checked_out = Gauge(
+    "trade_tree_db_pool_checked_out", "Соединений пула, выданных сессиям."
+)
+db_pool_overflow = Gauge(
+    "trade_tree_db_pool_overflow", "Соединений сверх DB_POOL_SIZE."
+)
+db_pool_checkout_wait = Histogram(
+    "trade_tree_db_pool_checkout_wait_seconds",
+    "Ожидание соединения из пула (включая открытие нового), сек.",
+    buckets=POOL_WAIT_BUCKETS,
+)
+
+stock_conflicts = Counter(
+    "trade_tree_stock_conflicts_total",
+    "Ответы 409 Not enough stock при добавлении в заказ.",
+    ("endpoint",),
+    [("add_item",), ("add_items_batch",)],
+)
+# Транзакции записи, выполняемые через app.services.unit_of_work
+TRANSACTION_LABELS = [
+    (operation, reason)
+    for operation in ("add_item", "add_items_batch")
+    for reason in ("deadlock", "serialization")
+]
+transaction_retries = Counter(
+    "trade_tree_transaction_retries_total",
+    "Повторы транзакций после конфликта сериализации или deadlock.",
+    ("operation", "reason"),
+    TRANSACTION_LABELS,
+)
+transaction_conflicts = Counter(
+    "trade_tree_transaction_conflicts_total",
+    "Транзакции, не выполненные после всех повторов (ответ 503).",
+    ("operation", "reason"),
+    TRANSACTION_LABELS,
+)
+
+cache_requests = Counter(
+    "trade_tree_cache_requests_total",
+    "Обращения к кэшам: hit — ответ из кэша, miss — из БД, stale — устаревший "
+    "ответ с фоновым обновлением, coalesced — ожидание загрузки другого запроса.",
+    ("cache", "result"),
+    [
+        (cache, result)
+        for cache in ("category_tree", "idempotency", "sales_ranking")
+        for result in ("hit", "miss")
+    ],
+)
+group_commit_size = Histogram(
+    "trade_tree_group_commit_size",
+    "Запросов в одной группе групповой фиксации (ADD_ITEM_GROUP_COMMIT_*).",
+    ("operation",),
+    [("add_item",)],
+    buckets=GROUP_COMMIT_SIZE_BUCKETS,
+)
+idempotent_replays = Counter(
+    "trade_tree_idempotent_replays_total",
+    "Повторы запросов с Idempotency-Key, получившие сохранённый ответ.",
+    ("operation",),
+    [("add_item",), ("add_items_batch",)],
+)
+
+db_read_sessions = Counter(
+    "trade_tree_db_read_sessions_total",
+    "Сессии читающих эндпоинтов: replica — на реплике, primary — на основной БД "
+    "(реплик нет, все недоступны или отстают).",
+    ("target",),
+    [("replica",), ("primary",)],
+)
+db_replica_checks = Counter(
+    "trade_tree_db_replica_checks_total",
+    "Проверки реплик: ok — реплика используется, lagging — отставание больше "
+    "DB_REPLICA_MAX_LAG или неизвестно, down — недоступна.",
+    ("replica", "result"),
+)
+
+order_events_applied = Counter(
+    "trade_tree_order_events_applied_total",
+    "События order_events, применённые к агрегатам.",
+)
+order_event_lag = Histogram(
+    "trade_tree_order_event_lag_seconds",
+    "Возраст самого старого события пачки order_events при её применении, сек.",
+    buckets=ORDER_EVENT_LAG_BUCKETS,
+)
+
+admission_requests = Counter(
+    "trade_tree_admission_requests_total",
+    "Допуск HTTP-запросов по классу маршрута: admitted — сразу, queued — после "
+    "ожидания в очереди, rejected — очередь заполнена, timeout — ожидание истекло "
+    "(оба ответа 503).",
+    ("class", "result"),
+    [
+        (route_class, result)
+        for route_class in ("write", "read", "analytics")
+        for result in ("admitted", "queued", "rejected", "timeout")
+    ],
+)
+admission_limit = Gauge(
+    "trade_tree_admission_limit",
+    "Адаптивный лимит одновременных запросов (сумма по воркерам).",
+)
+
+log_records_dropped = Counter(
+    "trade_tree_log_records_dropped_total",
+    "Записи лога, отброшенные из-за переполненной очереди.",
+)
+
+
+def register_routes(routes: Iterable) -> None:
+    """Регистрирует метки HTTP-метрик для маршрутов приложения."""
+
+    for route in routes:
+        for method in sorted(getattr(route, "methods", None) or ()):
+            http_request_duration.register_labels(method, route.path)
+            for status in HTTP_STATUS_CLASSES:
+                http_requests.register_labels(method, route.path, status)
+
+
+def observe_request(method: str, route: str | None, status: int, duration: float) -> None:
+    """Учитывает завершённый HTTP-запрос по шаблону маршрута."""
+
+    key = (method, route)
+    histogram = http_request_duration.children.get(key)
+    if histogram is None:
+        key = UNMATCHED_ROUTE
+        histogram = http_request_duration.children[key]
+    histogram.observe(duration)
+    status_class = HTTP_STATUS_CLASSES[min(max(status // 100, 1), 5) - 1]
+    http_requests.labels(*key, status_class).inc()
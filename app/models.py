@@ -7,11 +7,18 @@ from sqlalchemy import (
     Integer,
     Numeric,
     ForeignKey,
+    ForeignKeyConstraint,
     DateTime,
+    Date,
     func,
     Index,
     DECIMAL,
+    FetchedValue,
+    SmallInteger,
+    CheckConstraint,
+    text,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 
 
 class Base(DeclarativeBase):
@@ -37,6 +44,44 @@ class Category(Base):
     __table_args__ = (Index("ix_categories_parent_id", parent_id),)
 
 
+class CategoryClosure(Base):
+    """Closure table иерархии категорий: все пары предок-потомок с глубиной.
+
+    Содержит и пару (id, id) с глубиной 0. Поддерживается триггерами на `categories`.
+    """
+
+    __tablename__ = "category_closure"
+
+    ancestor_id: Mapped[int] = mapped_column(
+        BigInteger, ForeignKey("categories.id", ondelete="CASCADE"), primary_key=True
+    )
+    descendant_id: Mapped[int] = mapped_column(
+        BigInteger, ForeignKey("categories.id", ondelete="CASCADE"), primary_key=True
+    )
+    depth: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_category_closure_ancestor_depth", ancestor_id, depth),
+        Index("ix_category_closure_descendant_depth", descendant_id, depth),
+    )
+
+
+class CategoryTreeVersion(Base):
+    """Версия дерева категорий (одна строка), растёт при любом изменении categories.
+
+    Триггер увеличивает версию и отправляет её в канал NOTIFY `category_tree`.
+    """
+
+    __tablename__ = "category_tree_version"
+
+    id: Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+    __table_args__ = (
+        CheckConstraint("id = 1", name="ck_category_tree_version_single_row"),
+    )
+
+
 class Product(Base):
     """Товар, принадлежащий категории и имеющий складской остаток."""
 
@@ -47,12 +92,48 @@ class Product(Base):
     category_id: Mapped[int] = mapped_column(
         BigInteger, ForeignKey("categories.id", ondelete="RESTRICT"), nullable=False
     )
+    # Корневая категория (первый уровень), заполняется триггером по category_closure
+    root_category_id: Mapped[int | None] = mapped_column(
+        BigInteger,
+        ForeignKey("categories.id", ondelete="SET NULL"),
+        nullable=True,
+        server_default=FetchedValue(),
+        server_onupdate=FetchedValue(),
+    )
     stock_qty: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Число шардов остатка; > 0 — остаток хранится в product_stock_shards
+    stock_shards: Mapped[int] = mapped_column(
+        SmallInteger, nullable=False, server_default=text("0")
+    )
     price: Mapped[DECIMAL] = mapped_column(Numeric(12, 2), nullable=False)
     created_at: Mapped[object] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
     )
-    __table_args__ = (Index("idx_products_category_id", category_id),)
+    __table_args__ = (
+        Index("idx_products_category_id", category_id),
+        Index("ix_products_root_category_id", root_category_id),
+        Index("ix_products_sharded", id, postgresql_where=text("stock_shards > 0")),
+    )
+
+
+class ProductStockShard(Base):
+    """Часть остатка шардированного товара.
+
+    Для «горячих» товаров остаток делится на несколько строк, чтобы параллельные
+    покупки списывали его из разных строк и не ждали одну блокировку.
+    """
+
+    __tablename__ = "product_stock_shards"
+
+    product_id: Mapped[int] = mapped_column(
+        BigInteger, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True
+    )
+    shard_no: Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    stock_qty: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    __table_args__ = (
+        CheckConstraint("stock_qty >= 0", name="ck_product_stock_shards_stock_qty"),
+    )
 
 
 class Customer(Base):
@@ -68,37 +149,78 @@ class Customer(Base):
     )
 
 
+class CustomerTotal(Base):
+    """Сумма и число заказов клиента, поддерживаемые триггерами `order_items`.
+
+    Заказ учитывается в `order_count`, пока в нём есть хотя бы одна позиция.
+    """
+
+    __tablename__ = "customer_totals"
+
+    customer_id: Mapped[int] = mapped_column(
+        BigInteger, ForeignKey("customers.id", ondelete="CASCADE"), primary_key=True
+    )
+    total_amount: Mapped[DECIMAL] = mapped_column(
+        Numeric(14, 2), nullable=False, server_default=text("0")
+    )
+    order_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, server_default=text("0")
+    )
+    updated_at: Mapped[object] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+    __table_args__ = (
+        Index(
+            "ix_customer_totals_total_amount",
+            total_amount.desc(),
+            customer_id,
+            postgresql_where=text("order_count > 0"),
+        ),
+    )
+
+
 class Order(Base):
-    """Заказ покупателя со статусом жизненного цикла."""
+    """Заказ покупателя со статусом жизненного цикла.
+
+    Таблица разбита на месячные партиции по `created_at` (UTC), поэтому ключ —
+    (id, created_at); id по-прежнему выдаётся последовательностью.
+    """
 
     __tablename__ = "orders"
 
-    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
     customer_id: Mapped[int] = mapped_column(
         BigInteger, ForeignKey("customers.id", ondelete="RESTRICT"), nullable=False
     )
     status: Mapped[str] = mapped_column(Text, nullable=False, default="draft")
     created_at: Mapped[object] = mapped_column(
-        DateTime(timezone=True), server_default=func.now()
+        DateTime(timezone=True), primary_key=True, server_default=func.now()
     )
 
     __table_args__ = (
         Index("ix_orders_customer_id", customer_id),
         Index("ix_orders_created_at", created_at),
         Index("ix_orders_status", status),
+        {"postgresql_partition_by": "RANGE (created_at)"},
     )
 
 
 class OrderItem(Base):
-    """Позиция заказа с количеством и зафиксированной ценой единицы товара."""
+    """Позиция заказа с количеством и зафиксированной ценой единицы товара.
+
+    Хранит время создания своего заказа (`order_created_at`) — ключ месячной
+    партиции, общий с `orders`: позиции заказа лежат в партиции того же месяца.
+    """
 
     __tablename__ = "order_items"
-    order_id: Mapped[int] = mapped_column(
-        BigInteger, ForeignKey("orders.id", ondelete="CASCADE"), primary_key=True
-    )
+    order_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     product_id: Mapped[int] = mapped_column(
         BigInteger, ForeignKey("products.id", ondelete="RESTRICT"), primary_key=True
     )
+    order_created_at: Mapped[object] = mapped_column(
+        DateTime(timezone=True), primary_key=True
+    )
     qty: Mapped[int] = mapped_column(Integer, nullable=False)
     unit_price: Mapped[DECIMAL] = mapped_column(Numeric(12, 2), nullable=False)
     created_at: Mapped[object] = mapped_column(
@@ -108,4 +230,105 @@ class OrderItem(Base):
         DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
     )
 
-    __table_args__ = (Index("ix_order_items_product_id", product_id),)
\ No newline at end of file
+    __table_args__ = (
+        ForeignKeyConstraint(
+            [order_id, order_created_at],
+            ["orders.id", "orders.created_at"],
+            name="fk_order_items_orders",
+            ondelete="CASCADE",
+        ),
+        Index("ix_order_items_product_id", product_id),
+        {"postgresql_partition_by": "RANGE (order_created_at)"},
+    )
+
+
+class ProductSalesDaily(Base):
+    """Предагрегированные продажи товара за сутки (UTC) по дате создания заказа."""
+
+    __tablename__ = "product_sales_daily"
+
+    day: Mapped[object] = mapped_column(Date, primary_key=True)
+    product_id: Mapped[int] = mapped_column(
+        BigInteger, ForeignKey("products.id", ondelete="RESTRICT"), primary_key=True
+    )
+    sold_qty: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    __table_args__ = (Index("ix_product_sales_daily_product_id", product_id),)
+
+
+class ProductSalesBucket(Base):
+    """Продажи товара за пятиминутную корзину времени создания заказа.
+
+    Хранятся последние 31 сутки: из них рейтинг продаж в памяти процесса
+    (`app.sales_ranking`) считает окна от часа до 30 суток. `updated_at`
+    меняется при каждом обновлении строки, по нему воркеры забирают изменения.
+    """
+
+    __tablename__ = "product_sales_buckets"
+
+    bucket_start: Mapped[object] = mapped_column(
+        DateTime(timezone=True), primary_key=True
+    )
+    product_id: Mapped[int] = mapped_column(
+        BigInteger, ForeignKey("products.id", ondelete="RESTRICT"), primary_key=True
+    )
+    sold_qty: Mapped[int] = mapped_column(Integer, nullable=False)
+    updated_at: Mapped[object] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+    __table_args__ = (Index("ix_product_sales_buckets_updated_at", updated_at),)
+
+
+class OrderEvent(Base):
+    """Событие добавления товара в заказ (outbox агрегатов).
+
+    Строка пишется в транзакции добавления позиции вместо обновления агрегатов;
+    фоновый потребитель (`app.tasks`, `python -m app.worker`) забирает события
+    пачками, применяет их к `product_sales_daily` и `product_sales_buckets` и удаляет.
+    """
+
+    __tablename__ = "order_events"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    order_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    order_created_at: Mapped[object] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
+    product_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    qty: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[object] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+
+class MaterializedViewRefresh(Base):
+    """Время последнего обновления материализованного представления."""
+
+    __tablename__ = "materialized_view_refreshes"
+
+    name: Mapped[str] = mapped_column(Text, primary_key=True)
+    refreshed_at: Mapped[object] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+
+class IdempotencyKey(Base):
+    """Ответ на запрос записи с заголовком `Idempotency-Key`.
+
+    Строка вставляется в транзакции самой записи, поэтому повтор запроса с тем же
+    ключом либо ждёт её фиксации и получает сохранённый ответ, либо (после отката)
+    выполняет запись заново.
+    """
+
+    __tablename__ = "idempotency_keys"
+
+    key: Mapped[str] = mapped_column(Text, primary_key=True)
+    request_hash: Mapped[str] = mapped_column(Text, nullable=False)
+    response: Mapped[object | None] = mapped_column(JSONB)
+    created_at: Mapped[object] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    expires_at: Mapped[object] = mapped_column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (Index("ix_idempotency_keys_expires_at", expires_at),)
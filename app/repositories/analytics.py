@@ -0,0 +1,122 @@
+"""Репозиторий колоночного снимка позиций заказов для аналитики в памяти.
+
+Позиции читаются одним проходом серверного курсора; все колонки приводятся к
+целым в SQL (цена — в копейках, время создания заказа — в секундах от эпохи
+Unix, отсутствующая корневая категория — `-1`), чтобы пачка строк сразу
+становилась двумерным целочисленным массивом без разбора значений в Python.
+Имена товаров, клиентов и корневых категорий читаются отдельно и только для
+встретившихся в позициях id.
+"""
+
+from collections.abc import AsyncIterator, Sequence
+
+from sqlalchemy import Row, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Ключ advisory-блокировки: общий снимок в ANALYTICS_SNAPSHOT_DIR строит один
+# воркер за раз
+ANALYTICS_SNAPSHOT_LOCK = 3_000_003
+
+# Колонки снимка в порядке выборки SQL_SNAPSHOT_ITEMS
+SNAPSHOT_ITEM_COLUMNS = (
+    "order_id",
+    "product_id",
+    "qty",
+    "unit_price",
+    "created_at",
+    "root_category_id",
+    "customer_id",
+)
+
+SQL_SNAPSHOT_ITEMS = text(
+    """
+    select oi.order_id,
+           oi.product_id,
+           oi.qty::bigint,
+           (oi.unit_price * 100)::bigint         as unit_price,
+           extract(epoch from oi.order_created_at)::bigint as created_at,
+           coalesce(p.root_category_id, -1)      as root_category_id,
+           o.customer_id
+    from order_items oi
+             join orders o on
+        o.id = oi.order_id
+            and o.created_at = oi.order_created_at
+             join products p on
+        p.id = oi.product_id
+    """
+)
+
+SQL_SNAPSHOT_PRODUCTS = text(
+    """
+    select id, name, coalesce(root_category_id, -1) as root_category_id
+    from products
+    where id = any(:ids)
+    """
+)
+
+SQL_SNAPSHOT_CUSTOMERS = text("select id, name from customers where id = any(:ids)")
+
+SQL_SNAPSHOT_CATEGORIES = text("select id, name from categories where id = any(:ids)")
+
+# Сколько id передаётся в одном запросе имён
+NAMES_BATCH_SIZE = 10_000
+
+
+async def try_lock_analytics_snapshot(session: AsyncSession) -> bool:
+    """Берёт advisory-блокировку построения снимка до конца транзакции.
+
+    Returns:
+        bool: False, если снимок уже строит другой воркер.
+    """
+
+    return (
+        await session.execute(
+            text("select pg_try_advisory_xact_lock(:key)"),
+            {"key": ANALYTICS_SNAPSHOT_LOCK},
+        )
+    ).scalar_one()
+
+
+async def iterate_snapshot_items(
+    session: AsyncSession, batch_size: int
+) -> AsyncIterator[Sequence[Row]]:
+    """Отдаёт позиции заказов пачками строк (`SNAPSHOT_ITEM_COLUMNS`).
+
+    Args:
+        session: Асинхронная SQLAlchemy-сессия с открытой транзакцией.
+        batch_size: Строк в пачке (и в одном обращении к курсору).
+    """
+
+    result = await session.stream(
+        SQL_SNAPSHOT_ITEMS, execution_options={"yield_per": batch_size}
+    )
+    async for rows in result.partitions():
+        yield rows
+
+
+async def _get_names(
+    session: AsyncSession, stmt, ids: Sequence[int]
+) -> list[Row]:
+    rows: list[Row] = []
+    for start in range(0, len(ids), NAMES_BATCH_SIZE):
+        batch = list(ids[start : start + NAMES_BATCH_SIZE])
+        rows.extend((await session.execute(stmt, {"ids": batch})).all())
+    return rows
+
+
+async def get_snapshot_products(session: AsyncSession, ids: Sequence[int]) -> list[Row]:
+    """Возвращает (id, name, root_category_id) товаров; без корня — `-1`."""
+
+    return await _get_names(session, SQL_SNAPSHOT_PRODUCTS, ids)
+
+
+async def get_snapshot_customers(session: AsyncSession, ids: Sequence[int]) -> list[Row]:
+    """Возвращает (id, name) клиентов."""
+
+    return await _get_names(session, SQL_SNAPSHOT_CUSTOMERS, ids)
+
+
+async def get_snapshot_categories(session: AsyncSession, ids: Sequence[int]) -> list[Row]:
+    """Возвращает (id, name) категорий."""
+
+    return await _get_names(session, SQL_SNAPSHOT_CATEGORIES, ids)
@@ -1,19 +1,357 @@
 """Репозиторий запросов каталога и аналитических представлений."""
 
-from sqlalchemy import select
-from sqlalchemy.orm import Session
-from app.views import v_top5_products_last_30_days
+from datetime import datetime, time, timedelta, timezone
 
+from sqlalchemy import Row, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import EXPLAIN_SAFE
+from app.views import mv_top_products_last_30_days
 
-def get_top5_products_last_30_days(session: Session):
-    """Читает топ-5 товаров из SQL-представления по продажам за последние 30 дней."""
+TOP_PRODUCTS_MV = "mv_top_products_last_30_days"
 
+# Ключ advisory-блокировки: обновлять представление одновременно может только один воркер
+TOP_PRODUCTS_REFRESH_LOCK = 3_000_001
+
+SQL_REFRESH_TOP_PRODUCTS = text(
+    f"REFRESH MATERIALIZED VIEW CONCURRENTLY {TOP_PRODUCTS_MV}"
+)
+
+# Полный пересчёт суточных продаж из order_items (seed, сверка агрегата). День
+# берётся из времени создания заказа в самой позиции, orders не читается.
+SQL_CLEAR_PRODUCT_SALES_DAILY = text("delete from product_sales_daily")
+
+SQL_REBUILD_PRODUCT_SALES_DAILY = text(
+    """
+    insert into product_sales_daily (product_id, day, sold_qty)
+    select oi.product_id,
+           (oi.order_created_at at time zone 'UTC')::date as day,
+           sum(oi.qty) as sold_qty
+    from order_items oi
+    group by oi.product_id,
+             day
+    """
+)
+
+# Пересчёт продаж последних дней: условие на ключ партиции order_items
+# оставляет в плане одну-две месячные партиции. Outbox блокируется первым:
+# потребитель событий держит его строки, прежде чем писать в product_sales_daily.
+# Ещё не применённые события за эти дни удаляются — их позиции уже в пересчёте.
+SQL_LOCK_PRODUCT_SALES_DAILY = text(
+    "lock table order_events, product_sales_daily, product_sales_buckets in exclusive mode"
+)
+SQL_CLEAR_RECENT_ORDER_EVENTS = text(
+    "delete from order_events where order_created_at >= :since"
+)
+SQL_CLEAR_RECENT_PRODUCT_SALES_DAILY = text(
+    "delete from product_sales_daily where day >= :since_day"
+)
+SQL_REBUILD_RECENT_PRODUCT_SALES_DAILY = text(
+    """
+    insert into product_sales_daily (product_id, day, sold_qty)
+    select oi.product_id,
+           (oi.order_created_at at time zone 'UTC')::date as day,
+           sum(oi.qty) as sold_qty
+    from order_items oi
+    where oi.order_created_at >= :since
+    group by oi.product_id,
+             day
+    """
+)
+
+SQL_CLEAR_RECENT_PRODUCT_SALES_BUCKETS = text(
+    "delete from product_sales_buckets where bucket_start >= :since"
+)
+SQL_REBUILD_RECENT_PRODUCT_SALES_BUCKETS = text(
+    """
+    insert into product_sales_buckets (bucket_start, product_id, sold_qty)
+    select date_bin('5 minutes', oi.order_created_at, timestamptz '2000-01-01 00:00:00+00')
+               as bucket_start,
+           oi.product_id,
+           sum(oi.qty) as sold_qty
+    from order_items oi
+    where oi.order_created_at >= greatest(:since, now() - interval '31 days')
+    group by bucket_start,
+             oi.product_id
+    """
+)
+
+# Пятиминутные продажи хранятся 31 сутки: этого хватает окну в 30 суток (UTC)
+SQL_CLEAR_PRODUCT_SALES_BUCKETS = text("delete from product_sales_buckets")
+SQL_REBUILD_PRODUCT_SALES_BUCKETS = text(
+    """
+    insert into product_sales_buckets (bucket_start, product_id, sold_qty)
+    select date_bin('5 minutes', oi.order_created_at, timestamptz '2000-01-01 00:00:00+00')
+               as bucket_start,
+           oi.product_id,
+           sum(oi.qty) as sold_qty
+    from order_items oi
+    where oi.order_created_at >= now() - interval '31 days'
+    group by bucket_start,
+             oi.product_id
+    """
+)
+SQL_PURGE_PRODUCT_SALES_BUCKETS = text(
+    "delete from product_sales_buckets where bucket_start < now() - interval '31 days'"
+)
+
+# Топ товаров за произвольное окно по пятиминутным продажам (без рейтинга в
+# памяти процесса); порядок тот же, что у материализованного представления
+SQL_TOP_PRODUCTS_SINCE = text(
+    """
+    with sales as (
+        select b.product_id,
+               sum(b.sold_qty) as sold_qty
+        from product_sales_buckets b
+        where b.bucket_start >= :since
+        group by b.product_id
+        having sum(b.sold_qty) > 0
+    )
+    select p.name as product_name,
+           rc.name as category_level1,
+           s.sold_qty::bigint as total_sold_qty
+    from sales s
+             join products p on
+        p.id = s.product_id
+             join categories rc on
+        rc.id = p.root_category_id
+    order by s.sold_qty desc,
+             p.name,
+             p.id
+    limit :limit
+    """
+).execution_options(**EXPLAIN_SAFE)
+
+# То же в поддереве категории: поддерево берётся из category_closure, поэтому
+# продажи агрегируются только по товарам его категорий
+SQL_TOP_PRODUCTS_SINCE_IN_CATEGORY = text(
+    """
+    with sales as (
+        select b.product_id,
+               sum(b.sold_qty) as sold_qty
+        from product_sales_buckets b
+                 join products p on
+            p.id = b.product_id
+                 join category_closure cc on
+            cc.descendant_id = p.category_id
+        where b.bucket_start >= :since
+          and cc.ancestor_id = :category_id
+        group by b.product_id
+        having sum(b.sold_qty) > 0
+    )
+    select p.name as product_name,
+           rc.name as category_level1,
+           s.sold_qty::bigint as total_sold_qty
+    from sales s
+             join products p on
+        p.id = s.product_id
+             join categories rc on
+        rc.id = p.root_category_id
+    order by s.sold_qty desc,
+             p.name,
+             p.id
+    limit :limit
+    """
+).execution_options(**EXPLAIN_SAFE)
+
+# Продажи по корзинам для рейтинга в памяти: номер корзины — время её начала в
+# пятиминутках от эпохи Unix
+SQL_PRODUCT_SALES_BUCKETS_SINCE = text(
+    """
+    select (extract(epoch from bucket_start) / 300)::bigint as bucket,
+           product_id,
+           sold_qty
+    from product_sales_buckets
+    where bucket_start >= to_timestamp(:since_bucket * 300)
+    """
+).execution_options(**EXPLAIN_SAFE)
+SQL_PRODUCT_SALES_BUCKETS_UPDATED = text(
+    """
+    select (extract(epoch from bucket_start) / 300)::bigint as bucket,
+           product_id,
+           sold_qty
+    from product_sales_buckets
+    where updated_at >= :updated_since
+      and bucket_start >= to_timestamp(:since_bucket * 300)
+    """
+).execution_options(**EXPLAIN_SAFE)
+
+# Название, категория с предками и корневая категория товаров рейтинга; товары
+# без корневой категории в рейтинг не попадают, как и в представлении
+SQL_RANKED_PRODUCTS = text(
+    """
+    select p.id,
+           p.name,
+           array(select cc.ancestor_id
+                 from category_closure cc
+                 where cc.descendant_id = p.category_id) as category_ids,
+           rc.name as root_category_name
+    from products p
+             join categories rc on
+        rc.id = p.root_category_id
+    where p.id = any(:ids)
+    """
+).execution_options(**EXPLAIN_SAFE)
+
+SQL_MV_REFRESHED_AGO = text(
+    """
+    select extract(epoch from now() - refreshed_at)
+    from materialized_view_refreshes
+    where name = :name
+    """
+)
+
+SQL_MARK_MV_REFRESHED = text(
+    """
+    insert into materialized_view_refreshes (name, refreshed_at)
+    values (:name, now())
+    on conflict (name) do update set refreshed_at = excluded.refreshed_at
+    """
+)
+
+
+async def get_top_products_last_30_days(session: AsyncSession, limit: int = 5):
+    """Читает топ товаров из материализованного представления продаж за 30 дней.
+
+    Args:
+        session: Асинхронная SQLAlchemy-сессия.
+        limit: Сколько позиций рейтинга вернуть.
+    """
+
+    mv = mv_top_products_last_30_days
     stmt = (
-        select(
-            v_top5_products_last_30_days.c.product_name,
-            v_top5_products_last_30_days.c.category_level1,
-            v_top5_products_last_30_days.c.total_sold_qty,
-        ).order_by(v_top5_products_last_30_days.c.total_sold_qty.desc())
+        select(mv.c.product_name, mv.c.category_level1, mv.c.total_sold_qty)
+        .order_by(mv.c.rank)
+        .limit(limit)
+        .execution_options(**EXPLAIN_SAFE)
     )
-    result = session.execute(stmt)
+    result = await session.execute(stmt)
     return result.mappings().all()
+
+
+async def get_top_products_since(
+    session: AsyncSession,
+    since: datetime,
+    limit: int,
+    category_id: int | None = None,
+):
+    """Считает топ товаров по пятиминутным продажам с момента `since`.
+
+    Args:
+        session: Асинхронная SQLAlchemy-сессия.
+        since: Начало окна (первая корзина окна).
+        limit: Сколько позиций рейтинга вернуть.
+        category_id: Категория, в поддереве которой считается топ (None — все).
+    """
+
+    params = {"since": since, "limit": limit}
+    if category_id is None:
+        result = await session.execute(SQL_TOP_PRODUCTS_SINCE, params)
+    else:
+        result = await session.execute(
+            SQL_TOP_PRODUCTS_SINCE_IN_CATEGORY, {**params, "category_id": category_id}
+        )
+    return result.mappings().all()
+
+
+async def get_product_sales_buckets(
+    session: AsyncSession, since_bucket: int, updated_since: datetime | None = None
+) -> list[Row]:
+    """Читает продажи по корзинам начиная с корзины `since_bucket`.
+
+    Args:
+        session: Асинхронная SQLAlchemy-сессия.
+        since_bucket: Номер первой корзины (пятиминутки от эпохи Unix).
+        updated_since: Только строки, обновлённые не раньше этого момента.
+
+    Returns:
+        list[Row]: Строки (bucket, product_id, sold_qty).
+    """
+
+    if updated_since is None:
+        result = await session.execute(
+            SQL_PRODUCT_SALES_BUCKETS_SINCE, {"since_bucket": since_bucket}
+        )
+    else:
+        result = await session.execute(
+            SQL_PRODUCT_SALES_BUCKETS_UPDATED,
+            {"since_bucket": since_bucket, "updated_since": updated_since},
+        )
+    return result.all()
+
+
+async def get_ranked_products(session: AsyncSession, product_ids: list[int]) -> list[Row]:
+    """Возвращает (id, name, category_ids, root_category_name) товаров рейтинга.
+
+    `category_ids` — категория товара и все её предки.
+    """
+
+    if not product_ids:
+        return []
+    return (await session.execute(SQL_RANKED_PRODUCTS, {"ids": product_ids})).all()
+
+
+async def rebuild_recent_product_sales(session: AsyncSession, days: int) -> int:
+    """Пересчитывает суточные продажи последних `days` суток (UTC) из `order_items`.
+
+    Ещё не применённые события `order_events` за эти сутки тоже пересчитываются
+    в `product_sales_daily`, пятиминутные продажи `product_sales_buckets` —
+    вместе с ними. На время пересчёта запись позиций заказов и потребитель
+    событий ждут блокировки таблиц.
+
+    Args:
+        session: Асинхронная SQLAlchemy-сессия с открытой транзакцией.
+        days: Сколько последних суток пересчитать, включая текущие.
+
+    Returns:
+        int: Число записанных строк (товар, сутки).
+    """
+
+    since_day = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    since = datetime.combine(since_day, time(), tzinfo=timezone.utc)
+    await session.execute(SQL_LOCK_PRODUCT_SALES_DAILY)
+    await session.execute(SQL_CLEAR_RECENT_PRODUCT_SALES_DAILY, {"since_day": since_day})
+    await session.execute(SQL_CLEAR_RECENT_ORDER_EVENTS, {"since": since})
+    await session.execute(SQL_CLEAR_RECENT_PRODUCT_SALES_BUCKETS, {"since": since})
+    await session.execute(SQL_REBUILD_RECENT_PRODUCT_SALES_BUCKETS, {"since": since})
+    result = await session.execute(
+        SQL_REBUILD_RECENT_PRODUCT_SALES_DAILY, {"since": since}
+    )
+    return result.rowcount
+
+
+async def refresh_top_products(session: AsyncSession, min_interval: float) -> bool:
+    """Обновляет материализованный топ товаров, если он старше `min_interval`.
+
+    Несколько воркеров uvicorn вызывают обновление по расписанию; advisory-блокировка
+    и отметка времени в `materialized_view_refreshes` гарантируют, что за интервал
+    представление пересчитывается один раз. В той же транзакции удаляются
+    пятиминутные продажи старше 31 суток.
+
+    Args:
+        session: Асинхронная SQLAlchemy-сессия без открытой транзакции.
+        min_interval: Минимальный возраст представления для обновления, сек.
+
+    Returns:
+        bool: True, если представление было обновлено.
+    """
+
+    async with session.begin():
+        locked = (
+            await session.execute(
+                text("select pg_try_advisory_xact_lock(:key)"),
+                {"key": TOP_PRODUCTS_REFRESH_LOCK},
+            )
+        ).scalar_one()
+        if not locked:
+            return False
+
+        refreshed_ago = (
+            await session.execute(SQL_MV_REFRESHED_AGO, {"name": TOP_PRODUCTS_MV})
+        ).scalar_one_or_none()
+        if refreshed_ago is not None and refreshed_ago < min_interval:
+            return False
+
+        await session.execute(SQL_PURGE_PRODUCT_SALES_BUCKETS)
+        await session.execute(SQL_REFRESH_TOP_PRODUCTS)
+        await session.execute(SQL_MARK_MV_REFRESHED, {"name": TOP_PRODUCTS_MV})
+    return True
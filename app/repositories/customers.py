@@ -0,0 +1,118 @@
+"""Репозиторий агрегатов по клиентам (`customer_totals`)."""
+
+from decimal import Decimal
+
+from sqlalchemy import Row, Select, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import EXPLAIN_SAFE
+from app.models import Customer, CustomerTotal
+
+# Сверка агрегата с order_items: исправляет расходящиеся строки, удаляет лишние.
+# Таблица блокируется от записи, чтобы триггеры не меняли её во время сверки.
+SQL_LOCK_CUSTOMER_TOTALS = text("lock table customer_totals in exclusive mode")
+
+SQL_RECONCILE_CUSTOMER_TOTALS = text(
+    """
+    with actual as (
+        select o.customer_id,
+               sum(oi.qty * oi.unit_price) as total_amount,
+               count(distinct o.id)        as order_count
+        from orders o
+                 join order_items oi on
+            o.id = oi.order_id
+                and o.created_at = oi.order_created_at
+        group by o.customer_id
+    ),
+    fixed as (
+        insert into customer_totals (customer_id, total_amount, order_count, updated_at)
+        select customer_id, total_amount, order_count, now()
+        from actual
+        on conflict (customer_id) do update
+        set total_amount = excluded.total_amount,
+            order_count = excluded.order_count,
+            updated_at = excluded.updated_at
+        where (customer_totals.total_amount, customer_totals.order_count)
+                  is distinct from (excluded.total_amount, excluded.order_count)
+        returning customer_id
+    ),
+    removed as (
+        delete from customer_totals ct
+        where not exists (select 1 from actual a where a.customer_id = ct.customer_id)
+        returning customer_id
+    )
+    select (select count(*) from fixed)   as fixed,
+           (select count(*) from removed) as removed
+    """
+)
+
+
+def client_statistics_query(
+    after: tuple[Decimal, int] | None = None, limit: int | None = None
+) -> Select:
+    """Запрос клиентов по убыванию суммы заказов из `customer_totals`.
+
+    Идёт по частичному индексу (total_amount desc, customer_id), поэтому стоимость
+    страницы не зависит ни от объёма истории заказов, ни от её номера.
+
+    Args:
+        after: Ключ (total_amount, customer_id) последней строки предыдущей
+            страницы; строки до него включительно пропускаются.
+        limit: Размер страницы (None — без ограничения).
+
+    Returns:
+        Select: Строки (customer_id, name, total_amount).
+    """
+
+    stmt = (
+        select(CustomerTotal.customer_id, Customer.name, CustomerTotal.total_amount)
+        .join(Customer, Customer.id == CustomerTotal.customer_id)
+        .where(CustomerTotal.order_count > 0)
+        .order_by(CustomerTotal.total_amount.desc(), CustomerTotal.customer_id)
+        .limit(limit)
+        .execution_options(**EXPLAIN_SAFE)
+    )
+    if after is not None:
+        total_amount, customer_id = after
+        # первое условие — граница индекса, второе отсекает уже отданные строки с той же суммой
+        stmt = stmt.where(
+            CustomerTotal.total_amount <= total_amount,
+            or_(
+                CustomerTotal.total_amount < total_amount,
+                CustomerTotal.customer_id > customer_id,
+            ),
+        )
+    return stmt
+
+
+async def get_client_statistics(
+    session: AsyncSession,
+    limit: int,
+    offset: int = 0,
+    after: tuple[Decimal, int] | None = None,
+) -> list[Row]:
+    """Читает страницу клиентов по убыванию суммы заказов.
+
+    Returns:
+        list[Row]: Строки (customer_id, name, total_amount).
+    """
+
+    stmt = client_statistics_query(after, limit).offset(offset)
+    return list((await session.execute(stmt)).all())
+
+
+async def reconcile_customer_totals(session: AsyncSession) -> Row:
+    """Пересчитывает `customer_totals` из `orders` и `order_items`.
+
+    На время сверки запись позиций заказов ждёт блокировки таблицы агрегата;
+    чтение статистики не блокируется.
+
+    Args:
+        session: Асинхронная SQLAlchemy-сессия с открытой транзакцией.
+
+    Returns:
+        Row: (fixed, removed) — число исправленных и удалённых строк.
+    """
+
+    await session.execute(SQL_LOCK_CUSTOMER_TOTALS)
+    return (await session.execute(SQL_RECONCILE_CUSTOMER_TOTALS)).one()
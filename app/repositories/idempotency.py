@@ -0,0 +1,95 @@
+"""Репозиторий ключей идемпотентности (`idempotency_keys`)."""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import Row, delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import IdempotencyKey
+
+
+async def claim_idempotency_key(
+    session: AsyncSession, key: str, request_hash: str, ttl: float
+) -> Row | None:
+    """Занимает ключ в текущей транзакции или возвращает сохранённый ответ.
+
+    Вставка ключа, который вставила ещё не завершённая транзакция, ждёт её
+    завершения: после фиксации ключ занят (возвращается строка с ответом), после
+    отката — вставка проходит. Истёкший ключ занимается заново.
+
+    Args:
+        session: Асинхронная SQLAlchemy-сессия с открытой транзакцией.
+        key: Значение заголовка `Idempotency-Key`.
+        request_hash: Отпечаток запроса (маршрут и тело).
+        ttl: Срок хранения ответа, сек.
+
+    Returns:
+        Row | None: None, если ключ занят этой транзакцией; иначе строка
+        (request_hash, response, expires_at) ранее выполненного запроса.
+    """
+
+    expires_at = func.now() + timedelta(seconds=ttl)
+    stmt = pg_insert(IdempotencyKey).values(
+        key=key, request_hash=request_hash, expires_at=expires_at
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[IdempotencyKey.key],
+        set_={
+            IdempotencyKey.request_hash: stmt.excluded.request_hash,
+            IdempotencyKey.response: None,
+            IdempotencyKey.created_at: func.now(),
+            IdempotencyKey.expires_at: stmt.excluded.expires_at,
+        },
+        where=IdempotencyKey.expires_at <= func.now(),
+    ).returning(IdempotencyKey.key)
+    if (await session.execute(stmt)).first() is not None:
+        return None
+
+    return (
+        await session.execute(
+            select(
+                IdempotencyKey.request_hash,
+                IdempotencyKey.response,
+                IdempotencyKey.expires_at,
+            ).where(IdempotencyKey.key == key)
+        )
+    ).one()
+
+
+async def save_idempotent_response(
+    session: AsyncSession, key: str, response: object
+) -> datetime:
+    """Сохраняет ответ занятого ключа; фиксируется вместе с самой записью.
+
+    Returns:
+        datetime: Время истечения ключа.
+    """
+
+    return (
+        await session.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.key == key)
+            .values(response=response)
+            .returning(IdempotencyKey.expires_at)
+        )
+    ).scalar_one()
+
+
+async def purge_idempotency_keys(session: AsyncSession, limit: int) -> int:
+    """Удаляет до `limit` истёкших ключей.
+
+    Returns:
+        int: Число удалённых строк.
+    """
+
+    expired = (
+        select(IdempotencyKey.key)
+        .where(IdempotencyKey.expires_at <= func.now())
+        .limit(limit)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.key.in_(expired))
+    )
+    return result.rowcount
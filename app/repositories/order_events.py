@@ -0,0 +1,172 @@
+"""Репозиторий outbox `order_events`: запись событий и их применение к агрегатам.
+
+Транзакция добавления товара в заказ не обновляет `product_sales_daily`, а
+дописывает в `order_events` строку (заказ, товар, количество). Вставка в
+отдельную таблицу без уникальных ключей не ждёт чужих блокировок, поэтому
+транзакция записи не держит строку товара дольше, чем нужно для списания
+остатка. Потребитель забирает самые старые события пачкой
+(`FOR UPDATE SKIP LOCKED`: несколько воркеров делят очередь без ожидания),
+одним запросом прибавляет их к суточным продажам и к продажам пятиминутных
+корзин последних 31 суток (`product_sales_buckets`) и удаляет. Событие
+применяется в той же транзакции, в которой удаляется, поэтому учитывается
+ровно один раз.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import Row, insert, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import OrderEvent
+
+# Применение пачки событий: строки продаж обновляются в порядке ключа, чтобы
+# параллельные потребители не блокировали друг друга встречно. Задержка — возраст
+# самого старого события пачки на момент применения.
+SQL_APPLY_ORDER_EVENTS = text(
+    """
+    with batch as (
+        select id
+        from order_events
+        order by id
+        limit :batch_size
+        for update skip locked
+    ),
+    applied as (
+        delete from order_events e
+        using batch b
+        where e.id = b.id
+        returning e.product_id, e.order_created_at, e.qty, e.created_at
+    ),
+    sales as (
+        insert into product_sales_daily (product_id, day, sold_qty)
+        select product_id,
+               (order_created_at at time zone 'UTC')::date as day,
+               sum(qty)
+        from applied
+        group by product_id,
+                 day
+        order by day,
+                 product_id
+        on conflict (day, product_id) do update
+        set sold_qty = product_sales_daily.sold_qty + excluded.sold_qty
+    ),
+    buckets as (
+        insert into product_sales_buckets (bucket_start, product_id, sold_qty)
+        select date_bin('5 minutes', order_created_at, timestamptz '2000-01-01 00:00:00+00')
+                   as bucket_start,
+               product_id,
+               sum(qty)
+        from applied
+        where order_created_at >= now() - interval '31 days'
+        group by bucket_start,
+                 product_id
+        order by bucket_start,
+                 product_id
+        on conflict (bucket_start, product_id) do update
+        set sold_qty = product_sales_buckets.sold_qty + excluded.sold_qty,
+            updated_at = now()
+    )
+    select count(*) as events,
+           coalesce(extract(epoch from clock_timestamp() - min(created_at))::float8, 0) as lag
+    from applied
+    """
+)
+
+# Очередь целиком: сколько событий ждёт и возраст самого старого, сек
+SQL_ORDER_EVENTS_BACKLOG = text(
+    """
+    select count(*) as events,
+           coalesce(extract(epoch from clock_timestamp() - min(created_at))::float8, 0) as lag
+    from order_events
+    """
+)
+
+
+async def add_order_events(
+    session: AsyncSession,
+    order_id: int,
+    order_created_at: datetime,
+    qty_by_product: dict[int, int],
+) -> None:
+    """Дописывает события добавления товаров в заказ одним многострочным INSERT.
+
+    Args:
+        session: Асинхронная SQLAlchemy-сессия с открытой транзакцией записи.
+        order_id: Идентификатор заказа.
+        order_created_at: Время создания заказа (по нему считаются сутки продаж).
+        qty_by_product: Добавленное количество по id товара.
+    """
+
+    if not qty_by_product:
+        return
+
+    await session.execute(
+        insert(OrderEvent).values(
+            [
+                {
+                    "order_id": order_id,
+                    "order_created_at": order_created_at,
+                    "product_id": product_id,
+                    "qty": qty,
+                }
+                for product_id, qty in sorted(qty_by_product.items())
+            ]
+        )
+    )
+
+
+async def add_product_order_events(
+    session: AsyncSession,
+    product_id: int,
+    qty_by_order: dict[tuple[int, datetime], int],
+) -> None:
+    """Дописывает события добавления одного товара в несколько заказов.
+
+    Args:
+        session: Асинхронная SQLAlchemy-сессия с открытой транзакцией записи.
+        product_id: Идентификатор товара.
+        qty_by_order: Добавленное количество по (id заказа, время создания заказа).
+    """
+
+    if not qty_by_order:
+        return
+
+    await session.execute(
+        insert(OrderEvent).values(
+            [
+                {
+                    "order_id": order_id,
+                    "order_created_at": order_created_at,
+                    "product_id": product_id,
+                    "qty": qty,
+                }
+                for (order_id, order_created_at), qty in sorted(qty_by_order.items())
+            ]
+        )
+    )
+
+
+async def apply_order_events(session: AsyncSession, batch_size: int) -> Row:
+    """Применяет к `product_sales_daily` и `product_sales_buckets` до
+    `batch_size` самых старых событий.
+
+    События, которые уже забрал другой потребитель, пропускаются.
+
+    Args:
+        session: Асинхронная SQLAlchemy-сессия с открытой транзакцией.
+        batch_size: Сколько событий забрать.
+
+    Returns:
+        Row: (events, lag) — число применённых событий и возраст самого старого
+        из них, сек.
+    """
+
+    return (
+        await session.execute(SQL_APPLY_ORDER_EVENTS, {"batch_size": batch_size})
+    ).one()
+
+
+async def get_order_events_backlog(session: AsyncSession) -> Row:
+    """Возвращает (events, lag): сколько событий ждёт и возраст самого старого, сек."""
+
+    return (await session.execute(SQL_ORDER_EVENTS_BACKLOG)).one()
@@ -0,0 +1,282 @@
+"""Репозиторий запросов записи заказов: блокировки, списание остатков, upsert позиций."""
+
+from collections.abc import Iterable
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import (
+    BigInteger,
+    Integer,
+    Row,
+    column,
+    func,
+    select,
+    text,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import Order, OrderItem, Product
+
+# Резервирование остатка и запись позиции за один запрос: строка товара
+# блокируется только на время этого UPDATE и до конца транзакции, без
+# промежуточных обращений клиента к БД. Время создания заказа читается один раз:
+# это ключ партиции позиции. Продажи не обновляются, а пишутся событием в outbox
+# order_events (см. app.repositories.order_events).
+SQL_RESERVE_AND_ADD_ITEM = text(
+    """
+    with ord as (
+        select created_at
+        from orders
+        where id = :order_id
+    ),
+    reserved as (
+        update products
+        set stock_qty = stock_qty - :qty
+        where id = :product_id
+          and stock_qty >= :qty
+          and stock_shards = 0
+          and exists (select 1 from ord)
+        returning id, stock_qty, price
+    ),
+    item as (
+        insert into order_items (order_id, product_id, order_created_at, qty, unit_price)
+        select :order_id, r.id, o.created_at, :qty, r.price
+        from reserved r
+                 cross join ord o
+        on conflict (order_id, product_id, order_created_at) do update
+        set qty = order_items.qty + excluded.qty,
+            unit_price = excluded.unit_price,
+            updated_at = now()
+        returning qty
+    ),
+    event as (
+        insert into order_events (order_id, order_created_at, product_id, qty)
+        select :order_id, o.created_at, r.id, :qty
+        from reserved r
+                 cross join ord o
+    )
+    select r.stock_qty as remaining_stock,
+           i.qty       as new_qty
+    from reserved r
+             cross join item i
+    """
+)
+
+# Состояние заказа и товара для объяснения неудачного резерва: нет заказа,
+# нет товара, не хватает остатка или остаток товара шардирован
+SQL_ORDER_PRODUCT_STATE = text(
+    """
+    select (select created_at from orders where id = :order_id) as order_created_at,
+           p.stock_qty,
+           p.stock_shards,
+           p.price
+    from (select 1) one
+             left join products p on
+        p.id = :product_id
+    """
+)
+
+
+async def get_order_created_at(session: AsyncSession, order_id: int) -> datetime | None:
+    """Возвращает время создания заказа или None, если заказа нет."""
+
+    return (
+        await session.execute(select(Order.created_at).where(Order.id == order_id))
+    ).scalar_one_or_none()
+
+
+async def get_orders_created_at(
+    session: AsyncSession, order_ids: Iterable[int]
+) -> dict[int, datetime]:
+    """Возвращает время создания найденных заказов по id одним запросом."""
+
+    rows = (
+        await session.execute(
+            select(Order.id, Order.created_at).where(Order.id.in_(sorted(set(order_ids))))
+        )
+    ).all()
+    return {row.id: row.created_at for row in rows}
+
+
+async def lock_products(
+    session: AsyncSession, product_ids: Iterable[int]
+) -> dict[int, Row]:
+    """Блокирует строки товаров одним `SELECT ... FOR UPDATE`.
+
+    Строки блокируются в порядке возрастания id, поэтому параллельные пакетные
+    запросы с пересекающимися товарами не образуют взаимных блокировок.
+    Шардированные товары не блокируются и не возвращаются: их остаток списывается
+    из `product_stock_shards`.
+
+    Returns:
+        dict[int, Row]: Строки (id, stock_qty, price) найденных нешардированных
+        товаров по id.
+    """
+
+    stmt = (
+        select(Product.id, Product.stock_qty, Product.price)
+        .where(Product.id.in_(sorted(set(product_ids))), Product.stock_shards == 0)
+        .order_by(Product.id)
+        .with_for_update()
+    )
+    rows = (await session.execute(stmt)).all()
+    return {row.id: row for row in rows}
+
+
+async def decrement_stock(
+    session: AsyncSession, qty_by_product: dict[int, int]
+) -> dict[int, int]:
+    """Списывает остатки нескольких товаров одним `UPDATE ... FROM (VALUES ...)`.
+
+    Строки товаров должны быть заблокированы заранее (`lock_products`).
+
+    Returns:
+        dict[int, int]: Новый остаток по id товара.
+    """
+
+    if not qty_by_product:
+        return {}
+
+    deltas = values(
+        column("id", BigInteger), column("qty", Integer), name="deltas"
+    ).data(sorted(qty_by_product.items()))
+    stmt = (
+        update(Product)
+        .where(Product.id == deltas.c.id)
+        .values(stock_qty=Product.stock_qty - deltas.c.qty)
+        .returning(Product.id, Product.stock_qty)
+    )
+    rows = (await session.execute(stmt)).all()
+    return {row.id: row.stock_qty for row in rows}
+
+
+async def upsert_order_items(
+    session: AsyncSession,
+    order_id: int,
+    order_created_at: datetime,
+    lines: dict[int, tuple[int, Decimal]],
+) -> dict[int, int]:
+    """Добавляет позиции заказа одним многострочным `INSERT ... ON CONFLICT`.
+
+    Существующей позиции увеличивается `qty`, цена единицы обновляется на текущую.
+
+    Args:
+        session: Асинхронная SQLAlchemy-сессия с открытой транзакцией.
+        order_id: Идентификатор заказа.
+        order_created_at: Время создания заказа (ключ партиции позиций).
+        lines: Количество и цена единицы по id товара.
+
+    Returns:
+        dict[int, int]: Итоговое количество позиции по id товара.
+    """
+
+    if not lines:
+        return {}
+
+    stmt = pg_insert(OrderItem).values(
+        [
+            {
+                "order_id": order_id,
+                "product_id": product_id,
+                "order_created_at": order_created_at,
+                "qty": qty,
+                "unit_price": unit_price,
+            }
+            for product_id, (qty, unit_price) in sorted(lines.items())
+        ]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            OrderItem.order_id,
+            OrderItem.product_id,
+            OrderItem.order_created_at,
+        ],
+        set_={
+            OrderItem.qty: OrderItem.qty + stmt.excluded.qty,
+            OrderItem.unit_price: stmt.excluded.unit_price,
+            OrderItem.updated_at: func.now(),
+        },
+    ).returning(OrderItem.product_id, OrderItem.qty)
+    rows = (await session.execute(stmt)).all()
+    return {row.product_id: row.qty for row in rows}
+
+
+async def upsert_product_order_items(
+    session: AsyncSession,
+    product_id: int,
+    unit_price: Decimal,
+    qty_by_order: dict[tuple[int, datetime], int],
+) -> dict[int, int]:
+    """Добавляет один товар в несколько заказов одним `INSERT ... ON CONFLICT`.
+
+    Args:
+        session: Асинхронная SQLAlchemy-сессия с открытой транзакцией.
+        product_id: Идентификатор товара.
+        unit_price: Текущая цена единицы.
+        qty_by_order: Количество по (id заказа, время создания заказа).
+
+    Returns:
+        dict[int, int]: Итоговое количество позиции по id заказа.
+    """
+
+    if not qty_by_order:
+        return {}
+
+    stmt = pg_insert(OrderItem).values(
+        [
+            {
+                "order_id": order_id,
+                "product_id": product_id,
+                "order_created_at": order_created_at,
+                "qty": qty,
+                "unit_price": unit_price,
+            }
+            for (order_id, order_created_at), qty in sorted(qty_by_order.items())
+        ]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            OrderItem.order_id,
+            OrderItem.product_id,
+            OrderItem.order_created_at,
+        ],
+        set_={
+            OrderItem.qty: OrderItem.qty + stmt.excluded.qty,
+            OrderItem.unit_price: stmt.excluded.unit_price,
+            OrderItem.updated_at: func.now(),
+        },
+    ).returning(OrderItem.order_id, OrderItem.qty)
+    rows = (await session.execute(stmt)).all()
+    return {row.order_id: row.qty for row in rows}
+
+
+async def reserve_and_add_item(
+    session: AsyncSession, order_id: int, product_id: int, quantity: int
+) -> Row | None:
+    """Атомарно списывает остаток и добавляет позицию в заказ одним запросом.
+
+    Проверка и списание остатка выполняются одним
+    `UPDATE ... WHERE stock_qty >= :qty RETURNING`, позиция и событие
+    `order_events` пишутся в том же CTE.
+
+    Returns:
+        Row | None: (remaining_stock, new_qty) или None, если резерв не удался —
+        причину объясняет `get_order_product_state`.
+    """
+
+    params = {"order_id": order_id, "product_id": product_id, "qty": quantity}
+    return (await session.execute(SQL_RESERVE_AND_ADD_ITEM, params)).one_or_none()
+
+
+async def get_order_product_state(
+    session: AsyncSession, order_id: int, product_id: int
+) -> Row:
+    """Возвращает (order_created_at, stock_qty, stock_shards, price) без блокировок.
+
+    `order_created_at` равен None, если заказа нет, остальные поля — если нет товара.
+    """
+
+    params = {"order_id": order_id, "product_id": product_id}
+    return (await session.execute(SQL_ORDER_PRODUCT_STATE, params)).one()
@@ -0,0 +1,151 @@
+"""Репозиторий месячных партиций `orders` и `order_items`.
+
+Месяц `YYYYMM` хранится в паре партиций `orders_YYYYMM` и `order_items_YYYYMM`
+с границами по началу месяца (UTC); позиции заказа лежат в партиции месяца
+самого заказа. Партиции создаёт SQL-функция `create_order_partitions`
+(миграция 009) заранее: вставка заказа в месяц без партиции завершается ошибкой.
+
+Партиции старше срока хранения отключаются `DETACH PARTITION ... CONCURRENTLY`,
+не блокируя чтение и запись заказов, и переносятся в схему `order_archive`:
+данные остаются в БД, но запросы к `orders`/`order_items` их больше не читают,
+а архивную таблицу можно выгрузить и удалить отдельно. Агрегаты
+(`customer_totals`, `product_sales_daily`) при этом не меняются.
+"""
+
+import re
+from dataclasses import dataclass, field
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# Ключ advisory-блокировки: партициями занимается один воркер за раз
+ORDER_PARTITIONS_LOCK = 3_000_002
+
+ORDER_ARCHIVE_SCHEMA = "order_archive"
+
+# Внешний ключ позиций на заказы: у отключённой партиции позиций он снимается,
+# иначе архивные позиции ссылались бы на заказы, которых в orders больше нет
+ORDER_ITEMS_ORDERS_FK = "fk_order_items_orders"
+
+# Партиции отключаются в этом порядке: позиции ссылаются на заказы
+ORDER_PARTITION_PARENTS = ("order_items", "orders")
+
+# Имя месячной партиции: родительская таблица и месяц YYYYMM
+ORDER_PARTITION_RE = re.compile(r"^(orders|order_items)_(\d{6})$")
+
+SQL_CREATE_ORDER_PARTITIONS = text(
+    "select create_order_partitions(:first_month, :last_month)"
+)
+
+SQL_ORDER_PARTITIONS = text(
+    """
+    select c.relname
+    from pg_inherits i
+             join pg_class c on
+        c.oid = i.inhrelid
+    where i.inhparent in ('orders'::regclass, 'order_items'::regclass)
+    """
+)
+
+
+@dataclass
+class PartitionMaintenance:
+    """Результат обслуживания партиций: создано таблиц и архивированные месяцы."""
+
+    created: int = 0
+    archived: list[str] = field(default_factory=list)
+
+
+def add_months(day: date, months: int) -> date:
+    """Первое число месяца, отстоящего от месяца `day` на `months`."""
+
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+async def archive_order_partitions(conn: AsyncConnection, before: date) -> list[str]:
+    """Отключает партиции месяцев раньше `before` и переносит их в `order_archive`.
+
+    `DETACH ... CONCURRENTLY` не выполняется в транзакции, поэтому соединение
+    должно быть в режиме AUTOCOMMIT. Повторный вызов доделывает месяц, прерванный
+    между шагами.
+
+    Returns:
+        list[str]: Архивированные месяцы (`YYYYMM`).
+    """
+
+    attached = set((await conn.execute(SQL_ORDER_PARTITIONS)).scalars())
+    cutoff = before.strftime("%Y%m")
+    months = sorted(
+        {
+            match.group(2)
+            for name in attached
+            if (match := ORDER_PARTITION_RE.match(name)) and match.group(2) < cutoff
+        }
+    )
+    for month in months:
+        for parent in ORDER_PARTITION_PARENTS:
+            partition = f"{parent}_{month}"
+            if partition in attached:
+                await conn.execute(
+                    text(f"alter table {parent} detach partition {partition} concurrently")
+                )
+            if parent == "order_items":
+                await conn.execute(
+                    text(
+                        f"alter table if exists {partition} "
+                        f"drop constraint if exists {ORDER_ITEMS_ORDERS_FK}"
+                    )
+                )
+            await conn.execute(
+                text(f"alter table if exists {partition} set schema {ORDER_ARCHIVE_SCHEMA}")
+            )
+    return months
+
+
+async def maintain_order_partitions(
+    conn: AsyncConnection, today: date, months_ahead: int, retention_months: int
+) -> PartitionMaintenance | None:
+    """Создаёт партиции до месяца `today + months_ahead` и архивирует устаревшие.
+
+    Args:
+        conn: Соединение в режиме AUTOCOMMIT.
+        today: Текущая дата (UTC).
+        months_ahead: Сколько месяцев после текущего должно иметь партиции.
+        retention_months: Сколько месяцев, включая текущий, остаются в таблицах
+            (0 — не архивировать).
+
+    Returns:
+        PartitionMaintenance | None: Результат или None, если партициями уже
+        занимается другой воркер.
+    """
+
+    locked = (
+        await conn.execute(
+            text("select pg_try_advisory_lock(:key)"), {"key": ORDER_PARTITIONS_LOCK}
+        )
+    ).scalar_one()
+    if not locked:
+        return None
+    try:
+        this_month = add_months(today, 0)
+        result = PartitionMaintenance()
+        result.created = (
+            await conn.execute(
+                SQL_CREATE_ORDER_PARTITIONS,
+                {
+                    "first_month": this_month,
+                    "last_month": add_months(this_month, months_ahead),
+                },
+            )
+        ).scalar_one()
+        if retention_months > 0:
+            result.archived = await archive_order_partitions(
+                conn, add_months(this_month, 1 - retention_months)
+            )
+        return result
+    finally:
+        await conn.execute(
+            text("select pg_advisory_unlock(:key)"), {"key": ORDER_PARTITIONS_LOCK}
+        )
@@ -0,0 +1,339 @@
+"""Репозиторий шардированных остатков «горячих» товаров.
+
+Остаток товара с `products.stock_shards > 0` хранится не в `products.stock_qty`
+(там 0), а в `stock_shards` строках `product_stock_shards`. Покупка списывает
+количество из одной случайной строки, пропуская заблокированные
+(`FOR UPDATE SKIP LOCKED`), поэтому параллельные покупки одного товара не ждут
+друг друга. Если все подходящие строки заняты, запрос ждёт одну случайную из
+них, и только если ни в одной строке не хватает остатка, списание идёт из
+нескольких строк под блокировкой всех шардов товара. Доступный остаток —
+сумма строк; фоновая перебалансировка выравнивает шарды, чтобы быстрый путь
+срабатывал как можно чаще.
+
+Суточные продажи не обновляются в транзакции покупки: она дописывает событие в
+outbox `order_events`, иначе общая строка `product_sales_daily` сериализовала
+бы покупки так же, как строка остатка.
+"""
+
+from collections.abc import Iterable
+
+from sqlalchemy import (
+    Integer,
+    Row,
+    SmallInteger,
+    column,
+    delete,
+    insert,
+    select,
+    text,
+    update,
+    values,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Product, ProductStockShard
+
+# Товары, про которые процесс уже знает, что их остаток шардирован: для них
+# add_item сразу идёт в шарды, минуя попытку списать products.stock_qty.
+# Множество пополняется и очищается по результатам запросов.
+sharded_products: set[int] = set()
+
+# Случайный шард с достаточным остатком: свободный (skip locked) или с ожиданием
+_SQL_PICK_SHARD = """
+    picked as (
+        select shard_no
+        from product_stock_shards
+        where product_id = :product_id
+          and stock_qty >= :qty{order_guard}
+        order by random()
+        limit 1
+        for update{skip_locked}
+    ),
+    reserved as (
+        update product_stock_shards s
+        set stock_qty = s.stock_qty - :qty
+        from picked
+        where s.product_id = :product_id
+          and s.shard_no = picked.shard_no
+        returning s.product_id, s.shard_no
+    )"""
+
+# Сумма шардов читается из снимка запроса, где собственное списание ещё не видно
+_SQL_RESERVE_SHARD = (
+    "with"
+    + _SQL_PICK_SHARD
+    + """
+    select (select sum(stock_qty)
+            from product_stock_shards
+            where product_id = :product_id) - :qty as remaining_stock
+    from reserved
+    """
+)
+SQL_RESERVE_FREE_SHARD = text(
+    _SQL_RESERVE_SHARD.format(order_guard="", skip_locked=" skip locked")
+)
+SQL_RESERVE_ANY_SHARD = text(_SQL_RESERVE_SHARD.format(order_guard="", skip_locked=""))
+
+# Списание из шарда и запись позиции за один запрос (аналог SQL_RESERVE_AND_ADD_ITEM);
+# продажи пишутся событием в order_events
+SQL_RESERVE_SHARD_AND_ADD_ITEM = text(
+    """with
+    ord as (
+        select created_at
+        from orders
+        where id = :order_id
+    ),"""
+    + _SQL_PICK_SHARD.format(
+        order_guard="\n          and exists (select 1 from ord)",
+        skip_locked=" skip locked",
+    )
+    + """,
+    item as (
+        insert into order_items (order_id, product_id, order_created_at, qty, unit_price)
+        select :order_id, p.id, o.created_at, :qty, p.price
+        from reserved r
+                 join products p on
+            p.id = r.product_id
+                 cross join ord o
+        on conflict (order_id, product_id, order_created_at) do update
+        set qty = order_items.qty + excluded.qty,
+            unit_price = excluded.unit_price,
+            updated_at = now()
+        returning qty
+    ),
+    event as (
+        insert into order_events (order_id, order_created_at, product_id, qty)
+        select :order_id, o.created_at, r.product_id, :qty
+        from reserved r
+                 cross join ord o
+    )
+    select (select sum(stock_qty)
+            from product_stock_shards
+            where product_id = :product_id) - :qty as remaining_stock,
+           i.qty                                  as new_qty
+    from item i
+    """
+)
+
+
+def _split(total: int, shards: int) -> list[int]:
+    """Делит остаток на `shards` частей, отличающихся не больше чем на единицу."""
+
+    base, extra = divmod(total, shards)
+    return [base + (1 if shard_no < extra else 0) for shard_no in range(shards)]
+
+
+async def _lock_shards(session: AsyncSession, product_id: int) -> dict[int, int]:
+    """Блокирует все шарды товара в порядке номера; возвращает остаток по шарду."""
+
+    rows = (
+        await session.execute(
+            select(ProductStockShard.shard_no, ProductStockShard.stock_qty)
+            .where(ProductStockShard.product_id == product_id)
+            .order_by(ProductStockShard.shard_no)
+            .with_for_update()
+        )
+    ).all()
+    return {row.shard_no: row.stock_qty for row in rows}
+
+
+async def _write_shards(
+    session: AsyncSession, product_id: int, stock_by_shard: dict[int, int]
+) -> None:
+    """Записывает новые остатки шардов одним `UPDATE ... FROM (VALUES ...)`."""
+
+    if not stock_by_shard:
+        return
+
+    shards = values(
+        column("shard_no", SmallInteger), column("stock_qty", Integer), name="shards"
+    ).data(sorted(stock_by_shard.items()))
+    await session.execute(
+        update(ProductStockShard)
+        .where(
+            ProductStockShard.product_id == product_id,
+            ProductStockShard.shard_no == shards.c.shard_no,
+        )
+        .values(stock_qty=shards.c.stock_qty)
+    )
+
+
+async def get_sharded_products(
+    session: AsyncSession, product_ids: Iterable[int]
+) -> dict[int, Row]:
+    """Возвращает (id, price) шардированных товаров из переданных id без блокировки."""
+
+    rows = (
+        await session.execute(
+            select(Product.id, Product.price).where(
+                Product.id.in_(sorted(set(product_ids))), Product.stock_shards > 0
+            )
+        )
+    ).all()
+    sharded_products.update(row.id for row in rows)
+    return {row.id: row for row in rows}
+
+
+async def reserve_shard_and_add_item(
+    session: AsyncSession, order_id: int, product_id: int, quantity: int
+) -> Row | None:
+    """Списывает остаток из свободного шарда и добавляет позицию одним запросом.
+
+    Returns:
+        Row | None: (remaining_stock, new_qty) или None, если нет заказа, товар не
+        шардирован или ни в одном свободном шарде не хватает остатка.
+    """
+
+    params = {"order_id": order_id, "product_id": product_id, "qty": quantity}
+    return (
+        await session.execute(SQL_RESERVE_SHARD_AND_ADD_ITEM, params)
+    ).one_or_none()
+
+
+async def drain_shards(
+    session: AsyncSession, product_id: int, quantity: int
+) -> int | None:
+    """Списывает остаток из нескольких шардов под блокировкой всех шардов товара.
+
+    Медленный путь для случаев, когда ни в одном шарде нет `quantity` целиком.
+    Количество снимается с самых полных шардов.
+
+    Returns:
+        int | None: Оставшийся суммарный остаток или None, если его не хватает.
+    """
+
+    stock = await _lock_shards(session, product_id)
+    total = sum(stock.values())
+    if not stock or total < quantity:
+        return None
+
+    left = quantity
+    changed = {}
+    for shard_no in sorted(stock, key=stock.__getitem__, reverse=True):
+        if not left:
+            break
+        take = min(left, stock[shard_no])
+        changed[shard_no] = stock[shard_no] - take
+        left -= take
+    await _write_shards(session, product_id, changed)
+    return total - quantity
+
+
+async def reserve_from_shards(
+    session: AsyncSession, product_id: int, quantity: int, skip_locked: bool = True
+) -> int | None:
+    """Списывает остаток шардированного товара.
+
+    Порядок попыток: свободный шард с достаточным остатком (если `skip_locked`),
+    ожидание одного случайного такого шарда, сбор из нескольких шардов через
+    `drain_shards`. Ожидание одного шарда не даёт параллельным запросам при
+    кратковременной занятости всех шардов уходить в блокировку всего товара.
+
+    Returns:
+        int | None: Оставшийся суммарный остаток или None, если его не хватает.
+    """
+
+    params = {"product_id": product_id, "qty": quantity}
+    attempts = [SQL_RESERVE_FREE_SHARD] if skip_locked else []
+    for stmt in [*attempts, SQL_RESERVE_ANY_SHARD]:
+        remaining = (await session.execute(stmt, params)).scalar_one_or_none()
+        if remaining is not None:
+            return remaining
+    return await drain_shards(session, product_id, quantity)
+
+
+async def shard_product_stock(
+    session: AsyncSession, product_id: int, shards: int
+) -> int | None:
+    """Переводит остаток товара в `shards` шардов (или меняет их число).
+
+    Returns:
+        int | None: Суммарный остаток товара или None, если товара нет.
+    """
+
+    product = (
+        await session.execute(
+            select(Product.stock_qty, Product.stock_shards)
+            .where(Product.id == product_id)
+            .with_for_update()
+        )
+    ).one_or_none()
+    if product is None:
+        return None
+
+    total = product.stock_qty + sum((await _lock_shards(session, product_id)).values())
+    await session.execute(
+        delete(ProductStockShard).where(ProductStockShard.product_id == product_id)
+    )
+    await session.execute(
+        insert(ProductStockShard),
+        [
+            {"product_id": product_id, "shard_no": shard_no, "stock_qty": stock_qty}
+            for shard_no, stock_qty in enumerate(_split(total, shards))
+        ],
+    )
+    await session.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(stock_qty=0, stock_shards=shards)
+    )
+    return total
+
+
+async def unshard_product_stock(session: AsyncSession, product_id: int) -> int | None:
+    """Возвращает остаток шардированного товара в `products.stock_qty`.
+
+    Returns:
+        int | None: Суммарный остаток товара или None, если товара нет.
+    """
+
+    stock_qty = (
+        await session.execute(
+            select(Product.stock_qty).where(Product.id == product_id).with_for_update()
+        )
+    ).scalar_one_or_none()
+    if stock_qty is None:
+        return None
+
+    total = stock_qty + sum((await _lock_shards(session, product_id)).values())
+    await session.execute(
+        delete(ProductStockShard).where(ProductStockShard.product_id == product_id)
+    )
+    await session.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(stock_qty=total, stock_shards=0)
+    )
+    return total
+
+
+async def rebalance_product_stock(session: AsyncSession, product_id: int) -> bool:
+    """Равномерно перераспределяет остаток товара между его шардами.
+
+    Returns:
+        bool: True, если распределение изменилось.
+    """
+
+    stock = await _lock_shards(session, product_id)
+    if not stock:
+        return False
+    target = dict(zip(sorted(stock), _split(sum(stock.values()), len(stock))))
+    changed = {
+        shard_no: stock_qty
+        for shard_no, stock_qty in target.items()
+        if stock[shard_no] != stock_qty
+    }
+    await _write_shards(session, product_id, changed)
+    return bool(changed)
+
+
+async def list_sharded_product_ids(session: AsyncSession) -> list[int]:
+    """Возвращает id всех шардированных товаров."""
+
+    return list(
+        (
+            await session.execute(
+                select(Product.id).where(Product.stock_shards > 0).order_by(Product.id)
+            )
+        ).scalars()
+    )
@@ -0,0 +1,426 @@
+"""Рейтинг продаж товаров в памяти процесса для `/catalog/top-products`.
+
+Продажи хранятся по пятиминутным корзинам времени создания заказа
+(`product_sales_buckets`, последние 31 сутки). Для каждого окна (`1h`, `24h`,
+`7d`, `30d`) держатся суммы продаж товаров и отсортированные списки ключей
+(-продано, название, id): общий и по каждой категории, куда попадают товары
+всего её поддерева. Изменение корзины меняет суммы только затронутых товаров и
+переставляет их ключи бинарным поиском в списках их категории и её предков,
+сдвиг окна вычитает выпавшие корзины, поэтому топ любого окна и поддерева
+отвечает срезом списка без обращения к БД.
+
+Окна `1h` и `24h` — последние 12 и 288 корзин, включая текущую; `7d` и `30d` —
+сутки (UTC), включая текущие, как у материализованного представления.
+
+Рейтинг загружается при старте воркера и затем раз в
+`SALES_RANKING_SYNC_INTERVAL` секунд забирает строки, обновлённые
+потребителем outbox (`updated_at`). Полная перезагрузка раз в
+`SALES_RANKING_RELOAD_INTERVAL` секунд и при смене версии дерева категорий
+подхватывает удалённые строки (пересчёт агрегата), переименования товаров и
+перенос категорий.
+"""
+
+import asyncio
+import logging
+import time
+from bisect import bisect_left, insort
+from collections.abc import Iterable
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Literal, get_args
+
+from sqlalchemy import text
+
+from app.category_tree import category_tree
+from app.db import SessionLocal
+from app.metrics import cache_requests
+from app.repositories.catalog import get_product_sales_buckets, get_ranked_products
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+SalesWindow = Literal["1h", "24h", "7d", "30d"]
+
+SALES_WINDOWS: tuple[str, ...] = get_args(SalesWindow)
+
+BUCKET_SECONDS = 300
+BUCKETS_PER_DAY = 86_400 // BUCKET_SECONDS
+
+# Корзин в скользящих окнах и суток (UTC) в суточных
+WINDOW_BUCKETS = {"1h": 12, "24h": 288}
+WINDOW_DAYS = {"7d": 7, "30d": 30}
+
+# Запас при заборе изменений: строка с `updated_at` чуть раньше прошлого забора
+# могла быть зафиксирована уже после него
+SYNC_OVERLAP = timedelta(seconds=10)
+
+# Изменений в окне, после которых дешевле отсортировать его заново, чем
+# переставлять ключи по одному (доля от числа товаров окна, но не меньше порога)
+REINDEX_MIN_CHANGES = 512
+REINDEX_SHARE = 8
+
+cache_hits = cache_requests.labels("sales_ranking", "hit")
+cache_misses = cache_requests.labels("sales_ranking", "miss")
+
+
+def current_bucket() -> int:
+    """Номер текущей корзины (пятиминутки от эпохи Unix)."""
+
+    return int(time.time()) // BUCKET_SECONDS
+
+
+def window_start(window: str, bucket: int) -> int:
+    """Первая корзина окна, которое заканчивается корзиной `bucket`."""
+
+    if window in WINDOW_BUCKETS:
+        return bucket - WINDOW_BUCKETS[window] + 1
+    return (bucket // BUCKETS_PER_DAY - WINDOW_DAYS[window] + 1) * BUCKETS_PER_DAY
+
+
+def window_since(window: str, now: datetime | None = None) -> datetime:
+    """Начало окна, заканчивающегося текущей корзиной, как момент времени."""
+
+    now = now or datetime.now(timezone.utc)
+    bucket = int(now.timestamp()) // BUCKET_SECONDS
+    return datetime.fromtimestamp(
+        window_start(window, bucket) * BUCKET_SECONDS, timezone.utc
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class RankedProduct:
+    """Товар рейтинга: название, категория с её предками и имя корневой категории."""
+
+    name: str
+    category_ids: tuple[int, ...]
+    root_category_name: str
+
+
+def _ranked_products(rows: Iterable) -> dict[int, RankedProduct]:
+    return {
+        row.id: RankedProduct(row.name, tuple(row.category_ids), row.root_category_name)
+        for row in rows
+    }
+
+
+class _Window:
+    """Суммы продаж окна и их отсортированные ключи по поддеревьям категорий
+    (None — все категории)."""
+
+    __slots__ = ("start", "totals", "keys", "index")
+
+    def __init__(self, start: int):
+        self.start = start
+        self.totals: dict[int, int] = {}
+        self.keys: dict[int, tuple[int, str, int]] = {}
+        self.index: dict[int | None, list[tuple[int, str, int]]] = {}
+
+
+class SalesRanking:
+    """Продажи по корзинам и рейтинги окон; изменяется только из цикла событий."""
+
+    def __init__(
+        self,
+        rows: Iterable[tuple[int, int, int]],
+        products: dict[int, RankedProduct],
+        bucket: int,
+    ):
+        """Строит рейтинг из строк (bucket, product_id, sold_qty).
+
+        Args:
+            rows: Продажи по корзинам.
+            products: Товары рейтинга по id; товары без описания учитываются
+                в суммах, но в рейтинг не попадают.
+            bucket: Текущая корзина.
+        """
+
+        self.bucket = bucket
+        self.products = products
+        self._buckets: dict[int, dict[int, int]] = {}
+        oldest = self._oldest()
+        for row_bucket, product_id, sold_qty in rows:
+            if row_bucket >= oldest and sold_qty:
+                self._buckets.setdefault(row_bucket, {})[product_id] = sold_qty
+
+        self._windows: dict[str, _Window] = {}
+        for window in SALES_WINDOWS:
+            state = self._windows[window] = _Window(window_start(window, bucket))
+            for row_bucket, sales in self._buckets.items():
+                if state.start <= row_bucket <= bucket:
+                    for product_id, sold_qty in sales.items():
+                        state.totals[product_id] = (
+                            state.totals.get(product_id, 0) + sold_qty
+                        )
+            self._reindex(state)
+
+    def _oldest(self) -> int:
+        return min(window_start(window, self.bucket) for window in SALES_WINDOWS)
+
+    def _key(self, product_id: int, sold_qty: int) -> tuple[int, str, int] | None:
+        product = self.products.get(product_id)
+        if product is None or sold_qty <= 0:
+            return None
+        return -sold_qty, product.name, product_id
+
+    def _reindex(self, state: _Window) -> None:
+        state.keys = {}
+        for product_id, sold_qty in state.totals.items():
+            key = self._key(product_id, sold_qty)
+            if key is not None:
+                state.keys[product_id] = key
+        ordered = sorted(state.keys.values())
+        state.index = {None: ordered}
+        for key in ordered:
+            for category_id in self.products[key[2]].category_ids:
+                state.index.setdefault(category_id, []).append(key)
+
+    def _apply(self, state: _Window, deltas: dict[int, int]) -> None:
+        """Прибавляет изменения сумм к окну и переставляет ключи товаров."""
+
+        deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        for product_id, delta in deltas.items():
+            sold_qty = state.totals.get(product_id, 0) + delta
+            if sold_qty:
+                state.totals[product_id] = sold_qty
+            else:
+                state.totals.pop(product_id, None)
+
+        if len(deltas) >= max(REINDEX_MIN_CHANGES, len(state.keys) // REINDEX_SHARE):
+            self._reindex(state)
+            return
+
+        for product_id in deltas:
+            old = state.keys.pop(product_id, None)
+            new = self._key(product_id, state.totals.get(product_id, 0))
+            if old is None and new is None:
+                continue
+            for group in (None, *self.products[product_id].category_ids):
+                keys = state.index.setdefault(group, [])
+                if old is not None:
+                    del keys[bisect_left(keys, old)]
+                if new is not None:
+                    insort(keys, new)
+            if new is not None:
+                state.keys[product_id] = new
+
+    def update(self, rows: Iterable[tuple[int, int, int]]) -> None:
+        """Заменяет продажи корзин значениями из строк (bucket, product_id, sold_qty).
+
+        Корзины раньше самого длинного окна пропускаются; корзины после текущей
+        сохраняются и войдут в окна при сдвиге.
+        """
+
+        oldest = self._oldest()
+        deltas: dict[str, dict[int, int]] = {window: {} for window in SALES_WINDOWS}
+        for row_bucket, product_id, sold_qty in rows:
+            if row_bucket < oldest:
+                continue
+            sales = self._buckets.setdefault(row_bucket, {})
+            delta = sold_qty - sales.get(product_id, 0)
+            if not delta:
+                continue
+            if sold_qty:
+                sales[product_id] = sold_qty
+            else:
+                del sales[product_id]
+            if row_bucket > self.bucket:
+                continue
+            for window, state in self._windows.items():
+                if row_bucket >= state.start:
+                    changes = deltas[window]
+                    changes[product_id] = changes.get(product_id, 0) + delta
+        for window, state in self._windows.items():
+            self._apply(state, deltas[window])
+
+    def advance(self, bucket: int) -> None:
+        """Сдвигает окна так, чтобы они заканчивались корзиной `bucket`."""
+
+        if bucket <= self.bucket:
+            return
+        previous = self.bucket
+        self.bucket = bucket
+        for window, state in self._windows.items():
+            start = window_start(window, bucket)
+            deltas: dict[int, int] = {}
+            for row_bucket, sales in self._buckets.items():
+                # выпавшие из окна корзины вычитаются, вошедшие — прибавляются
+                if state.start <= row_bucket < start and row_bucket <= previous:
+                    sign = -1
+                elif start <= row_bucket <= bucket and row_bucket > previous:
+                    sign = 1
+                else:
+                    continue
+                for product_id, sold_qty in sales.items():
+                    deltas[product_id] = deltas.get(product_id, 0) + sign * sold_qty
+            state.start = start
+            self._apply(state, deltas)
+
+        oldest = self._oldest()
+        for row_bucket in [b for b in self._buckets if b < oldest]:
+            del self._buckets[row_bucket]
+
+    def top(self, window: str, limit: int, category_id: int | None = None) -> list[dict]:
+        """Топ товаров окна, в том числе в поддереве категории.
+
+        Args:
+            window: Окно (`SALES_WINDOWS`).
+            limit: Сколько позиций вернуть.
+            category_id: Категория, в поддереве которой считается топ (None — все).
+
+        Returns:
+            list[dict]: Позиции с полями `TopProductOut`.
+        """
+
+        keys = self._windows[window].index.get(category_id, [])[:limit]
+        result = []
+        for sold_qty, _, product_id in keys:
+            product = self.products[product_id]
+            result.append(
+                {
+                    "product_name": product.name,
+                    "category_level1": product.root_category_name,
+                    "total_sold_qty": -sold_qty,
+                }
+            )
+        return result
+
+
+class SalesRankingCache:
+    """Держит `SalesRanking` процесса и синхронизирует его с `product_sales_buckets`."""
+
+    def __init__(self) -> None:
+        self._ranking: SalesRanking | None = None
+        self._synced_at: datetime | None = None
+        self._loaded_at = 0.0
+        self._tree_version = 0
+        self._poll_task: asyncio.Task | None = None
+
+    @property
+    def ranking(self) -> SalesRanking | None:
+        """Текущий рейтинг или None, если он ещё не загружен."""
+
+        return self._ranking
+
+    def get(self, category_id: int | None = None) -> SalesRanking | None:
+        """Рейтинг для ответа из памяти (с `category_id` — если категория есть в
+        загруженном дереве категорий, `category_tree.tree`).
+
+        Учитывает попадание или промах в метрике `cache_requests`.
+        """
+
+        ranking = self._ranking
+        tree = category_tree.tree
+        if ranking is None or (
+            category_id is not None and (tree is None or category_id not in tree)
+        ):
+            cache_misses.inc()
+            return None
+        cache_hits.inc()
+        return ranking
+
+    async def load(self) -> SalesRanking:
+        """Загружает продажи всех окон и товары с продажами из одного снимка БД."""
+
+        bucket = current_bucket()
+        tree_version = category_tree.version
+        async with SessionLocal() as session:
+            async with session.begin():
+                await session.connection(
+                    execution_options={"isolation_level": "REPEATABLE READ"}
+                )
+                synced_at = (await session.execute(text("select now()"))).scalar_one()
+                rows = await get_product_sales_buckets(
+                    session, window_start("30d", bucket)
+                )
+                products = await get_ranked_products(
+                    session, sorted({row.product_id for row in rows})
+                )
+
+        # сортировка окон занимает заметное время на больших объёмах: поток
+        # отдаёт GIL, и цикл событий продолжает обслуживать запросы
+        ranking = await asyncio.to_thread(
+            SalesRanking,
+            [tuple(row) for row in rows],
+            _ranked_products(products),
+            bucket,
+        )
+        self._ranking = ranking
+        self._synced_at = synced_at
+        self._loaded_at = time.monotonic()
+        self._tree_version = tree_version
+        logger.info(
+            "Загружен рейтинг продаж: %s строк корзин, %s товаров",
+            len(rows),
+            len(products),
+        )
+        return ranking
+
+    async def sync(self) -> int:
+        """Сдвигает окна к текущей корзине и забирает изменённые строки корзин.
+
+        Returns:
+            int: Сколько строк забрано.
+        """
+
+        ranking = self._ranking
+        bucket = current_bucket()
+        async with SessionLocal() as session:
+            async with session.begin():
+                synced_at = (await session.execute(text("select now()"))).scalar_one()
+                rows = await get_product_sales_buckets(
+                    session,
+                    window_start("30d", bucket),
+                    updated_since=self._synced_at - SYNC_OVERLAP,
+                )
+                missing = sorted(
+                    {row.product_id for row in rows} - ranking.products.keys()
+                )
+                products = await get_ranked_products(session, missing)
+
+        if self._ranking is not ranking:
+            return 0
+        ranking.products.update(_ranked_products(products))
+        ranking.advance(bucket)
+        ranking.update(tuple(row) for row in rows)
+        self._synced_at = synced_at
+        return len(rows)
+
+    async def start(self) -> None:
+        """Загружает рейтинг и запускает его синхронизацию."""
+
+        try:
+            await self.load()
+        except Exception:
+            logger.exception("Рейтинг продаж недоступен, топ товаров пойдёт в БД")
+        self._poll_task = asyncio.create_task(self._poll(), name="sales_ranking_poll")
+
+    async def stop(self) -> None:
+        """Останавливает синхронизацию."""
+
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            await asyncio.gather(self._poll_task, return_exceptions=True)
+            self._poll_task = None
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(settings.sales_ranking_sync_interval)
+            try:
+                if (
+                    self._ranking is None
+                    or time.monotonic() - self._loaded_at
+                    >= settings.sales_ranking_reload_interval
+                    or category_tree.version != self._tree_version
+                ):
+                    await self.load()
+                else:
+                    await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Синхронизация рейтинга продаж не удалась")
+
+
+sales_ranking = SalesRankingCache()
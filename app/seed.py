@@ -1,129 +1,406 @@
-from app.db import engine, SessionLocal
-from sqlalchemy.orm import Session
-from sqlalchemy import select
-from app.models import Category, Product, Customer, Order, OrderItem
-import random
+"""Генерация тестовых данных потоковым `COPY FROM STDIN`.
 
-COUNT_SEED_PRODUCTS = 200_000
+Строки не собираются в памяти: генераторы отдают их блоками, а `COPY` читает
+поток по частям, поэтому память не зависит от объёма. Таблицы загружаются
+по порядку внешних ключей, каждая — кусками по `--chunk-size` строк (кусок —
+одна транзакция); с `--jobs N` куски одной стадии выполняют N процессов.
 
+Данные детерминированы: случайные значения каждого блока из `RNG_BLOCK` строк
+берутся из генератора с зерном (`--seed`, таблица, номер блока), цена товара
+и дата заказа — из хеша его id. Поэтому один и тот же `--seed` даёт одни и те
+же строки при любых `--jobs` и `--chunk-size` (даты — относительно момента запуска).
 
-def create_categories(db: Session, items, parent_id=None, leaf_ids=None):
-    if leaf_ids is None:
-        leaf_ids = []
+После загрузки пересчитываются `customer_totals`, `product_sales_daily`,
+`product_sales_buckets` и материализованный топ товаров.
 
-    for item in items:
-        cat = Category(name=item["name"], parent_id=parent_id)
-        db.add(cat)
-        db.commit()
-        db.flush()
-
-        children = item.get("children")
-        if children:
-            create_categories(db, children, cat.id, leaf_ids)
-        else:
-            leaf_ids.append(cat.id)
-
-    return leaf_ids
-
-
-def run():
-
-    with SessionLocal() as db:
-        try:
-            has_any = db.execute(select(Category.id).limit(1)).scalar_one_or_none()
-            if has_any:
-                print("DB already seeded, skipping")
-                return
-
-            categories = [
-                {
-                    "name": "Бытовая техника",
-                    "children": [
-                        {"name": "Стиральные машины"},
-                        {
-                            "name": "Холодильники",
-                            "children": [
-                                {"name": "Однокамерные"},
-                                {
-                                    "name": "Двухкамерные",
-                                    "children": [
-                                        {
-                                            "name": "Инверторные",
-                                            "children": [{"name": "Встраиваемые"}],
-                                        }
-                                    ],
-                                },
-                            ],
-                        },
-                        {"name": "Телевизоры"},
-                    ],
-                },
-                {
-                    "name": "Компьютеры",
-                    "children": [
-                        {
-                            "name": "Ноутбуки",
-                            "children": [
-                                {"name": '17"'},
-                                {"name": '19"'},
-                            ],
-                        },
-                        {"name": "Моноблоки"},
-                    ],
-                },
-            ]
-
-            leaf_cats = create_categories(db, categories)
-            db.commit()
+    python -m app.seed
+    python -m app.seed --reset --scale 125 --jobs 8   # ~12.5M заказов, ~50M позиций
+"""
+
+import argparse
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from random import Random
+
+from sqlalchemy import select, text
+
+from app.db import SyncSessionLocal, sync_engine
+from app.models import Category
+from app.repositories.catalog import (
+    SQL_CLEAR_PRODUCT_SALES_BUCKETS,
+    SQL_CLEAR_PRODUCT_SALES_DAILY,
+    SQL_REBUILD_PRODUCT_SALES_BUCKETS,
+    SQL_REBUILD_PRODUCT_SALES_DAILY,
+    TOP_PRODUCTS_MV,
+)
+from app.repositories.customers import (
+    SQL_LOCK_CUSTOMER_TOTALS,
+    SQL_RECONCILE_CUSTOMER_TOTALS,
+)
+from app.repositories.partitions import SQL_CREATE_ORDER_PARTITIONS, add_months
+from app.settings import settings
+
+# Строк на одно зерно генератора случайных чисел; границы кусков кратны ему
+RNG_BLOCK = 10_000
+
+MASK64 = (1 << 64) - 1
+
+SECONDS_PER_DAY = 86_400
+
+SQL_RESET = text(
+    """
+    truncate order_events, order_items, orders, customer_totals, customers,
+             product_sales_daily, product_sales_buckets, product_stock_shards,
+             products, category_closure, categories
+    restart identity cascade
+    """
+)
+
+# Триггер customer_totals на вставку позиций: при загрузке выключается,
+# агрегат пересчитывается одним запросом после неё
+ITEMS_TOTALS_TRIGGER = "trg_order_items_customer_totals_insert"
+
+SQL_SYNC_SEQUENCE = (
+    "select setval(pg_get_serial_sequence('{table}', 'id'), "
+    "coalesce(max(id), 0) + 1, false) from {table}"
+)
+
+
+@dataclass(frozen=True)
+class Scale:
+    """Объём генерируемых данных.
+
+    Дерево категорий полное: `category_breadth` корней, у каждой нелистовой
+    категории `category_breadth` детей, `category_depth` уровней; товары
+    распределяются по листьям.
+    """
+
+    category_depth: int = 3
+    category_breadth: int = 5
+    products: int = 200_000
+    customers: int = 10_000
+    orders: int = 100_000
+    max_items_per_order: int = 7
+    days: int = 90
+    seed: int = 1
+    # Момент «сейчас», от которого отсчитываются даты заказов
+    now: float = field(default_factory=time.time)
+
+    def level_start(self, level: int) -> int:
+        """id первой категории уровня `level` (с 1); id выдаются по уровням."""
+
+        return 1 + sum(self.category_breadth**j for j in range(1, level))
+
+    @property
+    def categories(self) -> int:
+        return self.level_start(self.category_depth + 1) - 1
+
+    @property
+    def first_leaf_id(self) -> int:
+        return self.level_start(self.category_depth)
+
+
+def _mix(seed: int, n: int) -> int:
+    """64-битный хеш (splitmix64) числа `n`: значение, вычислимое по id без состояния."""
+
+    x = (seed * 0x9E3779B97F4A7C15 + n) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+def _blocks(table: str, scale: Scale, start: int, stop: int) -> Iterator[tuple[Random, range]]:
+    """Делит id [start, stop) на блоки `RNG_BLOCK` с собственным зерном."""
+
+    for block_start in range(start, stop, RNG_BLOCK):
+        block = (block_start - 1) // RNG_BLOCK
+        rng = Random(f"{scale.seed}:{table}:{block}")
+        yield rng, range(block_start, min(block_start + RNG_BLOCK, stop))
+
+
+def product_price(scale: Scale, product_id: int) -> int:
+    return 10_000 + _mix(scale.seed, product_id) % 110_001
+
+
+def order_created_at(scale: Scale, order_id: int) -> str:
+    ago = _mix(scale.seed + 1, order_id) % (scale.days * SECONDS_PER_DAY)
+    return datetime.fromtimestamp(scale.now - ago, timezone.utc).isoformat()
+
+
+def category_rows(scale: Scale, start: int, stop: int) -> Iterator[str]:
+    breadth = scale.category_breadth
+    for level in range(1, scale.category_depth + 1):
+        level_start = scale.level_start(level)
+        parent_start = scale.level_start(level - 1) if level > 1 else None
+        for i in range(breadth**level):
+            parent_id = r"\N" if parent_start is None else parent_start + i // breadth
+            yield f"{level_start + i}\tКатегория {level}.{i + 1}\t{parent_id}\n"
+
+
+def product_rows(scale: Scale, start: int, stop: int) -> Iterator[str]:
+    first_leaf, last_leaf = scale.first_leaf_id, scale.categories
+    for rng, ids in _blocks("products", scale, start, stop):
+        for i in ids:
+            category_id = rng.randint(first_leaf, last_leaf)
+            stock = rng.randint(10, 100)
+            yield f"{i}\tProduct {i}\t{category_id}\t{stock}\t{product_price(scale, i)}\n"
+
+
+def customer_rows(scale: Scale, start: int, stop: int) -> Iterator[str]:
+    for rng, ids in _blocks("customers", scale, start, stop):
+        for i in ids:
+            yield f"{i}\tКлиент {i}\tГород {rng.randint(1, 500)}, улица {rng.randint(1, 2000)}\n"
+
+
+def order_rows(scale: Scale, start: int, stop: int) -> Iterator[str]:
+    for rng, ids in _blocks("orders", scale, start, stop):
+        for i in ids:
+            customer_id = rng.randint(1, scale.customers)
+            yield f"{i}\t{customer_id}\tsubmitted\t{order_created_at(scale, i)}\n"
 
-            customers = [
-                Customer(name="ООО Ромашка", address="Москва, Твердская 1"),
-                Customer(name="ИП Иванов", address="СПб, Невский 10"),
-                Customer(name="ЗАО Тест", address="Казань, Кремль 3"),
-            ]
-
-            db.add_all(customers)
-            db.flush()
-
-            all_products = []
-            for i in range(COUNT_SEED_PRODUCTS):
-                cat_id = random.choice(leaf_cats)
-                price = random.randint(10_000, 120_000)
-                stock = random.randint(10, 100)
-                all_products.append(
-                    Product(
-                        name=f"Product {i}",
-                        price=price,
-                        category_id=cat_id,
-                        stock_qty=stock,
-                    )
+
+def order_item_rows(scale: Scale, start: int, stop: int) -> Iterator[str]:
+    products = range(1, scale.products + 1)
+    max_items = min(scale.max_items_per_order, scale.products)
+    for rng, ids in _blocks("order_items", scale, start, stop):
+        for order_id in ids:
+            created_at = order_created_at(scale, order_id)
+            for product_id in rng.sample(products, rng.randint(1, max_items)):
+                qty = rng.randint(1, 5)
+                price = product_price(scale, product_id)
+                yield (
+                    f"{order_id}\t{product_id}\t{created_at}\t{qty}\t{price}\t"
+                    f"{created_at}\t{created_at}\n"
                 )
 
-            db.add_all(all_products)
-            db.flush()
 
-            for _ in range(300):
-                cust = random.choice(customers)
-                o = Order(customer_id=cust.id, status="submitted")
-                db.add(o)
-                db.flush()
+# Таблица -> (колонки COPY, генератор строк, число строк-ключей по масштабу)
+TABLES = {
+    "categories": ("id, name, parent_id", category_rows, lambda s: s.categories),
+    "products": (
+        "id, name, category_id, stock_qty, price", product_rows, lambda s: s.products
+    ),
+    "customers": ("id, name, address", customer_rows, lambda s: s.customers),
+    "orders": ("id, customer_id, status, created_at", order_rows, lambda s: s.orders),
+    # позиции генерируются по диапазонам id заказов
+    "order_items": (
+        "order_id, product_id, order_created_at, qty, unit_price, created_at, updated_at",
+        order_item_rows,
+        lambda s: s.orders,
+    ),
+}
+
+# Стадии загрузки по порядку внешних ключей; таблицы одной стадии независимы
+STAGES = (("categories",), ("products", "customers"), ("orders",), ("order_items",))
+
+# Таблицы с serial id, чьи последовательности сдвигаются за загруженные id
+SEQUENCE_TABLES = ("categories", "products", "customers", "orders")
+
+
+class RowStream:
+    """Файлоподобный поток для `copy_expert` поверх генератора текстовых строк."""
+
+    def __init__(self, rows: Iterable[str]):
+        self._rows = iter(rows)
+        self._buffer = b""
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        for row in self._rows:
+            data = row.encode()
+            chunks.append(data)
+            length += len(data)
+            self.count += 1
+            if 0 <= size <= length:
+                break
+        data = b"".join(chunks)
+        if size < 0:
+            self._buffer = b""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def copy_chunk(table: str, scale: Scale, start: int, stop: int) -> int:
+    """Загружает строки таблицы для id [start, stop) одной транзакцией.
+
+    Returns:
+        int: Число загруженных строк.
+    """
+
+    columns, generate, _ = TABLES[table]
+    stream = RowStream(generate(scale, start, stop))
+    connection = sync_engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f"copy {table} ({columns}) from stdin", stream)
+        connection.commit()
+    finally:
+        connection.close()
+    return stream.count
+
+
+def _init_worker() -> None:
+    # соединения пула родителя не должны использоваться в дочернем процессе
+    sync_engine.dispose(close=False)
+
+
+def _chunks(total: int, chunk_size: int) -> Iterator[tuple[int, int]]:
+    chunk_size = max(RNG_BLOCK, chunk_size // RNG_BLOCK * RNG_BLOCK)
+    for start in range(1, total + 1, chunk_size):
+        yield start, min(start + chunk_size, total + 1)
+
+
+def load(scale: Scale, jobs: int = 1, chunk_size: int = 100_000) -> None:
+    """Загружает все таблицы по стадиям и печатает скорость по каждой."""
+
+    executor = (
+        ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker)
+        if jobs > 1
+        else None
+    )
+    try:
+        for stage in STAGES:
+            started = time.perf_counter()
+            tasks = []
+            for table in stage:
+                total = 1 if table == "categories" else TABLES[table][2](scale)
+                for start, stop in _chunks(total, chunk_size):
+                    if executor is None or table == "categories":
+                        tasks.append((table, copy_chunk(table, scale, start, stop)))
+                    else:
+                        future = executor.submit(copy_chunk, table, scale, start, stop)
+                        tasks.append((table, future))
+            rows = dict.fromkeys(stage, 0)
+            for table, task in tasks:
+                rows[table] += task if isinstance(task, int) else task.result()
+            elapsed = time.perf_counter() - started
+            for table, count in rows.items():
+                print(f"{table}: {count} rows in {elapsed:.1f}s ({count / elapsed:,.0f} rows/s)")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
 
-                picks = random.sample(all_products, k=random.randint(1, 7))
-                for p in picks:
-                    qty = random.randint(1, 5)
-                    db.add(
-                        OrderItem(
-                            order_id=o.id, product_id=p.id, qty=qty, unit_price=p.price
-                        )
-                    )
+def rebuild_aggregates() -> None:
+    """Выравнивает последовательности id и пересчитывает агрегаты после загрузки."""
 
+    with SyncSessionLocal() as db:
+        for table in SEQUENCE_TABLES:
+            db.execute(text(SQL_SYNC_SEQUENCE.format(table=table)))
+        db.execute(SQL_LOCK_CUSTOMER_TOTALS)
+        db.execute(SQL_RECONCILE_CUSTOMER_TOTALS)
+        db.execute(SQL_CLEAR_PRODUCT_SALES_DAILY)
+        db.execute(SQL_REBUILD_PRODUCT_SALES_DAILY)
+        db.execute(SQL_CLEAR_PRODUCT_SALES_BUCKETS)
+        db.execute(SQL_REBUILD_PRODUCT_SALES_BUCKETS)
+        db.commit()
+        db.execute(text(f"REFRESH MATERIALIZED VIEW {TOP_PRODUCTS_MV}"))
+        db.commit()
+
+    with sync_engine.connect() as connection:
+        connection.execution_options(isolation_level="AUTOCOMMIT").execute(
+            text("analyze")
+        )
+
+
+def create_order_partitions(scale: Scale) -> None:
+    """Создаёт месячные партиции заказов на весь диапазон дат `scale` и вперёд."""
+
+    first = datetime.fromtimestamp(scale.now - scale.days * SECONDS_PER_DAY, timezone.utc)
+    last = add_months(
+        datetime.fromtimestamp(scale.now, timezone.utc).date(),
+        settings.order_partition_months_ahead,
+    )
+    with SyncSessionLocal() as db:
+        db.execute(
+            SQL_CREATE_ORDER_PARTITIONS,
+            {"first_month": first.date(), "last_month": last},
+        )
+        db.commit()
+
+
+def set_items_totals_trigger(enabled: bool) -> None:
+    action = "enable" if enabled else "disable"
+    with SyncSessionLocal() as db:
+        db.execute(text(f"alter table order_items {action} trigger {ITEMS_TOTALS_TRIGGER}"))
+        db.commit()
+
+
+def run(scale: Scale, jobs: int = 1, chunk_size: int = 100_000, reset: bool = False) -> None:
+    with SyncSessionLocal() as db:
+        if reset:
+            db.execute(SQL_RESET)
             db.commit()
+        elif db.execute(select(Category.id).limit(1)).scalar_one_or_none():
+            print("DB already seeded, skipping")
+            return
+
+    started = time.perf_counter()
+    create_order_partitions(scale)
+    set_items_totals_trigger(False)
+    try:
+        load(scale, jobs, chunk_size)
+    finally:
+        set_items_totals_trigger(True)
+    rebuild_aggregates()
+    print(f"Seed done in {time.perf_counter() - started:.1f}s.")
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    defaults = Scale()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="множитель числа товаров, клиентов и заказов")
+    parser.add_argument("--category-depth", type=int, default=defaults.category_depth)
+    parser.add_argument("--category-breadth", type=int, default=defaults.category_breadth)
+    parser.add_argument("--products", type=int, default=defaults.products)
+    parser.add_argument("--customers", type=int, default=defaults.customers)
+    parser.add_argument("--orders", type=int, default=defaults.orders)
+    parser.add_argument("--max-items-per-order", type=int,
+                        default=defaults.max_items_per_order,
+                        help="позиций в заказе: от 1 до этого числа")
+    parser.add_argument("--days", type=int, default=defaults.days,
+                        help="заказы распределяются по последним N дням")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--jobs", type=int, default=1, help="процессов загрузки")
+    parser.add_argument("--chunk-size", type=int, default=100_000,
+                        help="строк-ключей в одной транзакции COPY")
+    parser.add_argument("--reset", action="store_true",
+                        help="очистить таблицы перед загрузкой")
+    return parser.parse_args(argv)
+
+
+def scaled(scale: Scale, factor: float) -> Scale:
+    """Масштаб с числом товаров, клиентов и заказов, умноженным на `factor`."""
+
+    return replace(
+        scale,
+        products=max(1, round(scale.products * factor)),
+        customers=max(1, round(scale.customers * factor)),
+        orders=round(scale.orders * factor),
+    )
 
-            print("Seed done.")
 
-        except Exception as e:
-            print(e)
+def scale_from_args(args: argparse.Namespace) -> Scale:
+    scale = Scale(
+        category_depth=args.category_depth,
+        category_breadth=args.category_breadth,
+        products=args.products,
+        customers=args.customers,
+        orders=args.orders,
+        max_items_per_order=args.max_items_per_order,
+        days=args.days,
+        seed=args.seed,
+    )
+    return scaled(scale, args.scale)
 
 
 if "__main__" == __name__:
-    run()
+    args = parse_args()
+    run(scale_from_args(args), args.jobs, args.chunk_size, args.reset)
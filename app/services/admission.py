@@ -0,0 +1,227 @@
+"""Контроль допуска HTTP-запросов (admission control) по нагрузке на БД.
+
+Когда пул соединений исчерпан, запросы копятся в ожидании соединения в
+`get_db`, и задержка растёт у всех маршрутов сразу, включая оформление
+заказа. Контроллер ограничивает число одновременно обрабатываемых запросов
+процесса адаптивным лимитом и распределяет его по классам маршрутов в
+порядке приоритета:
+
+- `write` — запись (все методы, кроме GET/HEAD): может занять весь лимит;
+- `read` — чтение каталога: не больше `ADMISSION_SHARES["read"]` лимита;
+- `analytics` — тяжёлые отчёты (`ADMISSION_ROUTE_CLASSES`): не больше
+  `ADMISSION_SHARES["analytics"]` лимита.
+
+Запрос сверх лимита ждёт в ограниченной очереди своего класса; освободившееся
+место получает первый ожидающий самого приоритетного класса, которому хватает
+доли. При полной очереди или ожидании дольше `ADMISSION_QUEUE_TIMEOUT` запрос
+сразу получает 503 с `Retry-After`.
+
+Лимит подстраивается раз в `ADMISSION_ADJUST_INTERVAL` секунд по задержке БД
+за прошедший интервал (AIMD): если среднее время SQL-запроса или наибольшее
+ожидание соединения пула выше `ADMISSION_DB_LATENCY_TARGET`, лимит
+уменьшается в `ADMISSION_DECREASE_FACTOR` раз (не ниже
+`ADMISSION_MIN_LIMIT`), а если БД отвечает быстро и в лимит упирались —
+растёт на единицу (не выше `ADMISSION_MAX_LIMIT`). Доли классов считаются от
+текущего лимита, поэтому при перегрузке первой сжимается аналитика.
+
+Состояние — в памяти процесса: у каждого воркера свой лимит и свои очереди.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+
+from app.metrics import admission_limit, admission_requests
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Классы маршрутов в порядке приоритета
+ADMISSION_CLASSES = ("write", "read", "analytics")
+
+# Методы без записи; остальные запросы — класс `write`
+READ_METHODS = frozenset(("GET", "HEAD"))
+
+# Служебные пути не ограничиваются: метрики и документация нужны под нагрузкой
+EXEMPT_PATHS = ("/metrics", "/docs", "/redoc", "/openapi.json")
+
+
+class AdmissionRejectedError(Exception):
+    """Запрос не допущен: очередь класса заполнена или ожидание истекло."""
+
+    def __init__(self, route_class: str, reason: str):
+        super().__init__(f"{route_class}: {reason}")
+        self.route_class = route_class
+        self.reason = reason
+
+
+def classify(method: str, path: str) -> str | None:
+    """Класс маршрута запроса; None — запрос не ограничивается.
+
+    Args:
+        method: HTTP-метод.
+        path: Путь запроса (с `API_PREFIX`).
+    """
+
+    if path.startswith(EXEMPT_PATHS):
+        return None
+    if method not in READ_METHODS:
+        return "write"
+    relative = path.removeprefix(settings.api_prefix)
+    for prefix, route_class in settings.admission_route_classes.items():
+        if relative.startswith(prefix):
+            return route_class
+    return "read"
+
+
+def max_limit() -> int:
+    """Верхняя граница лимита: `ADMISSION_MAX_LIMIT` или весь пул соединений."""
+
+    return settings.admission_max_limit or settings.db_pool_size + settings.db_max_overflow
+
+
+class AdmissionController:
+    """Адаптивный лимит одновременных запросов процесса с очередями по классам."""
+
+    def __init__(self) -> None:
+        self.limit = max_limit()
+        self.in_flight = 0
+        self._class_in_flight = dict.fromkeys(ADMISSION_CLASSES, 0)
+        self._queues: dict[str, deque[asyncio.Future]] = {
+            route_class: deque() for route_class in ADMISSION_CLASSES
+        }
+        # задержка БД за текущий интервал подстройки
+        self._window_started = time.monotonic()
+        self._query_time = 0.0
+        self._queries = 0
+        self._pool_wait = 0.0
+        self._saturated = False
+
+    def start(self) -> None:
+        """Сбрасывает лимит к верхней границе и публикует его в метриках."""
+
+        self.limit = max_limit()
+        admission_limit.set(self.limit)
+
+    def class_limit(self, route_class: str) -> int:
+        """Сколько запросов класса допускается одновременно при текущем лимите."""
+
+        share = settings.admission_shares.get(route_class, 1.0)
+        return max(1, math.floor(self.limit * share))
+
+    def _can_admit(self, route_class: str) -> bool:
+        return (
+            self.in_flight < self.limit
+            and self._class_in_flight[route_class] < self.class_limit(route_class)
+        )
+
+    def _admit(self, route_class: str) -> None:
+        self.in_flight += 1
+        self._class_in_flight[route_class] += 1
+        if self.in_flight >= self.limit:
+            self._saturated = True
+
+    async def acquire(self, route_class: str) -> None:
+        """Занимает место для запроса класса, при необходимости ждёт в очереди.
+
+        Raises:
+            AdmissionRejectedError: Очередь класса заполнена или ожидание
+                дольше `ADMISSION_QUEUE_TIMEOUT`.
+        """
+
+        queue = self._queues[route_class]
+        if not queue and self._can_admit(route_class):
+            self._admit(route_class)
+            admission_requests.labels(route_class, "admitted").inc()
+            return
+
+        self._saturated = True
+        if len(queue) >= settings.admission_queue_sizes.get(route_class, 0):
+            admission_requests.labels(route_class, "rejected").inc()
+            raise AdmissionRejectedError(route_class, "queue full")
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append(future)
+        # asyncio.wait не отменяет future: место, выданное `_wake` в момент
+        # истечения ожидания, видно по future.done() и не теряется
+        try:
+            await asyncio.wait((future,), timeout=settings.admission_queue_timeout)
+        except asyncio.CancelledError:
+            # клиент отключился: место, выданное перед отменой, возвращается
+            if future.done():
+                self.release(route_class)
+            else:
+                queue.remove(future)
+                future.cancel()
+            raise
+        if not future.done():
+            queue.remove(future)
+            future.cancel()
+            admission_requests.labels(route_class, "timeout").inc()
+            raise AdmissionRejectedError(route_class, "queue timeout")
+        admission_requests.labels(route_class, "queued").inc()
+
+    def release(self, route_class: str) -> None:
+        """Освобождает место запроса и передаёт его ожидающим по приоритету."""
+
+        self.in_flight -= 1
+        self._class_in_flight[route_class] -= 1
+        if time.monotonic() - self._window_started >= settings.admission_adjust_interval:
+            self._adjust()
+        self._wake()
+
+    def _wake(self) -> None:
+        for route_class in ADMISSION_CLASSES:
+            queue = self._queues[route_class]
+            while queue and self._can_admit(route_class):
+                future = queue.popleft()
+                if future.done():
+                    continue
+                self._admit(route_class)
+                future.set_result(None)
+
+    def observe_query(self, duration: float) -> None:
+        """Учитывает время выполнения SQL-запроса, сек."""
+
+        self._query_time += duration
+        self._queries += 1
+
+    def observe_pool_wait(self, wait: float) -> None:
+        """Учитывает ожидание соединения из пула основной БД, сек."""
+
+        if wait > self._pool_wait:
+            self._pool_wait = wait
+
+    def _adjust(self) -> None:
+        target = settings.admission_db_latency_target_ms / 1000
+        latency = self._query_time / self._queries if self._queries else 0.0
+        limit = self.limit
+        if latency > target or self._pool_wait > target:
+            limit = max(
+                settings.admission_min_limit,
+                math.floor(limit * settings.admission_decrease_factor),
+            )
+        elif self._saturated:
+            limit = min(max_limit(), limit + 1)
+        if limit != self.limit:
+            logger.info(
+                "Лимит допуска %d -> %d: SQL %.1f мс (%d запросов), ожидание пула %.1f мс",
+                self.limit,
+                limit,
+                latency * 1000,
+                self._queries,
+                self._pool_wait * 1000,
+            )
+            self.limit = limit
+            admission_limit.set(limit)
+
+        self._window_started = time.monotonic()
+        self._query_time = 0.0
+        self._queries = 0
+        self._pool_wait = 0.0
+        self._saturated = self.in_flight >= self.limit
+
+
+admission = AdmissionController()
@@ -0,0 +1,90 @@
+"""Групповая фиксация (group commit) одновременных запросов записи.
+
+Запросы с одинаковым ключом (например, товаром), пришедшие в течение окна в
+несколько миллисекунд, собираются в памяти процесса в группу и выполняются
+одной транзакцией: одна блокировка, одно списание, одна многострочная вставка
+вместо очереди транзакций на одной строке. Группа закрывается по окончании
+окна или при достижении максимального размера; следующая группа того же
+ключа собирается, пока выполняется предыдущая.
+
+Функция применения получает элементы в порядке поступления и возвращает
+результат для каждого из них: значение или исключение, которое получит
+только этот запрос. Исключение самой функции (ошибка БД, исчерпанные повторы
+транзакции) получают все запросы группы. Отмена ожидающего запроса не
+исключает его из группы: запись выполнится, ответ будет отброшен.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Generic, TypeVar
+
+from app.metrics import group_commit_size
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class GroupCommit(Generic[K, T, R]):
+    """Сборщик групп запросов по ключу и их выполнение функцией `apply`."""
+
+    def __init__(
+        self,
+        operation: str,
+        apply: Callable[[K, list[T]], Awaitable[list[R | Exception]]],
+    ):
+        self.operation = operation
+        self._apply = apply
+        self._pending: dict[K, list[tuple[T, asyncio.Future]]] = {}
+        self._running: set[asyncio.Task] = set()
+
+    async def submit(self, key: K, item: T, window: float, max_size: int) -> R:
+        """Добавляет элемент в открытую группу ключа и ждёт его результат.
+
+        Args:
+            key: Ключ группы.
+            item: Элемент запроса.
+            window: Сколько секунд группа собирается после первого элемента.
+            max_size: Размер, при котором группа закрывается досрочно.
+
+        Raises:
+            Exception: Исключение, назначенное этому элементу или всей группе.
+        """
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        group = self._pending.get(key)
+        if group is None:
+            group = self._pending[key] = []
+            loop.call_later(window, self._close, key, group)
+        group.append((item, future))
+        if len(group) >= max_size:
+            self._close(key, group)
+        return await future
+
+    def _close(self, key: K, group: list[tuple[T, asyncio.Future]]) -> None:
+        # группа могла закрыться досрочно по размеру раньше таймера
+        if self._pending.get(key) is not group:
+            return
+        del self._pending[key]
+        task = asyncio.create_task(self._run(key, group))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, key: K, group: list[tuple[T, asyncio.Future]]) -> None:
+        group_commit_size.labels(self.operation).observe(len(group))
+        try:
+            results = await self._apply(key, [item for item, _ in group])
+        except asyncio.CancelledError:
+            for _, future in group:
+                future.cancel()
+            raise
+        except Exception as e:
+            results = [e] * len(group)
+        for (_, future), result in zip(group, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,140 @@
+"""Идемпотентные запросы записи по заголовку `Idempotency-Key`.
+
+Клиент, повторяющий запрос после таймаута, передаёт тот же ключ. Ключ занимается
+строкой `idempotency_keys` в транзакции самой записи (`claim_idempotency_key`) и
+фиксируется вместе с ответом, поэтому запись выполняется не больше одного раза:
+повтор после фиксации получает сохранённый ответ, а одновременный повтор ждёт
+вставку ключа первой транзакцией. Ответы с ошибкой (4xx) откатывают транзакцию и
+не сохраняются — такой запрос с тем же ключом выполняется заново.
+
+Недавние ответы держит LRU в памяти процесса, и частые повторы одного ключа
+отвечаются без обращения к БД. Истёкшие ключи удаляет фоновая задача
+(`purge_idempotency_keys_job`).
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.metrics import cache_requests, idempotent_replays
+from app.repositories.idempotency import claim_idempotency_key, save_idempotent_response
+from app.services.unit_of_work import run_in_transaction
+from app.settings import settings
+
+
+class IdempotencyKeyReusedError(Exception):
+    """Ключ уже использован запросом с другим маршрутом или телом."""
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    """Ответ выполненного запроса и отпечаток этого запроса."""
+
+    request_hash: str
+    body: object
+    expires_at: float
+
+
+class ResponseCache:
+    """LRU ответов по ключу идемпотентности с учётом срока хранения."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, StoredResponse] = OrderedDict()
+
+    def get(self, key: str) -> StoredResponse | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            cache_requests.labels("idempotency", "miss").inc()
+            return None
+        if entry.expires_at <= time.time():
+            del self._entries[key]
+            cache_requests.labels("idempotency", "miss").inc()
+            return None
+        self._entries.move_to_end(key)
+        cache_requests.labels("idempotency", "hit").inc()
+        return entry
+
+    def put(self, key: str, entry: StoredResponse) -> None:
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+response_cache = ResponseCache(settings.idempotency_cache_size)
+
+
+def request_fingerprint(operation: str, path_params: dict, payload: object) -> str:
+    """Отпечаток запроса: операция, параметры пути и тело в каноническом JSON."""
+
+    canonical = json.dumps(
+        [operation, path_params, payload], sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _replay(entry: StoredResponse, request_hash: str) -> object:
+    if entry.request_hash != request_hash:
+        raise IdempotencyKeyReusedError
+    return entry.body
+
+
+async def run_idempotent(
+    session: AsyncSession,
+    key: str,
+    request_hash: str,
+    work: Callable[[], Awaitable[object]],
+    *,
+    operation: str,
+) -> tuple[object, bool]:
+    """Выполняет `work` не больше одного раза на ключ `key`.
+
+    Ключ занимается и ответ сохраняется в той же транзакции, что и `work`
+    (с повтором при конфликте, см. `run_in_transaction`).
+
+    Args:
+        session: Сессия без открытой транзакции.
+        key: Значение заголовка `Idempotency-Key`.
+        request_hash: Отпечаток запроса (`request_fingerprint`).
+        work: Тело транзакции; возвращает ответ, сериализуемый в JSON.
+        operation: Имя операции для метрик и логов.
+
+    Returns:
+        tuple[object, bool]: Ответ и признак того, что он взят из сохранённых.
+
+    Raises:
+        IdempotencyKeyReusedError: Ключ использован другим запросом.
+    """
+
+    entry = response_cache.get(key)
+    if entry is not None:
+        idempotent_replays.labels(operation).inc()
+        return _replay(entry, request_hash), True
+
+    async def claim_and_work() -> tuple[StoredResponse, bool]:
+        stored = await claim_idempotency_key(
+            session, key, request_hash, settings.idempotency_key_ttl
+        )
+        if stored is not None:
+            return StoredResponse(
+                stored.request_hash, stored.response, stored.expires_at.timestamp()
+            ), True
+        body = await work()
+        expires_at = await save_idempotent_response(session, key, body)
+        return StoredResponse(request_hash, body, expires_at.timestamp()), False
+
+    entry, replayed = await run_in_transaction(
+        session, claim_and_work, operation=operation
+    )
+    response_cache.put(key, entry)
+    if replayed:
+        idempotent_replays.labels(operation).inc()
+    return _replay(entry, request_hash), replayed
@@ -0,0 +1,143 @@
+"""Транзакция записи как единица работы с повтором при конфликте.
+
+PostgreSQL прерывает одну из транзакций взаимной блокировки (`deadlock_detected`,
+SQLSTATE 40P01) и транзакции, которые нельзя сериализовать (`serialization_failure`,
+40001). Обе ошибки временные: та же транзакция, начатая заново, обычно проходит.
+`run_in_transaction` выполняет работу в `session.begin()` и при этих ошибках
+повторяет её целиком с экспоненциальной задержкой со случайным разбросом
+(full jitter), пока не исчерпаны число попыток и бюджет времени. Остальные ошибки
+(в том числе `HTTPException` из работы) пробрасываются сразу.
+
+Работа должна быть повторяемой: всё состояние она читает из БД внутри
+транзакции, а побочные эффекты вне БД допустимы только идемпотентные.
+"""
+
+import asyncio
+import logging
+import random
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import TypeVar
+
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.metrics import transaction_conflicts, transaction_retries
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# SQLSTATE временных конфликтов и их метки в метриках
+RETRYABLE_SQLSTATES = {
+    "40P01": "deadlock",
+    "40001": "serialization",
+}
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Ограничения повторов: число попыток, задержки и общий бюджет, сек."""
+
+    attempts: int
+    base_delay: float
+    max_delay: float
+    budget: float
+
+    @classmethod
+    def from_settings(cls) -> "RetryPolicy":
+        return cls(
+            attempts=settings.tx_retry_attempts,
+            base_delay=settings.tx_retry_base_delay,
+            max_delay=settings.tx_retry_max_delay,
+            budget=settings.tx_retry_budget,
+        )
+
+    def delay(self, retry: int) -> float:
+        """Задержка перед повтором номер `retry` (с 1): U(0, base * 2^(retry-1))."""
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry - 1)))
+
+
+class TransactionConflictError(Exception):
+    """Транзакция не выполнена: конфликт повторялся до исчерпания попыток."""
+
+    def __init__(self, operation: str, sqlstate: str, attempts: int):
+        super().__init__(
+            f"{operation}: конфликт {sqlstate} после {attempts} попыток"
+        )
+        self.operation = operation
+        self.sqlstate = sqlstate
+        self.attempts = attempts
+
+
+def retryable_sqlstate(exc: BaseException) -> str | None:
+    """SQLSTATE ошибки, если транзакцию с ней имеет смысл повторить."""
+
+    if not isinstance(exc, DBAPIError):
+        return None
+    sqlstate = getattr(exc.orig, "sqlstate", None) or getattr(exc.orig, "pgcode", None)
+    return sqlstate if sqlstate in RETRYABLE_SQLSTATES else None
+
+
+async def run_in_transaction(
+    session: AsyncSession,
+    work: Callable[[], Awaitable[T]],
+    *,
+    operation: str,
+    policy: RetryPolicy | None = None,
+) -> T:
+    """Выполняет `work` в транзакции `session`, повторяя её при 40P01 и 40001.
+
+    Перед повтором транзакция откатывается (`session.begin()` делает это при
+    ошибке), а загруженные ORM-объекты сессии истекают и перечитываются.
+
+    Args:
+        session: Сессия без открытой транзакции.
+        work: Тело транзакции; вызывается заново на каждой попытке.
+        operation: Имя операции для метрик и логов (`add_item`, `add_items_batch`).
+        policy: Ограничения повторов; по умолчанию из настроек `TX_RETRY_*`.
+
+    Returns:
+        Результат `work` успешной попытки.
+
+    Raises:
+        TransactionConflictError: Конфликт не разрешился за отведённые попытки.
+    """
+
+    policy = policy or RetryPolicy.from_settings()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + policy.budget
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            async with session.begin():
+                return await work()
+        except DBAPIError as e:
+            sqlstate = retryable_sqlstate(e)
+            if sqlstate is None:
+                raise
+            reason = RETRYABLE_SQLSTATES[sqlstate]
+            delay = policy.delay(attempt)
+            if attempt >= policy.attempts or loop.time() + delay > deadline:
+                transaction_conflicts.labels(operation, reason).inc()
+                logger.warning(
+                    "%s: конфликт %s (%s) не разрешился за %s попыток",
+                    operation,
+                    sqlstate,
+                    reason,
+                    attempt,
+                )
+                raise TransactionConflictError(operation, sqlstate, attempt) from e
+            transaction_retries.labels(operation, reason).inc()
+            logger.info(
+                "%s: конфликт %s (%s), повтор %s через %.3f с",
+                operation,
+                sqlstate,
+                reason,
+                attempt,
+                delay,
+            )
+        await asyncio.sleep(delay)
@@ -2,12 +2,22 @@
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pathlib import Path
+from typing import Literal
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 
+def to_async_url(url: str) -> str:
+    """Подменяет драйвер в URL БД на `asyncpg` (`postgresql+psycopg2://` и т.п.)."""
+
+    scheme, sep, rest = url.partition("://")
+    if not sep:
+        return url
+    return f"{scheme.split('+', 1)[0]}+asyncpg://{rest}"
+
+
 class Sessings(BaseSettings):
-    """Настройки сервиса: БД, метаданные приложения и префикс API."""
+    """Настройки сервиса: БД, пул соединений, метаданные приложения и префикс API."""
 
     model_config = SettingsConfigDict(
         env_file=BASE_DIR / ".env",
@@ -18,5 +28,143 @@ class Sessings(BaseSettings):
     version: str = ""
     api_prefix: str = ""
 
+    # Пул соединений асинхронного движка (на один процесс uvicorn)
+    db_pool_size: int = 20
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+
+    # Реплики для читающих эндпоинтов (JSON-список URL, как DATABASE_URL); реплика
+    # с отставанием больше DB_REPLICA_MAX_LAG сек или недоступная не используется
+    database_replica_urls: list[str] = []
+    db_replica_pool_size: int = 10
+    db_replica_max_lag: float = 5.0
+    db_replica_check_interval: float = 5.0
+
+    # Списание остатка в add_item_to_order: FOR UPDATE + ORM или один атомарный UPDATE
+    stock_reservation_mode: Literal["locking", "atomic"] = "locking"
+
+    # Групповая фиксация add_item_to_order без Idempotency-Key: запросы одного
+    # нешардированного товара, пришедшие за окно, сек, выполняются одной транзакцией
+    # (0 — выключено); группа закрывается досрочно при max_size запросах
+    add_item_group_commit_window: float = 0.0
+    add_item_group_commit_max_size: int = 128
+
+    # Повтор транзакций записи при deadlock (40P01) и serialization failure (40001):
+    # число попыток, задержка (экспонента со случайным разбросом) и бюджет, сек
+    tx_retry_attempts: int = 5
+    tx_retry_base_delay: float = 0.01
+    tx_retry_max_delay: float = 0.5
+    tx_retry_budget: float = 2.0
+
+    # Ответы запросов записи с Idempotency-Key: срок хранения, сек, размер LRU в
+    # памяти процесса и период удаления истёкших ключей, сек (0 — не удалять)
+    idempotency_key_ttl: float = 86_400.0
+    idempotency_cache_size: int = 10_000
+    idempotency_purge_interval: float = 300.0
+
+    # Контроль допуска запросов по нагрузке на БД (app.services.admission): лимит
+    # одновременных запросов процесса (0 — DB_POOL_SIZE + DB_MAX_OVERFLOW) и его
+    # нижняя граница; доли лимита и очереди по классам маршрутов, ожидание в очереди
+    # и Retry-After ответа 503, сек; классы маршрутов по префиксу пути без API_PREFIX
+    admission_control_enabled: bool = False
+    admission_max_limit: int = 0
+    admission_min_limit: int = 4
+    admission_shares: dict[str, float] = {"write": 1.0, "read": 0.75, "analytics": 0.25}
+    admission_queue_sizes: dict[str, int] = {"write": 200, "read": 100, "analytics": 20}
+    admission_queue_timeout: float = 1.0
+    admission_retry_after: int = 1
+    admission_route_classes: dict[str, str] = {
+        "/orders/clients/statistics": "analytics",
+        "/analytics/": "analytics",
+    }
+    # Подстройка лимита: интервал, сек, целевая задержка SQL-запроса и ожидания
+    # соединения пула, мс, и множитель уменьшения лимита при её превышении
+    admission_adjust_interval: float = 0.5
+    admission_db_latency_target_ms: float = 50.0
+    admission_decrease_factor: float = 0.8
+
+    # Период обновления материализованного топа товаров, сек (0 — не обновлять)
+    top_products_refresh_interval: float = 60.0
+
+    # Период перебалансировки шардов остатка «горячих» товаров, сек (0 — не выполнять)
+    stock_rebalance_interval: float = 30.0
+
+    # Потребитель outbox order_events в приложении: пауза между проходами по
+    # очереди, сек (0 — не запускать, например при отдельном python -m app.worker),
+    # и сколько событий применяется одной транзакцией
+    order_events_interval: float = 1.0
+    order_events_batch_size: int = 1000
+
+    # Месячные партиции orders/order_items: сколько месяцев создавать вперёд, через
+    # сколько месяцев отключать старые в схему order_archive (0 — не отключать) и
+    # период проверки, сек (0 — не выполнять)
+    order_partition_months_ahead: int = 3
+    order_partition_retention_months: int = 0
+    order_partition_interval: float = 3600.0
+
+    # Кэш дерева категорий в памяти процесса (инвалидация через LISTEN/NOTIFY)
+    category_tree_cache_enabled: bool = True
+    category_tree_poll_interval: float = 30.0
+
+    # Рейтинг продаж в памяти процесса для /catalog/top-products (app.sales_ranking):
+    # период забора изменённых пятиминутных продаж и полной перезагрузки, сек
+    sales_ranking_enabled: bool = True
+    sales_ranking_sync_interval: float = 2.0
+    sales_ranking_reload_interval: float = 600.0
+
+    # Колоночный снимок позиций заказов для /analytics/* (app.analytics, нужен numpy):
+    # период перестроения, сек (0 — не строить), и каталог файлов снимка, общих для
+    # воркеров через mmap (пусто — снимок в памяти каждого воркера)
+    analytics_snapshot_interval: float = 0.0
+    analytics_snapshot_dir: str = ""
+
+    # Кэш ответов аналитических эндпоинтов (см. app.cache.responses): memory, redis
+    # или none; TTL свежего ответа по маршруту, сек, и сколько ещё отдавать устаревший
+    cache_backend: Literal["memory", "redis", "none"] = "memory"
+    cache_redis_url: str = "redis://localhost:6379/0"
+    cache_max_entries: int = 10_000
+    cache_ttls: dict[str, float] = {
+        "top_products": 30.0,
+        "clients_statistics": 5.0,
+        "children_count": 60.0,
+    }
+    cache_stale_ttl: float = 30.0
+
+    # Сериализация списков без Pydantic-моделей на строку (orjson, если установлен)
+    fast_serialization: bool = False
+
+    # Размер пачки строк при потоковой выдаче списков (курсор на стороне сервера)
+    stream_batch_size: int = 1000
+
+    # Время SQL в заголовке Server-Timing и статистика запросов на HTTP-запрос
+    sql_timing_enabled: bool = True
+    # Порог журнала медленных запросов, мс (0 — не писать); EXPLAIN ANALYZE читающих
+    slow_query_threshold_ms: float = 500.0
+    slow_query_explain: bool = False
+
+    # Логирование через очередь и фоновый поток (см. app.logging_config)
+    log_level: str = "INFO"
+    log_levels: dict[str, str] = {}
+    log_format: Literal["text", "json"] = "text"
+    log_queue_size: int = 10_000
+    # Доля записываемых INFO-логов отдельных транзакций (логгер app.transactions)
+    log_transaction_sample_rate: float = 1.0
+
+    # Метрики Prometheus (GET /metrics); каталог mmap-файлов для нескольких воркеров
+    metrics_enabled: bool = True
+    metrics_dir: str = ""
+
+    @property
+    def async_database_url(self) -> str:
+        """URL БД с асинхронным драйвером asyncpg.
+
+        В `.env` остаётся синхронный URL (его использует Alembic и скрипты),
+        драйвер для приложения подменяется на `asyncpg`.
+        """
+
+        return to_async_url(self.database_url)
+
 
 settings = Sessings()
@@ -0,0 +1,197 @@
+"""Фоновые периодические задачи, запускаемые в lifespan приложения."""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timezone
+
+from app.cache.responses import api_cache
+from app.db import SessionLocal, engine
+from app.repositories.catalog import refresh_top_products
+from app.metrics import order_event_lag, order_events_applied
+from app.repositories.idempotency import purge_idempotency_keys
+from app.repositories.order_events import apply_order_events
+from app.repositories.partitions import maintain_order_partitions
+from app.repositories.stock_shards import (
+    list_sharded_product_ids,
+    rebalance_product_stock,
+)
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Ключей идемпотентности, удаляемых одной транзакцией
+IDEMPOTENCY_PURGE_BATCH = 10_000
+
+
+async def run_periodically(
+    name: str, interval: float, job: Callable[[], Awaitable[object]]
+) -> None:
+    """Выполняет `job` каждые `interval` секунд до отмены задачи.
+
+    Ошибка одного запуска логируется и не останавливает расписание.
+    """
+
+    while True:
+        try:
+            await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Фоновая задача %s завершилась с ошибкой", name)
+        await asyncio.sleep(interval)
+
+
+async def refresh_top_products_job() -> None:
+    """Обновляет материализованный топ товаров за 30 дней."""
+
+    async with SessionLocal() as session:
+        if await refresh_top_products(
+            session, min_interval=settings.top_products_refresh_interval
+        ):
+            api_cache.invalidate("top_products")
+            logger.info("Обновлён топ товаров за 30 дней")
+
+
+async def rebalance_stock_shards_job() -> None:
+    """Выравнивает шарды остатка каждого шардированного товара.
+
+    Каждый товар перебалансируется отдельной короткой транзакцией, чтобы не
+    держать блокировки шардов всех товаров одновременно.
+    """
+
+    async with SessionLocal() as session, session.begin():
+        product_ids = await list_sharded_product_ids(session)
+    for product_id in product_ids:
+        async with SessionLocal() as session, session.begin():
+            if await rebalance_product_stock(session, product_id):
+                logger.info("Перебалансированы шарды остатка товара %s", product_id)
+
+
+async def apply_order_events_job(batch_size: int | None = None) -> int:
+    """Применяет накопленные события outbox `order_events` к агрегатам.
+
+    Очередь разбирается пачками по отдельной короткой транзакции, пока пачка
+    заполняется целиком.
+
+    Args:
+        batch_size: Событий в пачке (по умолчанию `ORDER_EVENTS_BATCH_SIZE`).
+
+    Returns:
+        int: Число применённых событий.
+    """
+
+    batch_size = batch_size or settings.order_events_batch_size
+    total = 0
+    while True:
+        async with SessionLocal() as session, session.begin():
+            applied = await apply_order_events(session, batch_size)
+        if applied.events:
+            order_events_applied.inc(applied.events)
+            order_event_lag.observe(applied.lag)
+            logger.debug(
+                "Применено событий заказов: %s, задержка %.2f с",
+                applied.events,
+                applied.lag,
+            )
+        total += applied.events
+        if applied.events < batch_size:
+            return total
+
+
+async def purge_idempotency_keys_job() -> None:
+    """Удаляет истёкшие ключи идемпотентности пачками по отдельной транзакции."""
+
+    total = 0
+    while True:
+        async with SessionLocal() as session, session.begin():
+            deleted = await purge_idempotency_keys(session, IDEMPOTENCY_PURGE_BATCH)
+        total += deleted
+        if deleted < IDEMPOTENCY_PURGE_BATCH:
+            break
+    if total:
+        logger.info("Удалено истёкших ключей идемпотентности: %s", total)
+
+
+async def maintain_order_partitions_job() -> None:
+    """Создаёт партиции заказов на месяцы вперёд и архивирует устаревшие."""
+
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        result = await maintain_order_partitions(
+            conn,
+            datetime.now(timezone.utc).date(),
+            settings.order_partition_months_ahead,
+            settings.order_partition_retention_months,
+        )
+    if result is None:
+        return
+    if result.created:
+        logger.info("Создано партиций заказов: %s", result.created)
+    if result.archived:
+        logger.info(
+            "Партиции заказов перенесены в архив: %s", ", ".join(result.archived)
+        )
+
+
+def start_background_tasks() -> list[asyncio.Task]:
+    """Запускает периодические задачи приложения.
+
+    Returns:
+        list[asyncio.Task]: Запущенные задачи для остановки в `stop_background_tasks`.
+    """
+
+    jobs: list[tuple[str, float, Callable[[], Awaitable[object]]]] = []
+    if settings.top_products_refresh_interval > 0:
+        jobs.append(
+            (
+                "refresh_top_products",
+                settings.top_products_refresh_interval,
+                refresh_top_products_job,
+            )
+        )
+    if settings.stock_rebalance_interval > 0:
+        jobs.append(
+            (
+                "rebalance_stock_shards",
+                settings.stock_rebalance_interval,
+                rebalance_stock_shards_job,
+            )
+        )
+    if settings.order_events_interval > 0:
+        jobs.append(
+            (
+                "apply_order_events",
+                settings.order_events_interval,
+                apply_order_events_job,
+            )
+        )
+    if settings.idempotency_purge_interval > 0:
+        jobs.append(
+            (
+                "purge_idempotency_keys",
+                settings.idempotency_purge_interval,
+                purge_idempotency_keys_job,
+            )
+        )
+    if settings.order_partition_interval > 0:
+        jobs.append(
+            (
+                "maintain_order_partitions",
+                settings.order_partition_interval,
+                maintain_order_partitions_job,
+            )
+        )
+
+    return [
+        asyncio.create_task(run_periodically(name, interval, job), name=name)
+        for name, interval, job in jobs
+    ]
+
+
+async def stop_background_tasks(tasks: list[asyncio.Task]) -> None:
+    """Отменяет фоновые задачи и дожидается их завершения."""
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,11 +1,13 @@
 
-from sqlalchemy import Table, Column, String, Integer, MetaData
+from sqlalchemy import Table, Column, String, Integer, BigInteger, MetaData
 
 metadata = MetaData()
 
-v_top5_products_last_30_days = Table(
-    "v_top5_products_last_30_days",
+mv_top_products_last_30_days = Table(
+    "mv_top_products_last_30_days",
     metadata,
+    Column("rank", BigInteger),
+    Column("product_id", BigInteger),
     Column("product_name", String),
     Column("category_level1", String),
     Column("total_sold_qty", Integer),
@@ -0,0 +1,71 @@
+"""Отдельный процесс потребителя outbox `order_events`.
+
+    python -m app.worker [--interval 1.0] [--batch-size 1000]
+
+Применяет события к агрегатам так же, как фоновая задача приложения; если
+события разбирает отдельный воркер, задачу в приложении можно выключить
+(`ORDER_EVENTS_INTERVAL=0`). Несколько воркеров делят очередь без ожидания
+(`FOR UPDATE SKIP LOCKED`). С `METRICS_DIR` метрики воркера видны в `/metrics`
+приложения.
+"""
+
+import argparse
+import asyncio
+import logging
+from functools import partial
+
+from app.db import SessionLocal, engine
+from app.logging_config import setup_logging
+from app.metrics import REGISTRY
+from app.repositories.order_events import get_order_events_backlog
+from app.settings import settings
+from app.tasks import apply_order_events_job, run_periodically
+
+logger = logging.getLogger(__name__)
+
+
+async def run(interval: float, batch_size: int) -> None:
+    REGISTRY.open(settings.metrics_dir)
+    try:
+        async with SessionLocal() as session:
+            backlog = await get_order_events_backlog(session)
+        logger.info(
+            "Потребитель order_events запущен: в очереди %s событий, "
+            "самому старому %.1f с",
+            backlog.events,
+            backlog.lag,
+        )
+        await run_periodically(
+            "apply_order_events",
+            interval,
+            partial(apply_order_events_job, batch_size),
+        )
+    finally:
+        await engine.dispose()
+        REGISTRY.close()
+
+
+def cli(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=settings.order_events_interval or 1.0,
+        help="пауза между проходами по очереди, сек",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=settings.order_events_batch_size,
+        help="событий в одной транзакции",
+    )
+    args = parser.parse_args(argv)
+    setup_logging()
+    try:
+        asyncio.run(run(args.interval, args.batch_size))
+    except KeyboardInterrupt:
+        pass
+
+
+if "__main__" == __name__:
+    cli()
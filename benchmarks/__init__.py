@@ -0,0 +1 @@
+"""Бенчмарки Trade Tree: нагрузочные сценарии против локальной PostgreSQL."""
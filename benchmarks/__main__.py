@@ -0,0 +1,5 @@
+"""python -m benchmarks — полный прогон эндпоинтов (см. `benchmarks.suite`)."""
+
+from benchmarks.suite import cli
+
+cli()
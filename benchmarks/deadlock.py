@@ -0,0 +1,211 @@
+"""Взаимные блокировки двух многотоварных заказов и их повтор.
+
+Пары воркеров конкурентно списывают по единице двух товаров, блокируя строки в
+противоположном порядке (`a, b` и `b, a`) с паузой `--hold` между ними, — так
+PostgreSQL гарантированно находит deadlock и прерывает одну из транзакций с
+SQLSTATE 40P01. Транзакции выполняются через `run_in_transaction`
+(`app.services.unit_of_work`) в двух режимах:
+
+- `no_retry` — одна попытка: прерванная транзакция считается ошибкой;
+- `retry` — повтор с задержкой по настройкам `TX_RETRY_*`.
+
+Сводка режима: пропускная способность и задержка выполненных транзакций,
+ошибки по типу, число повторов и deadlock по `pg_stat_database`. По умолчанию
+PostgreSQL ищет deadlock через `deadlock_timeout` (1 с) ожидания; с правами
+суперпользователя его можно уменьшить для транзакций бенчмарка
+(`--deadlock-timeout-ms`).
+
+Бенчмарк пишет в БД: списывает остатки товаров `1..2 * --pairs` и по окончании
+возвращает их. Запускать на засеянной локальной БД:
+
+    python -m benchmarks.deadlock --pairs 4 --duration 10 --deadlock-timeout-ms 50
+
+Прогон с режимом `retry` служит и проверкой повтора: код выхода `1`, если до
+вызывающего дошла ошибка 40P01/40001 или `TransactionConflictError` (повтор не
+справился) или если PostgreSQL не зафиксировал ни одного deadlock (сценарий не
+воспроизвёлся, проверять нечего). Причины печатаются в stderr после сводки.
+
+    python -m benchmarks.deadlock --modes retry --duration 5 --deadlock-timeout-ms 50
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import Counter
+
+from sqlalchemy import text
+
+from app.db import SessionLocal, engine
+from app.metrics import transaction_conflicts, transaction_retries
+from app.repositories.orders import decrement_stock
+from app.services.unit_of_work import (
+    RetryPolicy,
+    TransactionConflictError,
+    retryable_sqlstate,
+    run_in_transaction,
+)
+from benchmarks.stats import summarize
+
+MODES = ("no_retry", "retry")
+
+# Имя операции в метриках и логах unit of work
+OPERATION = "deadlock_bench"
+
+SQL_DEADLOCKS = text(
+    "select deadlocks from pg_stat_database where datname = current_database()"
+)
+
+for _reason in ("deadlock", "serialization"):
+    transaction_retries.register_labels(OPERATION, _reason)
+    transaction_conflicts.register_labels(OPERATION, _reason)
+
+
+async def read_deadlocks() -> int:
+    async with SessionLocal() as session:
+        return (await session.execute(SQL_DEADLOCKS)).scalar_one()
+
+
+async def run_mode(
+    mode: str,
+    product_ids: list[int],
+    duration: float,
+    hold: float,
+    deadlock_timeout_ms: int | None,
+) -> dict:
+    """Нагружает пары воркеров в заданном режиме и возвращает сводку."""
+
+    policy = RetryPolicy.from_settings()
+    if mode == "no_retry":
+        policy = RetryPolicy(attempts=1, base_delay=0, max_delay=0, budget=0)
+
+    latencies: list[float] = []
+    errors: Counter = Counter()
+    # конфликты (40P01/40001), дошедшие до вызывающего
+    conflicts = 0
+    attempts = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(order: tuple[int, int]) -> None:
+        nonlocal attempts, conflicts
+        async with SessionLocal() as session:
+
+            async def work() -> None:
+                nonlocal attempts
+                attempts += 1
+                if deadlock_timeout_ms is not None:
+                    await session.execute(
+                        text(f"set local deadlock_timeout = {int(deadlock_timeout_ms)}")
+                    )
+                for i, product_id in enumerate(order):
+                    if i:
+                        await asyncio.sleep(hold)
+                    await decrement_stock(session, {product_id: 1})
+
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    await run_in_transaction(
+                        session, work, operation=OPERATION, policy=policy
+                    )
+                except TransactionConflictError as exc:
+                    conflicts += 1
+                    errors[exc.sqlstate] += 1
+                    continue
+                except Exception as exc:
+                    sqlstate = retryable_sqlstate(exc)
+                    if sqlstate is not None:
+                        conflicts += 1
+                    errors[sqlstate or type(exc).__name__] += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+    pairs = list(zip(product_ids[::2], product_ids[1::2]))
+    deadlocks = await read_deadlocks()
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(worker((a, b)) for a, b in pairs),
+        *(worker((b, a)) for a, b in pairs),
+    )
+    summary = summarize(latencies, errors, time.perf_counter() - started)
+    summary["retries"] = attempts - len(latencies) - sum(errors.values())
+    summary["deadlocks"] = await read_deadlocks() - deadlocks
+    summary["conflicts"] = conflicts
+    return summary
+
+
+def check(report: dict) -> list[str]:
+    """Проверяет режим `retry`: причины провала (пустой список — успех)."""
+
+    summary = report["results"].get("retry")
+    if summary is None:
+        return []
+    failures = []
+    if summary["conflicts"]:
+        failures.append(
+            f"retry: {summary['conflicts']} конфликтов 40P01/40001 дошли до вызывающего"
+        )
+    if not summary["deadlocks"]:
+        failures.append("retry: deadlock не воспроизведён (pg_stat_database.deadlocks = 0)")
+    return failures
+
+
+async def main(args: argparse.Namespace) -> dict:
+    async with SessionLocal() as session:
+        rows = (
+            await session.execute(
+                text("select id, stock_qty from products order by id limit :count"),
+                {"count": 2 * args.pairs},
+            )
+        ).all()
+    original_stock = {row.id: row.stock_qty for row in rows}
+
+    results = {}
+    try:
+        for mode in args.modes:
+            results[mode] = await run_mode(
+                mode,
+                list(original_stock),
+                args.duration,
+                args.hold,
+                args.deadlock_timeout_ms,
+            )
+    finally:
+        async with SessionLocal() as session, session.begin():
+            for product_id, stock in original_stock.items():
+                await session.execute(
+                    text("update products set stock_qty = :stock where id = :id"),
+                    {"stock": stock, "id": product_id},
+                )
+        await engine.dispose()
+
+    return {
+        "benchmark": "deadlock",
+        "pairs": args.pairs,
+        "duration_s": args.duration,
+        "hold_s": args.hold,
+        "deadlock_timeout_ms": args.deadlock_timeout_ms,
+        "results": results,
+    }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pairs", type=int, default=4, help="пар встречных заказов")
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд на режим")
+    parser.add_argument(
+        "--hold", type=float, default=0.01, help="пауза между блокировками, сек"
+    )
+    parser.add_argument("--deadlock-timeout-ms", type=int, default=None)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    return parser.parse_args(argv)
+
+
+if "__main__" == __name__:
+    report = asyncio.run(main(parse_args()))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    failures = check(report)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,231 @@
+"""Конкурентное добавление в заказы одного «горячего» товара.
+
+Сравнивает режимы `STOCK_RESERVATION_MODE`, шардированный остаток (`sharded`:
+остаток товара разделён на `--shards` строк `product_stock_shards`) и групповую
+фиксацию (`grouped`: запросы за `--group-window` секунд выполняются одной
+транзакцией, `ADD_ITEM_GROUP_COMMIT_WINDOW`): воркеры в
+течение заданного времени добавляют по единице одного товара в собственные
+заказы через `POST /orders/{order_id}/items`. Приложение вызывается in-process через ASGI,
+поэтому измеряется полный путь запроса, включая работу с пулом и блокировками.
+
+Бенчмарк пишет в БД: создаёт заказы и поднимает остаток товара, а по окончании
+удаляет заказы и возвращает остаток и суточные продажи. Запускать на засеянной
+локальной БД, размер пула должен быть не меньше конкурентности:
+
+    DB_POOL_SIZE=64 python -m benchmarks.hot_sku --product-id 1 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+import httpx
+from sqlalchemy import text
+
+from app.db import SessionLocal, engine
+from app.main import app
+from app.repositories.stock_shards import (
+    shard_product_stock,
+    sharded_products,
+    unshard_product_stock,
+)
+from app.settings import settings
+from app.tasks import apply_order_events_job
+from benchmarks.stats import summarize
+
+MODES = ("locking", "atomic", "sharded", "grouped")
+
+# Остаток на время прогона, чтобы ответы 409 не искажали пропускную способность
+HOT_STOCK = 1_000_000_000
+
+
+@asynccontextmanager
+async def hot_sku_orders(
+    product_id: int, count: int, shards: int = 0
+) -> AsyncIterator[list[int]]:
+    """Создаёт `count` заказов и поднимает остаток товара; откатывает после прогона.
+
+    При `shards > 0` остаток товара на время прогона делится на шарды.
+    """
+
+    async with SessionLocal() as session, session.begin():
+        original_stock = (
+            await session.execute(
+                text("select stock_qty from products where id = :id for update"),
+                {"id": product_id},
+            )
+        ).scalar_one()
+        await session.execute(
+            text("update products set stock_qty = :stock where id = :id"),
+            {"stock": HOT_STOCK, "id": product_id},
+        )
+        if shards:
+            await shard_product_stock(session, product_id, shards)
+        order_ids = (
+            await session.execute(
+                # заказы разных клиентов, чтобы не упираться в одну строку customer_totals
+                text(
+                    """
+                    insert into orders (customer_id, status)
+                    select c.ids[1 + (n - 1) % cardinality(c.ids)], 'bench'
+                    from generate_series(1, :count) n,
+                         (select array(select id from customers order by id limit :count)
+                             as ids) c
+                    returning id
+                    """
+                ),
+                {"count": count},
+            )
+        ).scalars().all()
+
+    try:
+        yield list(order_ids)
+    finally:
+        # продажи откатываются после применения всех событий сценария
+        await apply_order_events_job()
+        async with SessionLocal() as session, session.begin():
+            params = {"ids": list(order_ids), "product_id": product_id}
+            await session.execute(
+                text(
+                    """
+                    update product_sales_daily psd
+                    set sold_qty = psd.sold_qty - s.qty
+                    from (select (oi.order_created_at at time zone 'UTC')::date as day,
+                                 sum(oi.qty) as qty
+                          from order_items oi
+                          where oi.order_id = any(:ids)
+                            and oi.product_id = :product_id
+                          group by day) s
+                    where psd.product_id = :product_id
+                      and psd.day = s.day
+                    """
+                ),
+                params,
+            )
+            await session.execute(
+                text(
+                    """
+                    update product_sales_buckets b
+                    set sold_qty = b.sold_qty - s.qty,
+                        updated_at = now()
+                    from (select date_bin('5 minutes', oi.order_created_at,
+                                          timestamptz '2000-01-01 00:00:00+00')
+                                     as bucket_start,
+                                 sum(oi.qty) as qty
+                          from order_items oi
+                          where oi.order_id = any(:ids)
+                            and oi.product_id = :product_id
+                          group by bucket_start) s
+                    where b.product_id = :product_id
+                      and b.bucket_start = s.bucket_start
+                    """
+                ),
+                params,
+            )
+            await session.execute(
+                text("delete from orders where id = any(:ids)"), params
+            )
+            if shards:
+                await unshard_product_stock(session, product_id)
+                sharded_products.discard(product_id)
+            await session.execute(
+                text("update products set stock_qty = :stock where id = :id"),
+                {"stock": original_stock, "id": product_id},
+            )
+
+
+async def run_mode(
+    client: httpx.AsyncClient,
+    mode: str,
+    order_ids: list[int],
+    product_id: int,
+    duration: float,
+    group_window: float,
+) -> dict:
+    """Нагружает эндпоинт в заданном режиме списания и возвращает сводку."""
+
+    # шардированный остаток списывается одинаково в обоих режимах, а групповая
+    # транзакция не зависит от режима списания
+    settings.stock_reservation_mode = "locking" if mode == "locking" else "atomic"
+    settings.add_item_group_commit_window = group_window if mode == "grouped" else 0
+    latencies: list[float] = []
+    errors: Counter = Counter()
+    deadline = time.perf_counter() + duration
+
+    async def worker(order_id: int) -> None:
+        url = f"{settings.api_prefix}/orders/{order_id}/items"
+        body = {"product_id": product_id, "quantity": 1}
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, json=body)
+            except Exception as exc:
+                errors[type(exc).__name__] += 1
+                continue
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors[response.status_code] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(order_id) for order_id in order_ids))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def main(args: argparse.Namespace) -> dict:
+    if settings.db_pool_size + settings.db_max_overflow < args.concurrency:
+        print(
+            "warning: пул соединений меньше конкурентности, "
+            "результат будет ограничен ожиданием пула"
+        )
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for mode in args.modes:
+            shards = args.shards if mode == "sharded" else 0
+            async with hot_sku_orders(
+                args.product_id, args.concurrency, shards
+            ) as order_ids:
+                results[mode] = await run_mode(
+                    client,
+                    mode,
+                    order_ids,
+                    args.product_id,
+                    args.duration,
+                    args.group_window,
+                )
+    await engine.dispose()
+    return {
+        "benchmark": "hot_sku",
+        "product_id": args.product_id,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "shards": args.shards,
+        "group_window_s": args.group_window,
+        "results": results,
+    }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--product-id", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд на режим")
+    parser.add_argument("--shards", type=int, default=16, help="шардов в режиме sharded")
+    parser.add_argument(
+        "--group-window",
+        type=float,
+        default=0.002,
+        help="окно сбора группы в режиме grouped, сек",
+    )
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    return parser.parse_args(argv)
+
+
+if "__main__" == __name__:
+    print(json.dumps(asyncio.run(main(parse_args())), ensure_ascii=False, indent=2))
@@ -0,0 +1,135 @@
+"""Сериализация списков: `response_model` против быстрого пути (`FAST_SERIALIZATION`).
+
+Два сценария, каждый в обоих режимах:
+- `synthetic` — отдельное приложение с одним эндпоинтом, возвращающим `--rows`
+  строк статистики клиентов из памяти: измеряется только стоимость сериализации;
+- `endpoints` — читающие эндпоинты каталога на текущей БД.
+
+Запросы идут in-process через ASGI; БД только читается:
+
+    python -m benchmarks.serialization --rows 10000 --concurrency 8 --duration 5
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from decimal import Decimal
+
+import httpx
+from fastapi import FastAPI, Response
+
+from app.api.catalog.schemas import ClientStatistics
+from app.api.pagination import page_response
+from app.api.serialization import orjson
+from app.db import engine
+from app.main import app
+from app.settings import settings
+from benchmarks.stats import summarize
+
+MODES = {"response_model": False, "fast": True}
+
+ENDPOINTS = (
+    "/orders/clients/statistics?limit=1000",
+    "/categories/children-count",
+    "/categories/1/subtree",
+    "/catalog/top-products",
+)
+
+
+def synthetic_app(rows: int) -> FastAPI:
+    """Приложение с одним списком из `rows` строк без обращения к БД."""
+
+    data = [
+        {"customer_id": i, "name": f"Клиент {i}", "total_amount": Decimal(i) * 100}
+        for i in range(rows)
+    ]
+    bench_app = FastAPI()
+
+    @bench_app.get("/rows", response_model=list[ClientStatistics])
+    async def get_rows(response: Response):
+        return page_response(ClientStatistics, data, response)
+
+    return bench_app
+
+
+async def drive(
+    client: httpx.AsyncClient, urls: list[str], concurrency: int, duration: float
+) -> dict:
+    """Гоняет `concurrency` воркеров по кругу по `urls` и возвращает сводку."""
+
+    latencies: list[float] = []
+    errors: Counter = Counter()
+    deadline = time.perf_counter() + duration
+
+    async def worker(offset: int) -> None:
+        n = offset
+        while time.perf_counter() < deadline:
+            url = urls[n % len(urls)]
+            n += 1
+            started = time.perf_counter()
+            try:
+                response = await client.get(url)
+            except Exception as exc:
+                errors[type(exc).__name__] += 1
+                continue
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors[response.status_code] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def run_scenario(
+    asgi_app: FastAPI, urls: list[str], args: argparse.Namespace
+) -> dict:
+    results = {}
+    transport = httpx.ASGITransport(app=asgi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for mode in args.modes:
+            settings.fast_serialization = MODES[mode]
+            results[mode] = await drive(client, urls, args.concurrency, args.duration)
+    return results
+
+
+async def main(args: argparse.Namespace) -> dict:
+    results = {}
+    if "synthetic" in args.scenarios:
+        results["synthetic"] = await run_scenario(
+            synthetic_app(args.rows), ["/rows"], args
+        )
+    if "endpoints" in args.scenarios:
+        urls = [settings.api_prefix + url for url in ENDPOINTS]
+        results["endpoints"] = await run_scenario(app, urls, args)
+    await engine.dispose()
+    return {
+        "benchmark": "serialization",
+        "orjson": orjson is not None,
+        "rows": args.rows,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "results": results,
+    }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000, help="строк в synthetic")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0, help="секунд на режим")
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        choices=("synthetic", "endpoints"),
+        default=["synthetic", "endpoints"],
+    )
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    return parser.parse_args(argv)
+
+
+if "__main__" == __name__:
+    print(json.dumps(asyncio.run(main(parse_args())), ensure_ascii=False, indent=2))
@@ -0,0 +1,41 @@
+"""Сводная статистика прогонов бенчмарков."""
+
+import math
+from collections import Counter
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Перцентиль `q` (0..100) по отсортированной выборке методом nearest-rank."""
+
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(
+    latencies: list[float], errors: Counter, elapsed: float
+) -> dict[str, float | int | dict]:
+    """Собирает пропускную способность, перцентили задержки и ошибки прогона.
+
+    Args:
+        latencies: Длительности успешных запросов, сек.
+        errors: Число неуспешных запросов по коду ответа или типу ошибки.
+        elapsed: Длительность прогона, сек.
+    """
+
+    ordered = sorted(latencies)
+    total = len(ordered) + sum(errors.values())
+    return {
+        "requests": total,
+        "ok": len(ordered),
+        "throughput_rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(ordered, 50) * 1000, 2),
+            "p95": round(percentile(ordered, 95) * 1000, 2),
+            "p99": round(percentile(ordered, 99) * 1000, 2),
+            "max": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        },
+        "error_rate": round(sum(errors.values()) / total, 4) if total else 0.0,
+        "errors": {str(key): count for key, count in errors.items()},
+    }
@@ -0,0 +1,455 @@
+"""Нагрузочный прогон всех эндпоинтов каталога с отчётом в JSON.
+
+Для каждого масштаба из `--scales` база пересоздаётся `app.seed` (без `--scales`
+используются текущие данные), затем каждый сценарий в течение `--duration`
+секунд нагружается `--concurrency` воркерами. Приложение вызывается in-process
+через ASGI вместе с lifespan (кэш дерева категорий, фоновые задачи).
+
+Сценарии чтения: статистика клиентов, дочерние категории, предки листовой
+и поддерево корневой категории, топ товаров. Сценарии записи: добавление в
+заказы одного «горячего» товара (`add_item_hot`), случайных товаров
+(`add_item_spread`) и пакета случайных товаров (`add_items_batch`); каждый
+воркер пишет в собственный заказ. После сценария записи заказы удаляются,
+остатки и суточные продажи возвращаются.
+
+В отчёте по сценарию: пропускная способность, перцентили задержки, доля ошибок
+по кодам ответа и время ожидания блокировок в PostgreSQL — сумма по выборкам
+`pg_stat_activity` (бэкенды с `wait_event_type = 'Lock'`, умноженные на период
+выборки), а также число deadlock за прогон. Отчёты разных коммитов сравнимы
+при одинаковых `--scales`, `--seed` и параметрах нагрузки:
+
+    python -m benchmarks --scales 0.1 1 --concurrency 16 --duration 10 --output bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from collections import Counter
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager, redirect_stdout
+from dataclasses import dataclass
+from random import Random
+
+import asyncpg
+import httpx
+from sqlalchemy import text
+
+from app import seed
+from app.db import SessionLocal, asyncpg_dsn
+from app.main import app
+from app.settings import BASE_DIR, settings
+from app.tasks import apply_order_events_job
+from benchmarks.stats import summarize
+
+# Остаток «горячего» товара на время прогона, чтобы ответы 409 не искажали результат
+HOT_STOCK = 1_000_000_000
+
+SQL_LOCK_WAITERS = """
+    select count(*)
+    from pg_stat_activity
+    where datname = current_database()
+      and wait_event_type = 'Lock'
+      and pid <> pg_backend_pid()
+"""
+
+SQL_DEADLOCKS = "select deadlocks from pg_stat_database where datname = current_database()"
+
+# Откат записей сценария: продажи и остатки возвращаются по позициям заказов
+SQL_RESTORE_SALES = text(
+    """
+    update product_sales_daily psd
+    set sold_qty = psd.sold_qty - s.qty
+    from (select oi.product_id,
+                 (oi.order_created_at at time zone 'UTC')::date as day,
+                 sum(oi.qty) as qty
+          from order_items oi
+          where oi.order_id = any(:ids)
+          group by oi.product_id,
+                   day) s
+    where psd.product_id = s.product_id
+      and psd.day = s.day
+    """
+)
+
+SQL_RESTORE_SALES_BUCKETS = text(
+    """
+    update product_sales_buckets b
+    set sold_qty = b.sold_qty - s.qty,
+        updated_at = now()
+    from (select oi.product_id,
+                 date_bin('5 minutes', oi.order_created_at,
+                          timestamptz '2000-01-01 00:00:00+00') as bucket_start,
+                 sum(oi.qty) as qty
+          from order_items oi
+          where oi.order_id = any(:ids)
+          group by oi.product_id,
+                   bucket_start) s
+    where b.product_id = s.product_id
+      and b.bucket_start = s.bucket_start
+    """
+)
+
+SQL_RESTORE_STOCK = text(
+    """
+    update products p
+    set stock_qty = p.stock_qty + s.qty
+    from (select product_id, sum(qty) as qty
+          from order_items
+          where order_id = any(:ids)
+          group by product_id) s
+    where p.id = s.product_id
+      and p.stock_shards = 0
+    """
+)
+
+
+@dataclass(frozen=True)
+class Catalog:
+    """id из текущих данных, по которым сценарии строят запросы."""
+
+    root_ids: list[int]
+    leaf_ids: list[int]
+    max_product_id: int
+    hot_product_id: int
+
+
+# Запрос сценария: (метод, путь без префикса API, тело) по генератору воркера и его заказу
+RequestFactory = Callable[[Random, Catalog, int | None], tuple[str, str, object]]
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    request: RequestFactory
+    writes: bool = False
+
+
+def _random_products(rng: Random, catalog: Catalog, count: int) -> list[int]:
+    return rng.sample(range(1, catalog.max_product_id + 1), count)
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in (
+        Scenario(
+            "clients_statistics",
+            lambda rng, c, order_id: ("GET", "/orders/clients/statistics?limit=100", None),
+        ),
+        Scenario(
+            "children_count",
+            lambda rng, c, order_id: ("GET", "/categories/children-count", None),
+        ),
+        Scenario(
+            "category_ancestors",
+            lambda rng, c, order_id: (
+                "GET", f"/categories/{rng.choice(c.leaf_ids)}/ancestors", None
+            ),
+        ),
+        Scenario(
+            "category_subtree",
+            lambda rng, c, order_id: (
+                "GET", f"/categories/{rng.choice(c.root_ids)}/subtree", None
+            ),
+        ),
+        Scenario(
+            "top_products",
+            lambda rng, c, order_id: ("GET", "/catalog/top-products", None),
+        ),
+        Scenario(
+            "add_item_hot",
+            lambda rng, c, order_id: (
+                "POST",
+                f"/orders/{order_id}/items",
+                {"product_id": c.hot_product_id, "quantity": 1},
+            ),
+            writes=True,
+        ),
+        Scenario(
+            "add_item_spread",
+            lambda rng, c, order_id: (
+                "POST",
+                f"/orders/{order_id}/items",
+                {"product_id": _random_products(rng, c, 1)[0], "quantity": 1},
+            ),
+            writes=True,
+        ),
+        Scenario(
+            "add_items_batch",
+            lambda rng, c, order_id: (
+                "POST",
+                f"/orders/{order_id}/items:batch",
+                [
+                    {"product_id": product_id, "quantity": 1}
+                    for product_id in _random_products(rng, c, 5)
+                ],
+            ),
+            writes=True,
+        ),
+    )
+}
+
+
+async def load_catalog(hot_product_id: int) -> Catalog:
+    async with SessionLocal() as session:
+        root_ids = (
+            await session.execute(
+                text("select id from categories where parent_id is null order by id")
+            )
+        ).scalars().all()
+        leaf_ids = (
+            await session.execute(
+                text(
+                    """
+                    select c.id
+                    from categories c
+                    where not exists (select 1 from categories ch where ch.parent_id = c.id)
+                    order by c.id
+                    """
+                )
+            )
+        ).scalars().all()
+        max_product_id = (
+            await session.execute(text("select max(id) from products"))
+        ).scalar_one()
+    if not root_ids or max_product_id is None:
+        raise SystemExit("База пуста: укажите --scales или выполните python -m app.seed")
+    return Catalog(list(root_ids), list(leaf_ids), max_product_id, hot_product_id)
+
+
+@asynccontextmanager
+async def bench_orders(count: int, hot_product_id: int) -> AsyncIterator[list[int]]:
+    """Создаёт `count` заказов разных клиентов; после прогона удаляет их и
+    возвращает остатки и суточные продажи товаров из их позиций.
+    """
+
+    async with SessionLocal() as session, session.begin():
+        original_stock = (
+            await session.execute(
+                text("select stock_qty from products where id = :id for update"),
+                {"id": hot_product_id},
+            )
+        ).scalar_one()
+        await session.execute(
+            text("update products set stock_qty = :stock where id = :id"),
+            {"stock": HOT_STOCK, "id": hot_product_id},
+        )
+        order_ids = (
+            await session.execute(
+                text(
+                    """
+                    insert into orders (customer_id, status)
+                    select c.ids[1 + (n - 1) % cardinality(c.ids)], 'bench'
+                    from generate_series(1, :count) n,
+                         (select array(select id from customers order by id limit :count)
+                             as ids) c
+                    returning id
+                    """
+                ),
+                {"count": count},
+            )
+        ).scalars().all()
+
+    try:
+        yield list(order_ids)
+    finally:
+        # продажи откатываются после применения всех событий сценария
+        await apply_order_events_job()
+        async with SessionLocal() as session, session.begin():
+            params = {"ids": list(order_ids)}
+            await session.execute(SQL_RESTORE_SALES, params)
+            await session.execute(SQL_RESTORE_SALES_BUCKETS, params)
+            await session.execute(SQL_RESTORE_STOCK, params)
+            await session.execute(text("delete from orders where id = any(:ids)"), params)
+            await session.execute(
+                text("update products set stock_qty = :stock where id = :id"),
+                {"stock": original_stock, "id": hot_product_id},
+            )
+
+
+class LockWaitSampler:
+    """Периодически считает бэкенды, ждущие блокировку, по отдельному соединению."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.lock_wait_s = 0.0
+        self.max_waiters = 0
+        self.deadlocks = 0
+        self._task: asyncio.Task | None = None
+
+    async def _sample(self, connection: asyncpg.Connection) -> None:
+        previous = time.perf_counter()
+        while True:
+            await asyncio.sleep(self.interval)
+            waiters = await connection.fetchval(SQL_LOCK_WAITERS)
+            now = time.perf_counter()
+            self.lock_wait_s += waiters * (now - previous)
+            self.max_waiters = max(self.max_waiters, waiters)
+            previous = now
+
+    @asynccontextmanager
+    async def running(self) -> AsyncIterator["LockWaitSampler"]:
+        connection = await asyncpg.connect(asyncpg_dsn())
+        try:
+            deadlocks = await connection.fetchval(SQL_DEADLOCKS)
+            self._task = asyncio.create_task(self._sample(connection))
+            try:
+                yield self
+            finally:
+                self._task.cancel()
+                await asyncio.gather(self._task, return_exceptions=True)
+            self.deadlocks = await connection.fetchval(SQL_DEADLOCKS) - deadlocks
+        finally:
+            await connection.close()
+
+    def report(self) -> dict:
+        return {
+            "lock_wait_s": round(self.lock_wait_s, 3),
+            "lock_waiters_max": self.max_waiters,
+            "deadlocks": self.deadlocks,
+        }
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    catalog: Catalog,
+    order_ids: list[int | None],
+    args: argparse.Namespace,
+) -> dict:
+    """Нагружает сценарий воркерами (по одному на заказ) и возвращает сводку."""
+
+    latencies: list[float] = []
+    errors: Counter = Counter()
+    deadline = time.perf_counter() + args.duration
+
+    async def worker(n: int, order_id: int | None) -> None:
+        rng = Random(f"{args.seed}:{scenario.name}:{n}")
+        while time.perf_counter() < deadline:
+            method, path, body = scenario.request(rng, catalog, order_id)
+            started = time.perf_counter()
+            try:
+                response = await client.request(
+                    method, settings.api_prefix + path, json=body
+                )
+            except Exception as exc:
+                errors[type(exc).__name__] += 1
+                continue
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors[response.status_code] += 1
+
+    sampler = LockWaitSampler(args.lock_sample_interval)
+    async with sampler.running():
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(n, order_id) for n, order_id in enumerate(order_ids)))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, errors, elapsed) | sampler.report()
+
+
+async def run_suite(args: argparse.Namespace) -> dict:
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with (
+        app.router.lifespan_context(app),
+        httpx.AsyncClient(transport=transport, base_url="http://bench") as client,
+    ):
+        catalog = await load_catalog(args.hot_product_id)
+        for name in args.scenarios:
+            scenario = SCENARIOS[name]
+            if not scenario.writes:
+                order_ids = [None] * args.concurrency
+                results[name] = await run_scenario(client, scenario, catalog, order_ids, args)
+                continue
+            async with bench_orders(args.concurrency, args.hot_product_id) as order_ids:
+                results[name] = await run_scenario(client, scenario, catalog, order_ids, args)
+    return results
+
+
+def current_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args: argparse.Namespace) -> dict:
+    if settings.db_pool_size + settings.db_max_overflow < args.concurrency:
+        print(
+            "warning: пул соединений меньше конкурентности, "
+            "результат будет ограничен ожиданием пула"
+        )
+
+    runs = []
+    for factor in args.scales or [None]:
+        run = {"scale": factor}
+        if factor is not None:
+            started = time.perf_counter()
+            # вывод seed не должен смешиваться с JSON-отчётом в stdout
+            with redirect_stdout(sys.stderr):
+                seed.run(
+                    seed.scaled(seed.Scale(seed=args.seed), factor),
+                    args.seed_jobs,
+                    reset=True,
+                )
+            run["seed_s"] = round(time.perf_counter() - started, 1)
+        run["results"] = asyncio.run(run_suite(args))
+        runs.append(run)
+
+    return {
+        "benchmark": "suite",
+        "commit": current_commit(),
+        "seed": args.seed,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "settings": {
+            "stock_reservation_mode": settings.stock_reservation_mode,
+            "fast_serialization": settings.fast_serialization,
+            "db_pool_size": settings.db_pool_size,
+            "db_max_overflow": settings.db_max_overflow,
+            "cache_backend": settings.cache_backend,
+            "cache_ttls": settings.cache_ttls,
+            "database_replicas": len(settings.database_replica_urls),
+        },
+        "runs": runs,
+    }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", nargs="*", type=float,
+                        help="масштабы app.seed (база пересоздаётся); без них — текущие данные")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="зерно данных seed и запросов воркеров")
+    parser.add_argument("--seed-jobs", type=int, default=1, help="процессов загрузки seed")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд на сценарий")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--hot-product-id", type=int, default=1)
+    parser.add_argument("--lock-sample-interval", type=float, default=0.01,
+                        help="период выборки ожиданий блокировок, сек")
+    parser.add_argument("--output", help="файл для JSON-отчёта (по умолчанию stdout)")
+    return parser.parse_args(argv)
+
+
+def cli(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    report = json.dumps(main(args), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report + "\n")
+    else:
+        print(report)
+
+
+if "__main__" == __name__:
+    cli()